@@ -0,0 +1,61 @@
+"""
+消息体压缩的基准测试：不同大小的订单消息在各压缩算法下的CPU耗时和节省的字节数。
+
+    python -m benchmarks.compression
+"""
+import time
+import random
+
+from sqlblock.utils.json import json_dumps
+from soybean.compression import Compression, available_codecs, decompress
+
+
+def make_order(n_items):
+    rnd = random.Random(n_items)
+    return {
+        "order_no": f"SO{rnd.randrange(10**9):09d}",
+        "customer": {"id": rnd.randrange(10**6), "name": "Tom", "level": "gold"},
+        "status": "committed",
+        "items": [{
+            "sku": f"SKU-{rnd.randrange(10**5):05d}",
+            "title": f"product title {rnd.randrange(1000)}",
+            "qty": rnd.randrange(1, 10),
+            "price": round(rnd.uniform(1, 1000), 2),
+            "tags": ["promotion", "free-shipping"][:rnd.randrange(3)],
+        } for _ in range(n_items)],
+    }
+
+
+def timeit(func, arg, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = func(arg)
+    return (time.perf_counter() - started) / rounds, result
+
+
+def main():
+    print(f"{'size':>8s} {'codec':>6s} {'bytes':>8s} {'saved':>7s} "
+          f"{'comp(us)':>9s} {'decomp(us)':>10s}")
+
+    for n_items in (2, 20, 100, 500, 2000):
+        body = json_dumps(make_order(n_items)).encode("utf-8")
+        rounds = max(10, 200000 // len(body))
+
+        for codec_name in available_codecs():
+            compression = Compression(codec_name, threshold=0)
+            elapsed, (compressed, used) = timeit(compression.compress, body,
+                                                 rounds)
+            if used is None:
+                print(f"{len(body):8d} {codec_name:>6s}  not compressible")
+                continue
+
+            decomp_elapsed, _ = timeit(
+                lambda data: decompress(data, codec_name), compressed, rounds)
+
+            saved = 1 - len(compressed) / len(body)
+            print(f"{len(body):8d} {codec_name:>6s} {len(compressed):8d} "
+                  f"{saved:7.1%} {elapsed * 1e6:9.1f} {decomp_elapsed * 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+小消息发送路径的基准测试：每次发送都构造消息(create_jsonobj_msg)与消息模板的比较。
+只测量消息的编码和构造，不经过网络。
+
+    python -m benchmarks.message_template
+"""
+import time
+
+from rocketmq.client import Message
+
+from soybean.utils import create_jsonobj_msg, encode_jsonobj_body
+from soybean.template import MessageTemplate
+
+
+TOPIC = "Order"
+TAG = "Created"
+PROPS = {"source": "benchmark", "version": "1"}
+
+
+def bench(func, messages, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for jsonobj in messages:
+            func(jsonobj)
+    count = rounds * len(messages)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    messages = [{"no": i, "amount": i * 10, "status": "created"}
+                for i in range(1000)]
+    rounds = 100
+
+    def per_send(jsonobj):
+        return create_jsonobj_msg(TOPIC, jsonobj, tag=TAG, props=PROPS)
+
+    fresh_template = MessageTemplate(TOPIC, TAG, PROPS, message_factory=Message,
+                                     reusable=False)
+
+    def fresh(jsonobj):
+        body, _ = encode_jsonobj_body(jsonobj)
+        return fresh_template.create(body)
+
+    reused_template = MessageTemplate(TOPIC, TAG, PROPS, message_factory=Message)
+
+    def reused(jsonobj):
+        body, _ = encode_jsonobj_body(jsonobj)
+        return reused_template.create(body)
+
+    print(f"{'path':<24s} {'msgs/s':>12s}")
+    for name, func in (("create_jsonobj_msg", per_send),
+                       ("template", fresh),
+                       ("template (reused)", reused)):
+        print(f"{name:<24s} {bench(func, messages, rounds):12.0f}")
+
+
+if __name__ == "__main__":
+    main()
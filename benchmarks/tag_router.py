@@ -0,0 +1,66 @@
+"""
+进程内标签路由的基准测试：编译后的路由表与逐个反应器匹配标签表达式的比较。
+
+    python -m benchmarks.tag_router
+"""
+import time
+import random
+
+from soybean.router import TagRouter, parse_tag_expression
+
+
+def naive_route(subscriptions, tag):
+    matched = []
+    for expression, target in subscriptions:
+        tags = [t.strip() for t in expression.split("||")]
+        if "*" in tags or tag in tags:
+            matched.append(target)
+    return matched
+
+
+def parsed_route(subscriptions, tag):
+    return [target for tags, target in subscriptions
+            if tags is None or tag in tags]
+
+
+def bench(func, tags, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for tag in tags:
+            func(tag)
+    return (time.perf_counter() - started) / (rounds * len(tags))
+
+
+def main():
+    rnd = random.Random(0)
+    print(f"{'subs':>6s} {'naive(us)':>10s} {'parsed(us)':>11s} {'router(us)':>11s}")
+
+    for n_subs in (10, 100, 300, 1000):
+        n_tags = n_subs * 2
+        subscriptions = []
+        for i in range(n_subs):
+            if i % 50 == 0:
+                expression = "*"
+            else:
+                expression = " || ".join(f"Tag{rnd.randrange(n_tags)}"
+                                         for _ in range(rnd.randrange(1, 4)))
+            subscriptions.append((expression, f"reactor-{i}"))
+
+        router = TagRouter()
+        for expression, target in subscriptions:
+            router.add(expression, target)
+
+        parsed = [(parse_tag_expression(e), t) for e, t in subscriptions]
+        tags = [f"Tag{rnd.randrange(n_tags)}" for _ in range(1000)]
+        rounds = max(1, 20000 // n_subs)
+
+        naive = bench(lambda tag: naive_route(subscriptions, tag), tags, rounds)
+        parsed_elapsed = bench(lambda tag: parsed_route(parsed, tag), tags, rounds)
+        routed = bench(router.route, tags, rounds)
+
+        print(f"{n_subs:6d} {naive * 1e6:10.2f} {parsed_elapsed * 1e6:11.2f} "
+              f"{routed * 1e6:11.3f}")
+
+
+if __name__ == "__main__":
+    main()
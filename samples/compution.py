@@ -44,6 +44,7 @@ async def on_result(message):
 
 async def main():
     async with domain:
+        await domain.ready(timeout=30)
         await start_computation()
         await compuation_finshed.wait()
 
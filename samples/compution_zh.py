@@ -52,6 +52,7 @@ async def on_计算(message):
 
 async def main():
     async with channel:
+        await channel.ready(timeout=30)
         await 开始计算()
         await finshed_compuation.wait()
 
@@ -23,7 +23,7 @@ async def biz_action1():
 
 async def main():
     async with channel:
-        await asyncio.sleep(1)
+        await channel.ready(timeout=30)
         await biz_action1()
 
         while True:
@@ -51,7 +51,7 @@ async def evaluate_risk(order):
 
 async def main():
     async with dbconn, channel:
-        await asyncio.sleep(0.1)
+        await channel.ready(timeout=30)
         try:
             order = {"name": "Tom"}
             order = await order_commit_action(order)
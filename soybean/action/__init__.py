@@ -1,6 +1,9 @@
 
 from ..utils import create_jsonobj_msg
 
-def make_action_msg(result, topic, tag):
+def make_action_msg(result, topic, tag, props=None,
+                    compression=None, claim_check=None):
     msg_key = None
-    return create_jsonobj_msg(topic, result, msg_key, tag)
+    return create_jsonobj_msg(topic, result, msg_key, tag, props=props,
+                              compression=compression,
+                              claim_check=claim_check)
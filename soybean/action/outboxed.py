@@ -0,0 +1,76 @@
+from ..typing import HandlerType
+from ..utils import make_group_id, encode_jsonobj_body
+from ..outbox import OutboxRecord
+from ..middleware import HandlerInfo, KIND_ACTION
+from ..logcontext import bind_context, reset_context
+
+# from ..channel import Channel
+
+
+class OutboxedAction:
+    """
+    发件箱模式的事务性动作：处理函数的结果在同一个数据库事务中插入发件箱表，
+    事务提交后由中继发送，事务内不再与broker往返。
+    """
+
+    def __init__(self,
+                 channel,
+                 handler: HandlerType,
+                 sqlblock_database,
+                 topic: str,
+                 tag: str = None,
+                 props=None,
+                 store=None,
+                 schema=None):
+
+        self._channel = channel
+        self._handler = handler
+        self._sqlblock_database = sqlblock_database
+        self._topic = topic
+        self._tag = tag
+        self._props = props
+        self._encode = schema.encode if schema is not None else None
+        self._relay = channel.get_outbox_relay(sqlblock_database, store)
+
+        self._group_id = make_group_id(channel.name, handler)
+        self._invoke = None
+
+    def compile(self):
+        """编译处理函数的中间件调用链"""
+        info = HandlerInfo(KIND_ACTION, self._group_id, self._topic,
+                           self._tag, self._handler)
+        self._invoke = self._channel.compile_handler(self._handler, info)
+
+    async def execute(self, *handler_args, **handler_kwargs):
+        if self._invoke is None:
+            self.compile()
+
+        @self._sqlblock_database.transaction
+        async def _transactional_handler():
+            coroutine = self._invoke(*handler_args, **handler_kwargs)
+            profiler = self._channel.profiler
+            if profiler is not None:
+                coroutine = profiler.run(self._group_id, coroutine)
+
+            result = await coroutine
+
+            jsonobj = result if self._encode is None else self._encode(result)
+            body, body_props = encode_jsonobj_body(jsonobj,
+                                                   self._channel.compression)
+            props = self._props
+            if body_props:
+                props = {**props, **body_props} if props else body_props
+
+            record = OutboxRecord(self._topic, self._tag, props=props, body=body)
+            await self._relay.store.insert(record)  # 与业务数据在同一事务中
+            return result
+
+        context_token = bind_context(KIND_ACTION, self._group_id,
+                                     self._topic, self._tag)
+        try:
+            ret = await _transactional_handler()
+        finally:
+            reset_context(context_token)
+
+        self._relay.notify()
+        return ret
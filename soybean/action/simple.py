@@ -1,12 +1,27 @@
+import time
+import asyncio
+import logging
 from rocketmq.client import SendStatus
-from rocketmq.client import Producer
 
 from ..typing import HandlerType
 from ..exceptions import ActionError
-from . import make_action_msg
+from ..flowcontrol import TokenBucket, ThrottleStats
+from ..flowcontrol import PRIORITY_ONLINE, check_send_priority
+from ..compression import make_compression
+from ..blobstore import ClaimCheck
+from ..utils import make_group_id, encode_jsonobj_body, create_msg
+from ..template import MessageTemplate
+from ..cache import ActionCache
+from ..scheduler import resolve_delay, match_delay_level
+from ..outbox import OutboxRecord
+from ..middleware import HandlerInfo, KIND_ACTION
+from ..logcontext import bind_context, reset_context
+from .transactional import producer_executor
 
 # from ..channel import Channel
 
+logger = logging.getLogger("soybean.action")
+
 
 class SendingAction:
     def __init__(self,
@@ -14,7 +29,12 @@ class SendingAction:
                  topic: str,
                  tag: str = None,
                  orderly: bool = False,
-                 props=None):
+                 props=None,
+                 rate_limit: float = None,
+                 priority: str = PRIORITY_ONLINE,
+                 compression=None,
+                 claim_check: int = None,
+                 schema=None):
 
         self._channel = channel
         self._topic = topic
@@ -22,27 +42,154 @@ class SendingAction:
         self._orderly = orderly
         self._props = props
 
+        check_send_priority(priority)
+        self._priority = priority
+        self._rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        self._throttle_stats = ThrottleStats()
+
+        if compression is None:
+            self._compression = channel.compression
+        else:
+            threshold = channel.compression.threshold if channel.compression else 4096
+            self._compression = make_compression(compression, threshold)
+
+        self._claim_check = None
+        if claim_check is not None:
+            self._claim_check = ClaimCheck(channel.blob_store, claim_check)
+
+        self._encode = schema.encode if schema is not None else None
+
+        # 主题、标签和固定的属性只编码一次，模板在首次发送时按领域当时的传输方式创建
+        self._template = None
+        self._template_local = None
+
         group_id = f"{channel.name}"
         if orderly:
             group_id += "|orderly"
         self._group_id = group_id
 
+    def _get_template(self) -> MessageTemplate:
+        # 动作可能在领域改用本地broker(use_local_transport)之前创建
+        channel = self._channel
+        if self._template is None or self._template_local != channel.is_local:
+            self._template = MessageTemplate(self._topic, self._tag, self._props,
+                                             message_factory=channel.message_factory,
+                                             reusable=not channel.is_local)
+            self._template_local = channel.is_local
+        return self._template
+
     def get_producer(self):
 
         producer = self._channel.get_producer(self._group_id)
         if producer is not None:
             return producer
 
-        producer = Producer(self._group_id, orderly=self._orderly)
-        producer.set_name_server_address(self._channel.namesrv_addr)
+        producer = self._channel.create_producer(self._group_id,
+                                                 orderly=self._orderly)
         producer.start()
 
         self._channel.register_producer(self._group_id, producer)
         return producer
 
-    async def send(self, msg):
-        msg_obj = make_action_msg(msg, self._topic, self._tag)
+    @property
+    def throttle_stats(self) -> ThrottleStats:
+        return self._throttle_stats
+
+    async def throttle(self):
+        """按照动作自身的发送速率和领域的发送调度等待发送许可"""
+        delay = 0.0
+        if self._rate_limiter is not None:
+            delay += await self._rate_limiter.acquire_async()
+
+        scheduler = self._channel.send_scheduler
+        if scheduler.limited:
+            delay += await self._channel.run_in_main_loop(
+                scheduler.acquire(self._priority))
+        self._throttle_stats.record(delay)
+
+    async def send(self, msg, delay=None, deliver_at=None, props=None, key=None):
+        """
+        发送消息。delay为延时的秒数或timedelta，deliver_at为投递的时刻；
+        延时恰好等于RocketMQ的延时级别时由broker延时投递，否则由本地调度器到期后发送。
+        props为本次发送附加的消息属性，key为消息的键。
+        有消息契约时按契约编码消息，不符合契约时抛出MessageSchemaError。
+        """
+        jsonobj = msg if self._encode is None else self._encode(msg)
+
+        extra_props = props  # 模板之外的属性
+        if props:
+            props = {**self._props, **props} if self._props else props
+        else:
+            props = self._props
+
+        delay = resolve_delay(delay, deliver_at)
+        delay_level = None
+        if delay:
+            delay_level = match_delay_level(delay)
+            if delay_level is None:
+                await self._channel.run_in_main_loop(
+                    self._schedule(time.time() + delay, jsonobj, props, key))
+                return msg
+
+        body, body_props = encode_jsonobj_body(jsonobj, self._compression,
+                                               self._claim_check)
+        if body_props:
+            props = {**props, **body_props} if props else body_props
+            extra_props = ({**extra_props, **body_props} if extra_props
+                           else body_props)
+
+        outbox = self._channel.outbox
+        if outbox is not None and outbox.accepts():
+            await self._channel.run_in_main_loop(
+                outbox.append(self._make_record(body, props, delay_level, key)))
+            return msg
+
+        await self.throttle()
+
+        msg_obj = self._get_template().create(body, key=key,
+                                              props=extra_props,
+                                              delay_level=delay_level)
+        try:
+            self.send_msg_obj(msg_obj)
+        except _BrokerUnavailable as exc:
+            if outbox is None:
+                raise
+
+            logger.warning("failed to send the message to '%s', "
+                           "kept in the outbox: %s", self._topic, exc)
+            await self._channel.run_in_main_loop(
+                outbox.append(self._make_record(body, props, delay_level, key)))
 
+        return msg
+
+    async def _schedule(self, deliver_at, jsonobj, props, key=None):
+        # 到期后按本动作的压缩和认领检查选项编码
+        compression = self._compression
+        if compression is not None:
+            compression = [compression.codec_name, compression.threshold]
+        else:
+            compression = False
+
+        claim_check = self._claim_check
+        if claim_check is not None:
+            claim_check = claim_check.threshold
+
+        self._channel.scheduler.schedule(
+            deliver_at, self._topic, self._tag, jsonobj,
+            orderly=self._orderly, props=props, priority=self._priority,
+            compression=compression, claim_check=claim_check, keys=key)
+
+    def _make_record(self, body, props, delay_level, key=None):
+        return OutboxRecord(self._topic, self._tag, keys=key, props=props,
+                            body=body,
+                            orderly=self._orderly, priority=self._priority,
+                            delay_level=delay_level)
+
+    def send_msg_obj(self, msg_obj):
+        """
+        用生产者发送消息对象。无法连接broker时抛出_BrokerUnavailable，
+        broker已经收到消息但是状态异常时抛出ActionError
+        """
         try:
             producer = self.get_producer()
             if self._orderly:
@@ -51,11 +198,11 @@ class SendingAction:
             else:
                 response = producer.send_sync(msg_obj)
         except Exception as exc:
-            raise ActionError(str(exc)) from exc
+            raise _BrokerUnavailable(str(exc)) from exc
 
         response_status = response.status
         if response_status == SendStatus.OK:
-            return msg
+            return
 
         if response_status == SendStatus.FLUSH_DISK_TIMEOUT:
             raise ActionError("flush disk timeout")
@@ -67,6 +214,27 @@ class SendingAction:
             raise ActionError("unknow send status code")
 
 
+class _BrokerUnavailable(ActionError):
+    """无法连接broker，消息没有被发送"""
+
+
+async def send_outbox_record(channel, record: OutboxRecord):
+    """补发发件箱中的记录，失败时抛出异常"""
+    action = SendingAction(channel, record.topic, record.tag,
+                           orderly=record.orderly,
+                           priority=record.priority or PRIORITY_ONLINE)
+    await action.throttle()
+
+    msg_obj = create_msg(record.topic, record.body, record.keys, record.tag,
+                         record.props, message_factory=channel.create_message)
+    if record.delay_level is not None:
+        msg_obj.set_delay_time_level(record.delay_level)
+
+    # 补发多在broker故障期间，同步发送会阻塞到超时，放到生产者线程池中执行
+    await asyncio.get_running_loop().run_in_executor(
+        producer_executor, action.send_msg_obj, msg_obj)
+
+
 class SimpleAction(SendingAction):
 
     def __init__(self,
@@ -75,13 +243,75 @@ class SimpleAction(SendingAction):
                  topic: str,
                  tag: str = None,
                  orderly: bool = False,
-                 props=None):
+                 props=None,
+                 rate_limit: float = None,
+                 priority: str = PRIORITY_ONLINE,
+                 compression=None,
+                 claim_check: int = None,
+                 delay=None,
+                 schema=None,
+                 cache: ActionCache = None):
 
-        super().__init__(channel, topic, tag, orderly, props)
+        super().__init__(channel, topic, tag, orderly, props,
+                         rate_limit=rate_limit, priority=priority,
+                         compression=compression, claim_check=claim_check,
+                         schema=schema)
 
         self._handler = handler
+        self._action_id = make_group_id(channel.name, handler)
+        self._delay = delay
+        self._cache = cache
+        self._invoke = None
+
+    @property
+    def cache(self) -> ActionCache:
+        return self._cache
+
+    def compile(self):
+        """编译处理函数的中间件调用链"""
+        info = HandlerInfo(KIND_ACTION, self._action_id, self._topic,
+                           self._tag, self._handler)
+        self._invoke = self._channel.compile_handler(self._handler, info)
 
     async def execute(self, *handler_args, **handler_kwargs):
-        ret_val = await self._handler(*handler_args, **handler_kwargs)
-        await self.send(ret_val)
-        return ret_val
+        if self._invoke is None:
+            self.compile()
+
+        context_token = bind_context(KIND_ACTION, self._action_id,
+                                     self._topic, self._tag)
+        try:
+            cache = self._cache
+            if cache is None:
+                ret_val = await self._run_handler(handler_args, handler_kwargs)
+                await self.send(ret_val, delay=self._delay)
+                return ret_val
+
+            cache_key = cache.make_key(handler_args, handler_kwargs)
+            found, ret_val = cache.get(cache_key)
+            if not found:
+                ret_val = await self._run_handler(handler_args, handler_kwargs)
+                cache.put(cache_key, ret_val)
+
+            if cache.suppress is None:
+                await self.send(ret_val, delay=self._delay)
+                return ret_val
+
+            # 相同内容的消息在窗口内只发送一次
+            jsonobj = ret_val if self._encode is None else self._encode(ret_val)
+            fingerprint = cache.fingerprint(jsonobj)
+            if cache.try_reserve(fingerprint):
+                try:
+                    await self.send(ret_val, delay=self._delay)
+                except BaseException:
+                    cache.release(fingerprint)
+                    raise
+            return ret_val
+        finally:
+            reset_context(context_token)
+
+    async def _run_handler(self, handler_args, handler_kwargs):
+        coroutine = self._invoke(*handler_args, **handler_kwargs)
+        profiler = self._channel.profiler
+        if profiler is not None:
+            coroutine = profiler.run(self._action_id, coroutine)
+        return await coroutine
@@ -1,4 +1,5 @@
-from asyncio import run_coroutine_threadsafe
+import logging
+from asyncio import run_coroutine_threadsafe, get_running_loop
 from rocketmq.client import SendStatus
 from rocketmq.client import TransactionMQProducer, TransactionStatus
 from concurrent.futures import ThreadPoolExecutor
@@ -7,8 +8,12 @@ from ..typing import HandlerType
 from ..exceptions import TrasnactionPreparingError
 from ..utils import make_group_id
 from ..event import ThreadingEventValue, AsyncEventValue
+from ..middleware import HandlerInfo, KIND_ACTION
+from ..logcontext import bind_context, reset_context
 from . import make_action_msg
 
+logger = logging.getLogger("soybean.action")
+
 producer_executor = ThreadPoolExecutor(max_workers=5)
 
 # from ..channel import Channel
@@ -21,7 +26,8 @@ class TransactionalAction:
                  sqlblock_database,
                  topic: str,
                  tag: str = None,
-                 props=None):
+                 props=None,
+                 schema=None):
 
         self._channel = channel
         self._handler = handler
@@ -29,9 +35,17 @@ class TransactionalAction:
         self._topic = topic
         self._tag = tag
         self._props = props
+        self._encode = schema.encode if schema is not None else None
         self._rechecker = None
 
         self._group_id = make_group_id(channel.name, handler)
+        self._invoke = None
+
+    def compile(self):
+        """编译处理函数的中间件调用链"""
+        info = HandlerInfo(KIND_ACTION, self._group_id, self._topic,
+                           self._tag, self._handler)
+        self._invoke = self._channel.compile_handler(self._handler, info)
 
     def get_producer(self):
         producer = self._channel.get_producer(self._group_id)
@@ -49,7 +63,9 @@ class TransactionalAction:
             try:
                 is_success = future.result()
                 if not isinstance(is_success, bool):
-                    print("rechecker should return a True or False value")
+                    logger.warning("the rechecker of '%s' should return "
+                                   "True or False, not %r",
+                                   self._group_id, is_success)
                     return TransactionStatus.UNKNOWN
 
                 if is_success:
@@ -57,7 +73,8 @@ class TransactionalAction:
                 else:
                     return TransactionStatus.ROLLBACK
             except Exception as exc:
-                print("rechecker error: ", str(exc))
+                logger.error("caught an error in the rechecker of '%s': %s",
+                             self._group_id, exc, exc_info=exc)
                 return TransactionStatus.UNKNOWN
 
         producer = TransactionMQProducer(self._group_id, _recheck_callback)
@@ -69,15 +86,25 @@ class TransactionalAction:
         return producer
 
     async def execute(self, *handler_args, **handler_kwargs):
+        if self._invoke is None:
+            self.compile()
+
         message = TransactionalMessage(self)
 
         @self._sqlblock_database.transaction
         async def _transactional_handler():
             # 在事务内执行内在逻辑
-            result = await self._handler(*handler_args, **handler_kwargs)
+            coroutine = self._invoke(*handler_args, **handler_kwargs)
+            profiler = self._channel.profiler
+            if profiler is not None:
+                coroutine = profiler.run(self._group_id, coroutine)
+
+            result = await coroutine
             await message.prepare(result) # 事务提交前发送准备消息
             return result
 
+        context_token = bind_context(KIND_ACTION, self._group_id,
+                                     self._topic, self._tag)
         try:
             ret = await _transactional_handler()
             await message.confirm() # 事务已提交，发送确认，允许事务消息发送
@@ -85,6 +112,8 @@ class TransactionalAction:
         except Exception as exc:
             message.exception(exc) # 事务回滚，撤回消息
             raise
+        finally:
+            reset_context(context_token)
 
 
 async def _default_rechecker(msg):
@@ -100,10 +129,15 @@ class TransactionalMessage:
     async def prepare(self, action_result):
 
         action = self._action
-        loop = action._channel.get_running_loop()
+        # prepared属于当前的事件循环，开启多个事件循环时不一定是主事件循环
+        loop = get_running_loop()
+        if action._encode is not None:
+            action_result = action._encode(action_result)
         msg_obj = make_action_msg(action_result,
                                   action._topic,
-                                  action._tag)
+                                  action._tag,
+                                  props=action._props,
+                                  compression=action._channel.compression)
 
         prepared = AsyncEventValue()
 
@@ -0,0 +1,122 @@
+"""
+管理端点。
+
+一个极简的HTTP/1.0服务器，只用于查看运行状态，不应暴露在公共网络上：
+* GET /stats   领域的运行统计，即DomainChannel.stats()；
+* GET /profile 性能剖析的报告，没有开启性能剖析时返回404；
+* GET /health/ready 就绪检查，未就绪时返回503；
+* GET /health/live  存活检查，失败时返回503。
+"""
+import asyncio
+import logging
+
+from .utils import json_dumps
+
+logger = logging.getLogger("soybean.admin")
+
+
+class AdminServer:
+
+    def __init__(self, channel, host: str = "127.0.0.1", port: int = 0):
+        self._channel = channel
+        self._host = host
+        self._port = port
+        self._server = None
+        self._routes = {
+            "/stats": self._get_stats,
+            "/profile": self._get_profile,
+            "/health/ready": self._get_readiness,
+            "/health/live": self._get_liveness,
+        }
+
+    @property
+    def port(self) -> int:
+        """实际监听的端口，port为0时由系统分配"""
+        if self._server is None:
+            return self._port
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle,
+                                                  self._host, self._port)
+        logger.info("admin endpoint is listening on %s:%d",
+                    self._host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while True:
+                # 忽略请求头
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                await self._respond(writer, 405, {"error": "method not allowed"})
+                return
+
+            path = parts[1].split("?", 1)[0]
+            route = self._routes.get(path)
+            if route is None:
+                await self._respond(writer, 404, {"error": "not found"})
+                return
+
+            status, body = await route()
+            await self._respond(writer, status, body)
+
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as exc:
+            logger.error("failed to handle an admin request: %s", exc,
+                         exc_info=exc)
+            await self._respond(writer, 500, {"error": str(exc)})
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, body):
+        reason = _REASONS.get(status, "")
+        if isinstance(body, str):
+            content_type = "text/plain; charset=utf-8"
+            data = body.encode("utf-8")
+        else:
+            content_type = "application/json"
+            data = json_dumps(body).encode("utf-8")
+
+        writer.write(f"HTTP/1.0 {status} {reason}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1"))
+        writer.write(data)
+        await writer.drain()
+
+    async def _get_stats(self):
+        return 200, self._channel.stats()
+
+    async def _get_profile(self):
+        profiler = self._channel.profiler
+        if profiler is None:
+            return 404, {"error": "profiling is not enabled"}
+        return 200, profiler.report()
+
+    async def _get_readiness(self):
+        ready, checks = await self._channel.health.readiness()
+        return (200 if ready else 503), checks
+
+    async def _get_liveness(self):
+        alive, checks = await self._channel.health.liveness()
+        return (200 if alive else 503), checks
+
+
+_REASONS = {
+    200: "OK",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
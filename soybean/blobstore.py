@@ -0,0 +1,192 @@
+"""
+认领检查(claim-check)模式。
+
+超过阈值的消息体不经过broker，而是存入blob存储，消息中只携带存储的引用，
+引用记录在消息属性CLAIM_CHECK_PROPERTY中。反应器在处理函数需要消息内容时才按引用读取，
+处理成功后释放引用，释放过的blob经过一段宽限时间后被回收；从未被释放的blob超过ttl后回收。
+"""
+import os
+import re
+import mmap
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger("soybean.blobstore")
+
+
+CLAIM_CHECK_PROPERTY = "soybean_claim_check"
+
+
+class BlobStore(ABC):
+    """blob存储的接口，子类需要实现全部方法"""
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """保存数据，返回引用"""
+
+    @abstractmethod
+    def get(self, ref: str):
+        """按引用读取数据，返回bytes或者bytes-like对象"""
+
+    @abstractmethod
+    def release(self, ref: str):
+        """标记该引用的数据已经被消费"""
+
+    @abstractmethod
+    def gc(self) -> int:
+        """回收已经释放或过期的数据，返回回收的数量"""
+
+
+_REF_PATTERN = re.compile("^[0-9a-f]{32}$")
+
+
+class FileBlobStore(BlobStore):
+    """基于本地文件系统的blob存储，读取时采用内存映射，不复制数据。
+
+    生产者与消费者需要能够访问相同的目录，如同一主机或者共享挂载的目录。
+    当同一消息有多个消费组时，grace应当足够覆盖各个消费组之间的消费进度差距。
+    """
+
+    def __init__(self, root: str, ttl: float = 24 * 3600, grace: float = 300):
+        self._root = root
+        self._ttl = ttl
+        self._grace = grace
+        self._released = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def _path(self, ref: str) -> str:
+        if not _REF_PATTERN.match(ref):
+            raise ValueError(f"invalid blob reference: '{ref}'")
+
+        return os.path.join(self._root, ref[:2], ref)
+
+    def put(self, data: bytes) -> str:
+        ref = uuid.uuid4().hex
+        path = self._path(ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 先写入临时文件再改名，读取者不会看到写了一半的数据
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        return ref
+
+    def get(self, ref: str):
+        with open(self._path(ref), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+
+            # 关闭文件后映射仍然有效，映射随着返回的memoryview被回收
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def release(self, ref: str):
+        with self._lock:
+            self._released.setdefault(ref, time.time())
+
+    def gc(self) -> int:
+        now = time.time()
+        count = 0
+
+        with self._lock:
+            released = self._released
+            expired = [ref for ref, released_at in released.items()
+                       if now - released_at >= self._grace]
+            for ref in expired:
+                del released[ref]
+
+        for ref in expired:
+            count += self._remove(self._path(ref))
+
+        expired_before = now - self._ttl
+        for entry in os.scandir(self._root):
+            if not entry.is_dir():
+                continue
+
+            for blob in os.scandir(entry.path):
+                if blob.stat().st_mtime < expired_before:
+                    count += self._remove(blob.path)
+
+        return count
+
+    def _remove(self, path) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+
+def default_blob_store(domain_name: str) -> FileBlobStore:
+    root = os.path.join(tempfile.gettempdir(), "soybean-blobs", domain_name)
+    return FileBlobStore(root)
+
+
+class ClaimCheck:
+    """认领检查的策略：消息体达到threshold字节时存入store，消息中只发送引用"""
+
+    __slots__ = ("_store", "_threshold")
+
+    def __init__(self, store: BlobStore, threshold: int):
+        self._store = store
+        self._threshold = threshold
+
+    @property
+    def threshold(self) -> int:
+        return self._threshold
+
+    def check(self, body: bytes):
+        """返回(消息体, 引用)，没有存入store时引用为None"""
+        if len(body) < self._threshold:
+            return body, None
+
+        ref = self._store.put(body)
+        return ref.encode("ascii"), ref
+
+
+class BlobCollector:
+    """周期性地在线程池中回收blob存储，get_store返回当前的存储，尚未创建时返回None"""
+
+    def __init__(self, get_store, interval: float = 60):
+        self._get_store = get_store
+        self._interval = interval
+        self._task = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run(loop))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, loop):
+        while True:
+            await asyncio.sleep(self._interval)
+            store = self._get_store()
+            if store is None:
+                continue
+
+            try:
+                count = await loop.run_in_executor(None, store.gc)
+                if count:
+                    logger.debug("collected %d blobs", count)
+            except Exception as exc:
+                logger.error("failed to collect blobs: %s", exc, exc_info=exc)
@@ -0,0 +1,167 @@
+"""
+动作结果的缓存。
+
+有些动作总是以相同的参数反复调用（例如广播参考数据），每次都执行处理函数并发送相同的消息。
+开启缓存后，同一组参数在ttl秒内直接返回上一次的结果，不再执行处理函数；
+超过max_size组参数时淘汰最久未用的结果。只适用于结果只取决于参数、没有副作用的处理函数，
+缓存的结果由各次调用共享，调用者不能修改。
+
+缺省命中缓存时仍然发送消息；设置suppress后，与suppress秒内已经发送过的消息内容相同的
+结果不再发送，由此减少broker的流量。缓存的键缺省为处理函数的参数，参数不可哈希时
+不缓存；也可以用key函数从参数计算键。缓存是线程安全的，可以在多个事件循环中使用。
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from sqlblock.utils.json import json_dumps
+
+
+class CacheStats:
+    __slots__ = ("hits", "misses", "suppressed")
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.suppressed = 0
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "suppressed": self.suppressed,
+                "hit_ratio": self.hits / total if total else 0.0}
+
+
+class ActionCache:
+    """
+    ttl 缓存结果的秒数；max_size 缓存的参数组数的上限；
+    suppress 相同内容的消息在该秒数内只发送一次，None表示每次都发送；
+    key 从处理函数的参数计算缓存键的函数。
+    """
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 1024,
+                 suppress: float = None, key=None):
+        if ttl <= 0:
+            raise ValueError(f"the ttl should be positive: {ttl}")
+        if max_size < 1:
+            raise ValueError(f"the max_size should be at least 1: {max_size}")
+
+        self._ttl = ttl
+        self._max_size = max_size
+        self._suppress = suppress
+        self._key = key
+
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # key -> (expires_at, result)
+        self._sent = OrderedDict()  # fingerprint -> sent_at
+        self._stats = CacheStats()
+
+    @property
+    def suppress(self) -> float:
+        return self._suppress
+
+    def make_key(self, args, kwargs):
+        """返回参数的缓存键，参数不可哈希时返回None"""
+        if self._key is not None:
+            return self._key(*args, **kwargs)
+
+        cache_key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+        try:
+            hash(cache_key)
+        except TypeError:
+            return None
+        return cache_key
+
+    def get(self, cache_key):
+        """返回(是否命中, 缓存的结果)"""
+        if cache_key is None:
+            with self._lock:
+                self._stats.misses += 1
+            return False, None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._results.get(cache_key)
+            if entry is None or entry[0] <= now:
+                self._stats.misses += 1
+                return False, None
+
+            self._results.move_to_end(cache_key)
+            self._stats.hits += 1
+            return True, entry[1]
+
+    def put(self, cache_key, result):
+        if cache_key is None:
+            return
+
+        expires_at = time.monotonic() + self._ttl
+        with self._lock:
+            self._results[cache_key] = (expires_at, result)
+            self._results.move_to_end(cache_key)
+            while len(self._results) > self._max_size:
+                self._results.popitem(last=False)
+
+    @staticmethod
+    def fingerprint(jsonobj) -> bytes:
+        """消息内容的摘要，用于识别重复的发送"""
+        body = json_dumps(jsonobj).encode("utf-8")
+        return hashlib.blake2b(body, digest_size=16).digest()
+
+    def try_reserve(self, fingerprint: bytes) -> bool:
+        """
+        相同内容的消息在suppress秒内已经发送过（或者正在发送）时返回False，
+        否则登记本次发送并返回True，检查和登记是原子的，并发的相同调用只有一个发送
+        """
+        now = time.monotonic()
+        with self._lock:
+            sent_at = self._sent.get(fingerprint)
+            if sent_at is not None and now - sent_at < self._suppress:
+                self._stats.suppressed += 1
+                return False
+
+            self._sent[fingerprint] = now
+            self._sent.move_to_end(fingerprint)
+
+            # 淘汰超出窗口的记录
+            while self._sent:
+                sent_at = next(iter(self._sent.values()))
+                if now - sent_at < self._suppress and \
+                        len(self._sent) <= self._max_size:
+                    break
+                self._sent.popitem(last=False)
+            return True
+
+    def release(self, fingerprint: bytes):
+        """撤销try_reserve()的登记，发送失败时调用"""
+        with self._lock:
+            self._sent.pop(fingerprint, None)
+
+    def clear(self):
+        """清除所有缓存的结果和发送记录，参考数据变化时调用"""
+        with self._lock:
+            self._results.clear()
+            self._sent.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = self._stats.as_dict()
+            stats["size"] = len(self._results)
+        return stats
+
+
+def make_action_cache(cache):
+    """
+    将cache参数规范为ActionCache对象：None或False表示不缓存，True为缺省的设置，
+    数值为缓存的秒数，ActionCache对象保持原样。
+    """
+    if cache is None or cache is False:
+        return None
+
+    if isinstance(cache, ActionCache):
+        return cache
+
+    if cache is True:
+        return ActionCache()
+
+    return ActionCache(ttl=cache)
@@ -0,0 +1,172 @@
+"""
+消费流量的录制。
+
+开启录制后，反应器消费的每条消息（主题、标签、键、soybean使用的属性、消息体、产生和存储的
+时刻）在消费线程中追加到本地的录制文件，供soybean.replay在本地broker上按原来的节奏回放。
+同一条消息被多个反应器消费或者被重新投递时只记录一次。
+
+录制文件以MAGIC开头，之后的每条记录为固定长度的头部和各个字段的bytes：
+    born_timestamp(q) store_timestamp(q) 主题、标签、键的长度(H) 属性、消息体的长度(I)
+属性为json对象。
+"""
+import json
+import struct
+import logging
+import threading
+from collections import OrderedDict
+
+from .prefetch import SNAPSHOT_PROPERTIES
+
+logger = logging.getLogger("soybean.capture")
+
+
+MAGIC = b"SOYCAP01"
+
+_RECORD_HEADER = struct.Struct("<qqHHHII")
+
+
+class CapturedMessage:
+    __slots__ = ("topic", "tag", "keys", "props", "body",
+                 "born_timestamp", "store_timestamp")
+
+    def __init__(self, topic, tag, keys, props, body,
+                 born_timestamp, store_timestamp):
+        self.topic = topic
+        self.tag = tag
+        self.keys = keys
+        self.props = props
+        self.body = body
+        self.born_timestamp = born_timestamp
+        self.store_timestamp = store_timestamp
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value or ""
+
+
+def encode_record(msg) -> bytes:
+    """编码消费到的消息，msg为rocketmq.client.ReceivedMessage或相同接口的对象"""
+    props = {}
+    for name in SNAPSHOT_PROPERTIES:
+        value = msg.get_property(name)
+        if value:
+            props[name] = _to_str(value)
+
+    topic = _to_str(msg.topic).encode("utf-8")
+    tag = msg.tags or b""
+    keys = msg.keys or b""
+    props_bytes = json.dumps(props).encode("utf-8") if props else b""
+    body = msg.body or b""
+
+    header = _RECORD_HEADER.pack(msg.born_timestamp, msg.store_timestamp,
+                                 len(topic), len(tag), len(keys),
+                                 len(props_bytes), len(body))
+    return b"".join((header, topic, tag, keys, props_bytes, body))
+
+
+class CaptureWriter:
+    """
+    线程安全的录制文件写入者。path 录制文件，已存在时追加；
+    max_bytes 录制文件的大小上限，超过后不再录制；
+    max_tracked_ids 用于去重的最近消息id数量。
+    """
+
+    def __init__(self, path: str, max_bytes: int = None,
+                 max_tracked_ids: int = 100000):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._max_tracked_ids = max_tracked_ids
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._count = 0
+        self._seen = OrderedDict()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def open(self):
+        self._file = open(self._path, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(MAGIC)
+            self._size = len(MAGIC)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+        logger.info("captured %d messages into '%s'", self._count, self._path)
+
+    def write(self, msg):
+        """在消费线程中录制一条消息，重新投递的和已经录制过的消息被忽略"""
+        if msg.reconsume_times > 0:
+            return
+
+        msg_id = msg.id
+        record = None
+        with self._lock:
+            if self._file is None or msg_id in self._seen:
+                return
+
+            self._seen[msg_id] = None
+            if len(self._seen) > self._max_tracked_ids:
+                self._seen.popitem(last=False)
+
+            record = encode_record(msg)
+            if self._max_bytes is not None and \
+                    self._size + len(record) > self._max_bytes:
+                logger.warning("the capture file '%s' is full, "
+                               "stopped capturing", self._path)
+                self._file.close()
+                self._file = None
+                return
+
+            self._file.write(record)
+            self._size += len(record)
+            self._count += 1
+
+
+def read_capture(path: str):
+    """依次读出录制文件中的消息，忽略末尾不完整的记录"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not a soybean capture file")
+
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+
+            (born_timestamp, store_timestamp, topic_len, tag_len, keys_len,
+             props_len, body_len) = _RECORD_HEADER.unpack(header)
+
+            data_len = topic_len + tag_len + keys_len + props_len + body_len
+            data = f.read(data_len)
+            if len(data) < data_len:
+                logger.warning("ignored a truncated record at the end of '%s'",
+                               path)
+                return
+
+            offset = 0
+            fields = []
+            for length in (topic_len, tag_len, keys_len, props_len, body_len):
+                fields.append(data[offset:offset + length])
+                offset += length
+
+            topic, tag, keys, props, body = fields
+            yield CapturedMessage(topic.decode("utf-8"),
+                                  tag.decode("utf-8") or None,
+                                  keys.decode("utf-8") or None,
+                                  json.loads(props) if props else {},
+                                  body, born_timestamp, store_timestamp)
@@ -1,14 +1,38 @@
 import asyncio
-from typing import Callable, Awaitable, Any, List, Dict
+import logging
+from typing import Callable, Awaitable, Any, List, Dict, Union
 from typing import ForwardRef
 import functools
+from rocketmq.client import Producer, PushConsumer, Message
 
 from .reactor import Reactor
+from .consumer import SharedConsumer
+from .flowcontrol import PauseGate, PriorityScheduler, LoopLagMonitor
+from .flowcontrol import SendScheduler, PRIORITY_ONLINE
+from .compression import Compression, make_compression
+from .blobstore import BlobStore, BlobCollector, default_blob_store
+from .profiling import Profiler
+from .scheduler import DelayedMessageScheduler
+from .rpc import RpcClient
+from .outbox import LocalOutbox
+from .relay import OutboxRelay, OutboxStore, PostgresOutboxStore
+from .admin import AdminServer
+from .health import HealthChecker
+from .local import is_local_addr, LocalProducer, LocalPushConsumer, LocalMessage
+from .middleware import HandlerInfo, compile_chain
+from .schema import compile_schema
+from .window import WindowAggregator
+from .looppool import LoopPool, run_in_loop
+from .capture import CaptureWriter
+from .cache import make_action_cache
 from .utils import check_topic_name, pinyin_translate
+from .exceptions import NotReadyError
 from .typing import HandlerType
-from .action.simple import SendingAction, SimpleAction
+from .action.simple import SendingAction, SimpleAction, send_outbox_record
 from .action.transactional import TransactionalAction
+from .action.outboxed import OutboxedAction
 
+logger = logging.getLogger("soybean.channel")
 
 """
 在消息队列中，GroupId目的维持在并发条件下消费位点(offset)的一致性。
@@ -32,14 +56,95 @@ class DomainChannel:
         "_namesrv_addr",
         "_producers",
         "_reactors",
+        "_shared_consumers",
         "_loop",
+        "_consume_gate",
+        "_priority_scheduler",
+        "_lag_monitor",
+        "_send_scheduler",
+        "_compression",
+        "_blob_store",
+        "_blob_collector",
+        "_profiler",
+        "_scheduler",
+        "_rpc",
+        "_outbox",
+        "_outbox_relays",
+        "_admin",
+        "_local",
+        "_middlewares",
+        "_topic_middlewares",
+        "_actions",
+        "_log_sample_every",
+        "_aggregators",
+        "_loop_pool",
+        "_capture",
+        "_running",
+        "_health",
+        "_reload_lock",
     )
 
-    def __init__(self, domain, namesrv_addr):
+    def __init__(self, domain, namesrv_addr,
+                 max_inflight: int = None,
+                 max_loop_lag: float = None,
+                 send_rate_limit: float = None,
+                 compression: Compression = None,
+                 blob_store: BlobStore = None,
+                 scheduler_path: str = None,
+                 outbox: LocalOutbox = None,
+                 admin_addr: str = None,
+                 log_sample_every: int = 100,
+                 event_loops: int = None,
+                 priority_weights: Dict[str, int] = None,
+                 priority_quotas: Dict[str, int] = None):
         self._name = domain
         self._namesrv_addr = namesrv_addr
+        self._local = is_local_addr(namesrv_addr)
+        self._loop = None
         self._producers = {}
         self._reactors = {}
+        self._shared_consumers = {}
+
+        # 领域内所有反应器共享的消费闸门，在途消息数量按反应器的优先级调度
+        self._consume_gate = PauseGate()
+        self._priority_scheduler = PriorityScheduler(max_inflight,
+                                                     weights=priority_weights,
+                                                     quotas=priority_quotas)
+
+        self._lag_monitor = None
+        if max_loop_lag is not None:
+            self._lag_monitor = LoopLagMonitor(self._consume_gate,
+                                               max_lag=max_loop_lag)
+
+        self._send_scheduler = SendScheduler(rate=send_rate_limit)
+        self._compression = compression
+
+        self._blob_store = blob_store
+        self._blob_collector = BlobCollector(lambda: self._blob_store)
+
+        self._profiler = None
+
+        self._scheduler = DelayedMessageScheduler(scheduler_path)
+        self._rpc = None
+        self._outbox = outbox
+        self._outbox_relays = {}
+
+        self._admin = None
+        if admin_addr is not None:
+            host, _, port = admin_addr.rpartition(":")
+            self._admin = AdminServer(self, host or "127.0.0.1", int(port))
+
+        self._middlewares = []
+        self._topic_middlewares = {}
+        self._actions = []
+        self._log_sample_every = log_sample_every
+
+        self._aggregators = []
+        self._loop_pool = LoopPool(event_loops) if event_loops else None
+        self._capture = None
+        self._running = False
+        self._reload_lock = None
+        self._health = HealthChecker(self)
 
     @property
     def name(self):
@@ -55,44 +160,512 @@ class DomainChannel:
 
         return TopicChannel(self, topic=name)
 
+    def use_local_transport(self, namesrv_addr: str = "local"):
+        """改用进程内的本地broker，用于回放和测试，需要在start()之前调用"""
+        if self._running:
+            raise RuntimeError("the transport should be changed before start()")
+        if not is_local_addr(namesrv_addr):
+            raise ValueError(f"not a local broker address: {namesrv_addr}")
+        for action in self._actions:
+            if isinstance(action, TransactionalAction):
+                raise ValueError("the local broker does not support "
+                                 "transactional messages, "
+                                 "use mode='outbox' instead")
+
+        self._namesrv_addr = namesrv_addr
+        self._local = True
+
+    def create_producer(self, group_id, orderly=False):
+        """创建尚未启动的生产者，名称服务器地址为"local"时使用进程内的本地broker"""
+        if self._local:
+            producer = LocalProducer(group_id, orderly=orderly)
+        else:
+            producer = Producer(group_id, orderly=orderly)
+        producer.set_name_server_address(self._namesrv_addr)
+        return producer
+
+    def create_consumer(self, group_id):
+        if self._local:
+            consumer = LocalPushConsumer(group_id=group_id)
+        else:
+            consumer = PushConsumer(group_id=group_id)
+        consumer.set_name_server_address(self._namesrv_addr)
+        return consumer
+
+    @property
+    def is_local(self) -> bool:
+        """是否使用进程内的本地broker"""
+        return self._local
+
+    @property
+    def message_factory(self):
+        return LocalMessage if self._local else Message
+
+    def create_message(self, topic):
+        return self.message_factory(topic)
+
     def get_producer(self, group_id):
         return self._producers.get(group_id)
 
     def get_reactor(self, group_id):
         return self._reactors.get(group_id)
 
+    def reactors(self) -> List[Reactor]:
+        return list(self._reactors.values())
+
+    def shared_consumers(self) -> List[SharedConsumer]:
+        return list(self._shared_consumers.values())
+
     def register_producer(self, group_id, producer):
         self._producers[group_id] = producer
 
     def register_reactor(self, group_id, reactor):
+        if self._running:
+            raise RuntimeError(f"reactor '{group_id}' should be added by "
+                               f"add_reactor() after start()")
+
         self._reactors[group_id] = reactor
+        self._add_to_shared_consumer(reactor)
+
+    def _add_to_shared_consumer(self, reactor) -> SharedConsumer:
+        if reactor.shared is None:
+            return None
+
+        key = (reactor.topic, reactor.shared)
+        shared_consumer = self._shared_consumers.get(key)
+        if shared_consumer is None:
+            shared_consumer = SharedConsumer(self, reactor.topic,
+                                             reactor.shared)
+            self._shared_consumers[key] = shared_consumer
+        shared_consumer.add_reactor(reactor)
+        return shared_consumer
+
+    async def add_reactor(self, reactor):
+        """
+        运行时添加反应器，只启动该反应器的消费者，不影响其它反应器。
+        同名的反应器（处理函数相同）已经存在时先移除，即以新的选项替换旧的反应器。
+        共享消费者的标签表达式并集变化时，以新的表达式重新订阅该共享消费者。
+        """
+        if not self._running:
+            self.register_reactor(reactor.reactor_id, reactor)
+            return
+
+        async with self._reload_lock:
+            if reactor.reactor_id in self._reactors:
+                await self._remove_reactor(reactor.reactor_id)
+
+            self._reactors[reactor.reactor_id] = reactor
+            shared_consumer = self._shared_consumers.get((reactor.topic,
+                                                          reactor.shared))
+            expression = shared_consumer.expression() if shared_consumer else None
+
+            shared_consumer = self._add_to_shared_consumer(reactor)
+            try:
+                await reactor.start()
+
+                if shared_consumer is not None:
+                    if not shared_consumer.started:
+                        await shared_consumer.start()
+                    elif shared_consumer.expression() != expression:
+                        await shared_consumer.restart()
+            except Exception:
+                # 启动失败时撤销登记，不留下没有启动的反应器
+                try:
+                    await self._remove_reactor(reactor.reactor_id)
+                except Exception as exc:
+                    logger.error("failed to roll back reactor '%s': %s",
+                                 reactor.reactor_id, exc, exc_info=exc)
+                raise
+
+        logger.info("added reactor '%s' on '%s' with '%s'",
+                    reactor.reactor_id, reactor.topic, reactor.expression)
+
+    async def remove_reactor(self, reactor_id) -> bool:
+        """
+        运行时移除反应器，只停止该反应器的消费者，等待正在处理的消息完成。
+        返回是否存在该反应器。
+        """
+        if not self._running:
+            reactor = self._reactors.pop(reactor_id, None)
+            if reactor is not None and reactor.shared is not None:
+                key = (reactor.topic, reactor.shared)
+                self._shared_consumers[key].remove_reactor(reactor)
+                if not self._shared_consumers[key].reactors:
+                    del self._shared_consumers[key]
+            return reactor is not None
+
+        async with self._reload_lock:
+            removed = await self._remove_reactor(reactor_id)
+
+        if removed:
+            logger.info("removed reactor '%s'", reactor_id)
+        return removed
+
+    async def _remove_reactor(self, reactor_id) -> bool:
+        reactor = self._reactors.pop(reactor_id, None)
+        if reactor is None:
+            return False
+
+        if reactor.shared is None:
+            await reactor.stop()
+            return True
+
+        key = (reactor.topic, reactor.shared)
+        shared_consumer = self._shared_consumers[key]
+        expression = shared_consumer.expression()
+        shared_consumer.remove_reactor(reactor)  # 不再分派新的消息
+        await reactor.stop()
+
+        if not shared_consumer.reactors:
+            del self._shared_consumers[key]
+            await shared_consumer.stop()
+        elif shared_consumer.expression() != expression:
+            await shared_consumer.restart()
+
+        return True
+
+    def register_aggregator(self, aggregator):
+        self._aggregators.append(aggregator)
+
+    def register_action(self, action):
+        """登记带有处理函数的动作，启动时编译其中间件调用链"""
+        self._actions.append(action)
+
+    def use(self, middleware, topic: str = None):
+        """注册中间件，指定topic时只用于该主题的反应器和动作，参见soybean.middleware"""
+        if self._loop is not None:
+            raise RuntimeError("middlewares should be registered before start()")
+
+        if topic is None:
+            self._middlewares.append(middleware)
+        else:
+            self._topic_middlewares.setdefault(topic, []).append(middleware)
+
+    def compile_handler(self, handler, info: HandlerInfo):
+        middlewares = self._middlewares + self._topic_middlewares.get(info.topic, [])
+        return compile_chain(handler, info, middlewares)
 
     def get_running_loop(self):
         return self._loop
 
+    @property
+    def loop_pool(self) -> LoopPool:
+        """处理反应器消息的多个事件循环，没有开启时为None"""
+        return self._loop_pool
+
+    async def run_in_main_loop(self, coroutine):
+        """在主事件循环中执行协程，用于发件箱、发送调度等只属于主事件循环的对象"""
+        if self._loop_pool is None:
+            return await coroutine
+        return await run_in_loop(self._loop, coroutine)
+
+    @property
+    def consume_gate(self) -> PauseGate:
+        return self._consume_gate
+
+    @property
+    def priority_scheduler(self) -> PriorityScheduler:
+        return self._priority_scheduler
+
+    @property
+    def send_scheduler(self) -> SendScheduler:
+        return self._send_scheduler
+
+    @property
+    def compression(self) -> Compression:
+        return self._compression
+
+    @property
+    def blob_store(self) -> BlobStore:
+        """认领检查模式所用的blob存储，没有指定时在首次使用时创建本地文件存储"""
+        if self._blob_store is None:
+            self._blob_store = default_blob_store(self._name)
+        return self._blob_store
+
+    @property
+    def profiler(self) -> Profiler:
+        return self._profiler
+
+    @property
+    def scheduler(self) -> DelayedMessageScheduler:
+        return self._scheduler
+
+    @property
+    def rpc(self) -> RpcClient:
+        """请求/应答的客户端，首次请求时才创建应答主题的消费者"""
+        if self._rpc is None:
+            self._rpc = RpcClient(self)
+        return self._rpc
+
+    @property
+    def outbox(self) -> LocalOutbox:
+        return self._outbox
+
+    async def _send_outboxed(self, record):
+        await send_outbox_record(self, record)
+
+    def get_outbox_relay(self, database, store: OutboxStore = None) -> OutboxRelay:
+        """数据库的发件箱表的中继，缺省为PostgreSQL中的soybean_outbox表"""
+        relay = self._outbox_relays.get(database)
+        if relay is None:
+            if store is None:
+                store = PostgresOutboxStore(database)
+            relay = OutboxRelay(store, self._send_outboxed)
+            self._outbox_relays[database] = relay
+        return relay
+
+    async def _send_delayed(self, delayed_msg, jsonobj):
+        compression = delayed_msg.compression
+        if compression:
+            codec, threshold = compression
+            compression = Compression(codec, threshold)
+
+        action = SendingAction(self, delayed_msg.topic, delayed_msg.tag,
+                               orderly=delayed_msg.orderly,
+                               props=delayed_msg.props,
+                               priority=delayed_msg.priority or PRIORITY_ONLINE,
+                               compression=compression,
+                               claim_check=delayed_msg.claim_check)
+        await action.send(jsonobj, key=delayed_msg.keys)
+
+    @property
+    def log_sample_every(self) -> int:
+        """反应器处理成功的DEBUG日志每多少条记录一条"""
+        return self._log_sample_every
+
+    @property
+    def admin(self) -> AdminServer:
+        return self._admin
+
+    @property
+    def running(self) -> bool:
+        """start()已经完成，且尚未stop()"""
+        return self._running
+
+    @property
+    def health(self) -> HealthChecker:
+        return self._health
+
+    def configure_health(self, **options) -> HealthChecker:
+        """设置就绪与存活检查的参数，options参见HealthChecker"""
+        self._health = HealthChecker(self, **options)
+        return self._health
+
+    async def ready(self, timeout: float = None, interval: float = 0.1):
+        """
+        等待领域启动完毕并通过就绪检查，可以在start()之前调用；
+        超过timeout秒仍未就绪时抛出NotReadyError，其中包含未通过的检查。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            ready, checks = await self._health.readiness()
+            if ready:
+                return checks
+
+            if deadline is not None and loop.time() >= deadline:
+                failed = [name for name, passed in checks.items() if not passed]
+                raise NotReadyError(f"domain '{self._name}' is not ready "
+                                    f"in {timeout}s, failed checks: "
+                                    f"{', '.join(failed)}")
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        """领域的运行统计：各个反应器的消费统计、发送限流、延时消息和发件箱"""
+        reactors = {}
+        for reactor_id, reactor in self._reactors.items():
+            reactors[reactor_id] = reactor.stats.as_dict()
+            reactors[reactor_id]["priority"] = reactor.priority
+            if reactor.prefetch_buffer is not None:
+                reactors[reactor_id]["prefetch"] = reactor.prefetch_buffer.as_dict()
+
+        stats = {
+            "reactors": reactors,
+            "throttle": self._send_scheduler.stats(),
+            "priorities": self._priority_scheduler.stats(),
+            "delayed_messages": len(self._scheduler),
+        }
+        if self._outbox is not None:
+            stats["outbox_pending"] = self._outbox.pending
+        return stats
+
+    @property
+    def capture(self) -> CaptureWriter:
+        return self._capture
+
+    def enable_capture(self, path: str, max_bytes: int = None) -> CaptureWriter:
+        """
+        录制反应器消费的消息，需要在start()之前调用，参见soybean.capture
+        """
+        self._capture = CaptureWriter(path, max_bytes=max_bytes)
+        return self._capture
+
+    def enable_profiling(self, **options) -> Profiler:
+        """
+        开启反应器和动作处理函数的性能剖析，需要在start()之前调用，options参见Profiler
+        """
+        self._profiler = Profiler(**options)
+        return self._profiler
+
+    def pause(self):
+        """暂停领域内所有反应器的消费"""
+        self._consume_gate.pause()
+
+    def resume(self):
+        """恢复领域内所有反应器的消费"""
+        self._consume_gate.resume()
+
     async def start(self):
         self._loop = asyncio.get_running_loop()
+        self._reload_lock = asyncio.Lock()
+
+        if self._lag_monitor is not None:
+            self._lag_monitor.start()
+
+        self._blob_collector.start()
+
+        if self._profiler is not None:
+            self._profiler.start()
+
+        if self._capture is not None:
+            self._capture.open()
+
+        if self._outbox is not None:
+            await self._outbox.start(self._send_outboxed)
+
+        await self._scheduler.start(self._send_delayed)
+
+        for relay in self._outbox_relays.values():
+            await relay.start()
+
+        for aggregator in self._aggregators:
+            await aggregator.start()
+
+        for action in self._actions:
+            action.compile()
+
+        if self._loop_pool is not None:
+            self._loop_pool.start()
 
         for reactor in self._reactors.values():
             await reactor.start()
 
+        for shared_consumer in self._shared_consumers.values():
+            await shared_consumer.start()
+
         for producer in self._producers.values():
             producer.start()
 
+        if self._admin is not None:
+            await self._admin.start()
+
+        self._running = True
+
     async def stop(self):
+        self._running = False
+
+        if self._admin is not None:
+            await self._admin.stop()
+
+        # 先打开闸门，避免被阻塞的消费线程无法结束
+        if self._lag_monitor is not None:
+            await self._lag_monitor.stop()
+        self._consume_gate.resume()
+
+        await self._blob_collector.stop()
+        await self._scheduler.stop()
+
+        for relay in self._outbox_relays.values():
+            await relay.stop()
+
+        for aggregator in self._aggregators:
+            await aggregator.stop()
+
+        if self._rpc is not None:
+            await self._rpc.stop()
+
+        if self._profiler is not None:
+            self._profiler.stop()
+
+        if self._outbox is not None:
+            await self._outbox.stop()
+
         for producer in self._producers.values():
             producer.shutdown()
 
+        for shared_consumer in self._shared_consumers.values():
+            await shared_consumer.stop()
+
         for reactor in self._reactors.values():
             await reactor.stop()
 
+        # 反应器处理完所有消息后保存窗口聚合的状态
+        for aggregator in self._aggregators:
+            aggregator.checkpoint()
+
+        if self._loop_pool is not None:
+            await self._loop_pool.stop()
+
+        if self._capture is not None:
+            self._capture.close()
+
 
 
 class RocketMQ:
     __slots__ = ("_channel",)
 
-    def __init__(self,  domain:str, namesrv_addr: str ="localhost:9876"):
-        self._channel = DomainChannel(domain, namesrv_addr)
+    def __init__(self,  domain:str, namesrv_addr: str ="localhost:9876",
+                 max_inflight: int = None,
+                 max_loop_lag: float = None,
+                 send_rate_limit: float = None,
+                 compression=None,
+                 compress_threshold: int = 4096,
+                 blob_store: BlobStore = None,
+                 scheduler_path: str = None,
+                 outbox_path: str = None,
+                 outbox_mode: str = "failed",
+                 admin_addr: str = None,
+                 log_sample_every: int = 100,
+                 event_loops: int = None,
+                 priority_weights: Dict[str, int] = None,
+                 priority_quotas: Dict[str, int] = None):
+        """
+        max_inflight 领域内所有反应器同时处理的消息数量上限；
+        max_loop_lag asyncio事件循环的延迟超过该秒数时暂停消费，延迟回落后自动恢复；
+        send_rate_limit 领域内所有动作每秒发送的消息数量上限，限流时优先发送在线消息；
+        compression 消息体超过compress_threshold字节时采用的压缩算法，
+            "zlib"、"zstd"、"lz4"或"auto"，缺省不压缩；
+        blob_store 认领检查模式存放大消息体的存储，缺省为本地临时目录下的文件存储；
+        scheduler_path 本地保存延时消息的日志文件，缺省不保存，重启后尚未发送的延时消息将丢失。
+        outbox_path 本地发件箱的目录，无法连接broker时消息先存入发件箱，恢复后在后台补发；
+        outbox_mode 为"failed"时只存入发送失败的消息，为"all"时所有消息都经发件箱发送；
+        admin_addr 管理端点监听的地址，如"127.0.0.1:8300"，提供/stats、/profile
+            和就绪、存活探测/health/ready、/health/live；
+        log_sample_every 反应器处理成功的DEBUG日志每多少条记录一条；
+        event_loops 处理反应器消息的事件循环数量，每个事件循环在单独的线程中运行，
+            缺省所有反应器都在主事件循环中处理，参见soybean.looppool；
+        priority_weights 反应器各个优先级的权重，缺省为{"online": 4, "bulk": 1}，
+            达到max_inflight后排队的消息按权重获得处理名额；
+        priority_quotas 各个优先级同时处理的消息数量上限，如{"bulk": 8}。
+        """
+        outbox = None
+        if outbox_path is not None:
+            outbox = LocalOutbox(outbox_path, mode=outbox_mode)
+
+        self._channel = DomainChannel(
+            domain, namesrv_addr,
+            max_inflight=max_inflight,
+            max_loop_lag=max_loop_lag,
+            send_rate_limit=send_rate_limit,
+            compression=make_compression(compression, compress_threshold),
+            blob_store=blob_store,
+            scheduler_path=scheduler_path,
+            outbox=outbox,
+            admin_addr=admin_addr,
+            log_sample_every=log_sample_every,
+            event_loops=event_loops,
+            priority_weights=priority_weights,
+            priority_quotas=priority_quotas)
     
     def topic(self, topic: str) -> TopicChannel:
         return self._channel.topic(topic)
@@ -105,6 +678,65 @@ class RocketMQ:
     def namesrv_addr(self) -> str:
         return self._channel._namesrv_addr
 
+    def use(self, middleware):
+        """注册领域的中间件，用于所有反应器和动作的处理函数，需要在start()之前调用"""
+        self._channel.use(middleware)
+
+    async def ready(self, timeout: float = None):
+        """
+        等待领域启动完毕，名字服务器可以连接、所有消费者和事件循环都已就绪，
+        超时抛出NotReadyError。
+        """
+        return await self._channel.ready(timeout)
+
+    def configure_health(self, loop_timeout: float = 5.0,
+                         stall_timeout: float = 300.0,
+                         connect_timeout: float = 2.0):
+        """
+        loop_timeout 事件循环执行探测协程的超时秒数；
+        stall_timeout 反应器有在途消息却没有进展的秒数超过该值时，存活检查失败；
+        connect_timeout 连接名字服务器的超时秒数。
+        """
+        self._channel.configure_health(loop_timeout=loop_timeout,
+                                       stall_timeout=stall_timeout,
+                                       connect_timeout=connect_timeout)
+
+    def stats(self):
+        """各个反应器每秒消费的数量、处理延迟的分位数、重新投递次数和消息的等待延迟"""
+        return self._channel.stats()
+
+    def throttle_stats(self):
+        """各个优先级的发送被领域限流的统计"""
+        return self._channel.send_scheduler.stats()
+
+    def enable_profiling(self, slow_callback: float = 0.1,
+                         trace_malloc: bool = False,
+                         sample_interval: float = None) -> Profiler:
+        """
+        开启性能剖析，统计每个处理函数的墙钟时间、CPU时间、内存分配和阻塞事件循环的时长。
+        profiler.format_report()输出报告，profiler.collapsed_stacks()输出火焰图所用的折叠栈。
+        """
+        return self._channel.enable_profiling(slow_callback=slow_callback,
+                                              trace_malloc=trace_malloc,
+                                              sample_interval=sample_interval)
+
+    @property
+    def profiler(self) -> Profiler:
+        return self._channel.profiler
+
+    def enable_capture(self, path: str, max_bytes: int = None) -> CaptureWriter:
+        """
+        录制反应器消费的消息到本地文件，用python -m soybean.replay在本地broker上回放，
+        比较不同版本处理函数的延迟。
+        """
+        return self._channel.enable_capture(path, max_bytes=max_bytes)
+
+    def pause(self):
+        self._channel.pause()
+
+    def resume(self):
+        self._channel.resume()
+
     async def start(self):
         await self._channel.start()
 
@@ -123,43 +755,252 @@ class TopicChannel:
         self._channel = channel
         self._topic = topic
 
-    def react(self, expression: str = "*") -> Any:
-        def _decorator(handler: HandlerType):
-
-            reactors = getattr(handler, "__reactors__", None)
-            if reactors is None:
-                reactors = []
-                setattr(handler, "__reactors__", reactors)
+    def use(self, middleware):
+        """注册该主题的中间件，位于领域中间件的内层"""
+        self._channel.use(middleware, topic=self._topic)
 
-            reactor = Reactor(self._channel,
-                              self._topic, expression,
-                              handler, depth=len(reactors))
+    def react(self, expression: str = "*",
+              max_inflight: int = 1,
+              rate_limit: float = None,
+              shared: Union[str, bool] = None,
+              reply: bool = False,
+              schema: type = None,
+              shard_by_key: bool = False,
+              prefetch: int = None,
+              prefetch_bytes: int = None,
+              priority: str = PRIORITY_ONLINE) -> Any:
+        """
+        max_inflight 该反应器同时处理的消息数量上限，即消费线程数；
+        rate_limit 该反应器每秒处理的消息数量上限（令牌桶）；
+        shared 共享消费者的名称，同一主题上共享名称相同的反应器共用一个消费者，
+            True表示名称为"default"；共享消费者的反应器没有独立的消费位点；
+        reply 处理函数的返回值作为应答发送给请求者，参见respond()；
+        schema 消息的契约，dataclass或TypedDict，处理函数的message参数为按契约解码的对象，
+            不符合契约的消息在调用处理函数之前被拒绝，参见soybean.schema；
+        shard_by_key 开启了多个事件循环时，按消息的键分配事件循环，同一个键的消息在
+            同一个事件循环中处理；缺省整个反应器固定在一个事件循环中；
+        prefetch 预取模式缓冲的消息数量上限，消息放入缓冲区后立即确认，由max_inflight个
+            协程处理，处理失败的消息重新发送给本消费组，参见soybean.prefetch；
+        prefetch_bytes 预取模式缓冲的消息体总字节数上限，指定时prefetch缺省为
+            max_inflight的16倍；
+        priority 反应器的优先级，"online"或"bulk"，领域的处理名额用完时
+            按优先级的权重分配名额，参见soybean.flowcontrol.PriorityScheduler。
+        """
+        def _decorator(handler: HandlerType):
+            reactor = self._create_reactor(handler, expression,
+                                           max_inflight=max_inflight,
+                                           rate_limit=rate_limit,
+                                           shared=shared,
+                                           reply=reply,
+                                           schema=schema,
+                                           shard_by_key=shard_by_key,
+                                           prefetch=prefetch,
+                                           prefetch_bytes=prefetch_bytes,
+                                           priority=priority)
             self._channel.register_reactor(reactor.reactor_id, reactor)
 
         return _decorator
 
+    def _create_reactor(self, handler, expression, max_inflight=1,
+                        rate_limit=None, shared=None, reply=False,
+                        schema=None, shard_by_key=False, prefetch=None,
+                        prefetch_bytes=None,
+                        priority=PRIORITY_ONLINE) -> Reactor:
+        compiled_schema = compile_schema(schema) if schema is not None else None
+        if shared is True:
+            shared = "default"
+        elif shared is False:
+            shared = None
+
+        reactors = getattr(handler, "__reactors__", None)
+        if reactors is None:
+            reactors = []
+            setattr(handler, "__reactors__", reactors)
+
+        return Reactor(self._channel,
+                       self._topic, expression,
+                       handler, depth=len(reactors),
+                       max_inflight=max_inflight,
+                       rate_limit=rate_limit,
+                       shared=shared,
+                       reply=reply,
+                       schema=compiled_schema,
+                       shard_by_key=shard_by_key,
+                       prefetch=prefetch,
+                       prefetch_bytes=prefetch_bytes,
+                       priority=priority)
+
+    async def register_reactor(self, handler: HandlerType,
+                               expression: str = "*", **options) -> str:
+        """
+        运行时注册反应器，options与react()相同，返回反应器的group_id。
+        只启动该反应器的消费者，其它反应器的消费不受影响；处理函数已经注册为反应器时，
+        以新的标签表达式和选项替换。
+        """
+        reactor = self._create_reactor(handler, expression, **options)
+        await self._channel.add_reactor(reactor)
+        return reactor.reactor_id
+
+    async def unregister_reactor(self, handler: HandlerType) -> bool:
+        """运行时注销该主题上处理函数的反应器，返回是否存在这样的反应器"""
+        reactor_ids = [reactor.reactor_id
+                       for reactor in self._channel.reactors()
+                       if reactor.topic == self._topic and reactor.handler is handler]
+
+        removed = False
+        for reactor_id in reactor_ids:
+            removed |= await self._channel.remove_reactor(reactor_id)
+        return removed
+
+    def aggregate(self, expression: str = "*",
+                  window: float = 60,
+                  slide: float = None,
+                  key=None,
+                  value=None,
+                  reducer: str = "count",
+                  emit_tag: str = None,
+                  emit_topic: str = None,
+                  lateness: float = 1.0,
+                  checkpoint_path: str = None,
+                  **options) -> WindowAggregator:
+        """
+        窗口聚合：按消息产生的时刻将事件归入窗口，窗口关闭后每个键的聚合结果作为一条消息，
+        以emit_tag标签发送到emit_topic主题（缺省为本主题），消息体为
+        {"key", "start", "end", "value", "count"}。参数参见WindowAggregator，
+        options与react()相同。
+        """
+        if emit_tag is None:
+            raise ValueError("the emit_tag of the aggregates should be given")
+
+        if emit_topic is None:
+            emit_topic = self._topic
+        else:
+            emit_topic = self._channel.topic(emit_topic)._topic
+        emit_action = SendingAction(self._channel, emit_topic, emit_tag)
+        aggregator = WindowAggregator(window, emit_action.send,
+                                      slide=slide, key=key, value=value,
+                                      reducer=reducer, lateness=lateness,
+                                      checkpoint_path=checkpoint_path)
+
+        async def _aggregate(message, msg_born_timestamp):
+            aggregator.add(message, msg_born_timestamp / 1000)
+
+        # 以聚合结果的主题和标签区分反应器的group_id
+        _aggregate.__module__ = __name__
+        _aggregate.__qualname__ = f"aggregate-{self._topic}-{emit_topic}-{emit_tag}"
+
+        self.react(expression, **options)(_aggregate)
+        self._channel.register_aggregator(aggregator)
+        return aggregator
+
+    def respond(self, expression: str = "*", **options) -> Any:
+        """
+        应答者：处理request()发出的请求消息，处理函数的返回值作为应答发送给请求者，
+        处理函数抛出的异常作为错误应答。options与react()相同。
+        """
+        return self.react(expression, reply=True, **options)
+
+    async def request(self, msg: Any,
+                      tag: str = None,
+                      timeout: float = 10,
+                      props: Dict[str, str] = None,
+                      priority: str = PRIORITY_ONLINE) -> Any:
+        """
+        发送请求消息并等待应答者的应答，返回应答的内容。
+        超时抛出RequestTimeoutError，应答者出错抛出RequestError。
+        """
+        action = SendingAction(self._channel, self._topic, tag,
+                               props=props, priority=priority)
+        return await self._channel.run_in_main_loop(
+            self._channel.rpc.request(action, msg, timeout))
+
     async def send(self, msg: Any,
              key: str = None,
              tag: str = None,
              orderly=False,
-             props: Dict[str, str] = None):
-
+             props: Dict[str, str] = None,
+             priority: str = PRIORITY_ONLINE,
+             compression=None,
+             claim_check: int = None,
+             delay=None,
+             deliver_at=None):
+        """
+        delay为延时发送的秒数或timedelta，deliver_at为投递的时刻(datetime或时间戳)
+        """
         action = SendingAction(self._channel,
                                self._topic, tag,
-                               orderly=orderly, props=props)
-        await action.send(msg)
+                               orderly=orderly, props=props,
+                               priority=priority,
+                               compression=compression,
+                               claim_check=claim_check)
+        await action.send(msg, delay=delay, deliver_at=deliver_at, key=key)
+
+    def action(self, tag=None, orderly=False, props=None,
+               rate_limit: float = None,
+               priority: str = PRIORITY_ONLINE,
+               compression=None,
+               claim_check: int = None,
+               delay=None,
+               mode: str = "transaction",
+               outbox_store: OutboxStore = None,
+               schema: type = None,
+               cache=None):
+        """
+        rate_limit 该动作每秒发送的消息数量上限；
+        priority 发送优先级，"online"或"bulk"，领域限流时优先发送online的消息；
+        compression 该动作的压缩算法，缺省沿用领域的设置，False表示不压缩；
+        claim_check 消息体达到该字节数时存入领域的blob存储，消息中只发送引用；
+        delay 该动作的消息延时投递的秒数或timedelta；
+        mode 数据库事务函数的动作发送消息的方式，"transaction"为事务性消息，
+            "outbox"为在同一事务中写入发件箱表，事务提交后由中继成批发送；
+        outbox_store 发件箱表的存储，缺省为数据库中的soybean_outbox表；
+        schema 消息的契约，dataclass或TypedDict，处理函数的结果按契约编码后发送；
+        cache 缓存处理函数的结果，True、缓存的秒数或soybean.cache.ActionCache，
+            只用于结果只取决于参数的处理函数，不适用于数据库事务函数。
+        """
+        compiled_schema = compile_schema(schema) if schema is not None else None
+        action_cache = make_action_cache(cache)
+        if mode not in ("transaction", "outbox"):
+            raise ValueError(f"unknown action mode '{mode}', "
+                             f"expected 'transaction' or 'outbox'")
 
-    def action(self, tag=None, orderly=False, props=None):
         def _decorator(handler):
 
             sqlblock_meta = getattr(handler, "__sqlblock_meta__", None)
-            if sqlblock_meta is not None:
+            if sqlblock_meta is not None and action_cache is not None:
+                raise ValueError("the results of transactional actions "
+                                 "can not be cached")
+
+            if sqlblock_meta is not None and mode == "outbox":
+                action = OutboxedAction(
+                    self._channel,
+                    sqlblock_meta._wrapped_func,
+                    sqlblock_meta._database,
+                    self._topic, tag, props,
+                    store=outbox_store,
+                    schema=compiled_schema)
+                self._channel.register_action(action)
+
+                async def _wrapped_action(*args, **kwargs):
+                    return await action.execute(*args, **kwargs)
+
+                functools.update_wrapper(_wrapped_action, handler)
+                return _wrapped_action
+
+            elif sqlblock_meta is not None:
+                if is_local_addr(self._channel.namesrv_addr):
+                    raise ValueError("the local broker does not support "
+                                     "transactional messages, "
+                                     "use mode='outbox' instead")
+
                 # transactional action
                 action = TransactionalAction(
                     self._channel,
                     sqlblock_meta._wrapped_func,
                     sqlblock_meta._database,
-                    self._topic, tag, props)
+                    self._topic, tag, props,
+                    schema=compiled_schema)
+                self._channel.register_action(action)
 
                 async def _wrapped_action(*args, **kwargs):
                     return await action.execute(*args, **kwargs)
@@ -174,11 +1015,22 @@ class TopicChannel:
             else:
                 # the simple action
                 action = SimpleAction(self._channel, handler, self._topic, tag,
-                                      orderly=orderly, props=props)
+                                      orderly=orderly, props=props,
+                                      rate_limit=rate_limit,
+                                      priority=priority,
+                                      compression=compression,
+                                      claim_check=claim_check,
+                                      delay=delay,
+                                      schema=compiled_schema,
+                                      cache=action_cache)
+                self._channel.register_action(action)
 
                 async def _wrapped_action(*args, **kwargs):
                     return await action.execute(*args, **kwargs)
 
+                setattr(_wrapped_action, "throttle_stats",
+                        action.throttle_stats)
+                setattr(_wrapped_action, "cache", action.cache)
                 functools.update_wrapper(_wrapped_action, handler)
                 return _wrapped_action
 
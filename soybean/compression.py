@@ -0,0 +1,140 @@
+"""
+消息体压缩。
+
+消息体超过阈值时压缩后再发送，所用的压缩算法记录在消息属性COMPRESSION_PROPERTY中，
+反应器读取消息体时根据该属性透明地解压。zlib总是可用，zstd和lz4需要分别安装
+zstandard和lz4包。
+
+rocketmq-client-python以C字符串的方式传递消息体，遇到NUL字节就会截断，
+因此压缩后的数据经过base64编码再作为消息体发送。
+"""
+import zlib
+import base64
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+COMPRESSION_PROPERTY = "soybean_compression"
+
+
+class Codec:
+    __slots__ = ("name", "compress", "decompress")
+
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+def _make_zlib_codec(level):
+    level = 6 if level is None else level
+    return Codec("zlib",
+                 lambda data: zlib.compress(data, level),
+                 zlib.decompress)
+
+
+def _make_zstd_codec(level):
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+    decompressor = zstandard.ZstdDecompressor()
+    return Codec("zstd", compressor.compress, decompressor.decompress)
+
+
+def _make_lz4_codec(level):
+    level = 0 if level is None else level
+    return Codec("lz4",
+                 lambda data: lz4_frame.compress(data, compression_level=level),
+                 lz4_frame.decompress)
+
+
+_codec_factories = {"zlib": _make_zlib_codec}
+if zstandard is not None:
+    _codec_factories["zstd"] = _make_zstd_codec
+if lz4_frame is not None:
+    _codec_factories["lz4"] = _make_lz4_codec
+
+# 解压不需要压缩级别，所有可用的算法共用一组解压器
+_decompressors = {name: factory(None).decompress
+                  for name, factory in _codec_factories.items()}
+
+
+def available_codecs():
+    return list(_codec_factories)
+
+
+def get_codec(name: str, level: int = None) -> Codec:
+    """
+    按名称获取压缩算法，名称为"auto"时优先选择zstd，其次zlib。
+    """
+    if name == "auto":
+        name = "zstd" if "zstd" in _codec_factories else "zlib"
+
+    factory = _codec_factories.get(name)
+    if factory is None:
+        raise ValueError(f"the compression '{name}' is not available, "
+                         f"expected one of {available_codecs()}")
+
+    return factory(level)
+
+
+class Compression:
+    """压缩策略：消息体超过threshold字节时用codec压缩，压缩后没有变小则保持原样"""
+
+    __slots__ = ("_codec", "_threshold")
+
+    def __init__(self, codec: str = "auto", threshold: int = 4096,
+                 level: int = None):
+        self._codec = get_codec(codec, level)
+        self._threshold = threshold
+
+    @property
+    def codec_name(self) -> str:
+        return self._codec.name
+
+    @property
+    def threshold(self) -> int:
+        return self._threshold
+
+    def compress(self, body: bytes):
+        """返回(消息体, 压缩算法名称)，没有压缩时算法名称为None"""
+        if len(body) < self._threshold:
+            return body, None
+
+        compressed = base64.b64encode(self._codec.compress(body))
+        if len(compressed) >= len(body):
+            return body, None
+
+        return compressed, self._codec.name
+
+
+def decompress(body: bytes, codec_name: str) -> bytes:
+    decompressor = _decompressors.get(codec_name)
+    if decompressor is None:
+        raise ValueError(f"unable to decompress the message body "
+                         f"compressed by unavailable '{codec_name}'")
+
+    return decompressor(base64.b64decode(body))
+
+
+def make_compression(compression, threshold: int = 4096):
+    """
+    将compression参数规范为Compression对象：None或False表示不压缩，True等同于"auto"，
+    字符串为压缩算法名称，Compression对象保持原样。
+    """
+    if compression is None or compression is False:
+        return None
+
+    if isinstance(compression, Compression):
+        return compression
+
+    if compression is True:
+        compression = "auto"
+
+    return Compression(compression, threshold)
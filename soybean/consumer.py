@@ -0,0 +1,138 @@
+"""
+共享消费者。
+
+每个反应器缺省独占一个PushConsumer，拥有自己的消费组、线程、心跳和负载均衡。
+同一主题上声明了相同共享名称的反应器共用一个PushConsumer，broker按照这些反应器
+标签表达式的并集投递消息，再在进程内按标签分派给各个反应器。
+
+共享消费者只有一个消费位点：任一反应器处理失败，整条消息都会被重新投递。
+为了不重复执行已经成功的处理函数，共享消费者记录重新投递的消息已被哪些反应器成功处理。
+需要独立消费位点的反应器不应共享消费者。
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from rocketmq.client import ConsumeStatus
+
+from .utils import pinyin_translate, get_msg_property
+from .router import TagRouter
+
+logger = logging.getLogger("soybean.consumer")
+
+
+def make_shared_group_id(channel_name, topic, name):
+    channel_name = pinyin_translate(channel_name)
+    name = pinyin_translate(name)
+    return f"{channel_name}%{topic}-shared-{name}"
+
+
+class SharedConsumer:
+
+    def __init__(self, channel, topic: str, name: str,
+                 max_tracked_messages: int = 10000):
+
+        self._channel = channel
+        self._topic = topic
+        self._name = name
+        self._group_id = make_shared_group_id(channel.name, topic, name)
+
+        self._router = TagRouter()
+        self._consumer = None
+
+        # 消息id => 已经成功处理该消息的反应器id集合，只保留最近的部分消息
+        self._completed = OrderedDict()
+        self._completed_lock = threading.Lock()
+        self._max_tracked_messages = max_tracked_messages
+
+    @property
+    def group_id(self) -> str:
+        return self._group_id
+
+    @property
+    def reactors(self):
+        return self._router.targets()
+
+    @property
+    def started(self) -> bool:
+        return self._consumer is not None
+
+    def add_reactor(self, reactor):
+        self._router.add(reactor.expression, reactor)
+
+    def remove_reactor(self, reactor):
+        self._router.remove(reactor)
+
+    def expression(self) -> str:
+        """所有反应器标签表达式的并集"""
+        return self._router.expression()
+
+    async def start(self):
+        consumer = self._channel.create_consumer(self._group_id)
+
+        thread_count = sum(r.max_inflight for r in self._router.targets())
+        consumer.set_thread_count(max(thread_count, 1))
+
+        consumer.subscribe(self._topic, self._dispatch,
+                           expression=self.expression())
+        consumer.start()
+
+        self._consumer = consumer
+
+    async def stop(self):
+        await asyncio.gather(*(r.wait_idle() for r in self._router.targets()))
+
+        # 与Reactor.stop相同，等待rocket-client-cpp处理完消费线程再关闭
+        await asyncio.sleep(0.5)
+
+        if self._consumer is not None:
+            self._consumer.shutdown()
+            self._consumer = None
+
+    async def restart(self):
+        """标签表达式的并集变化后，以新的表达式重新订阅"""
+        await self.stop()
+        await self.start()
+        logger.info("shared consumer '%s' resubscribed with '%s'",
+                    self._group_id, self.expression())
+
+    def _dispatch(self, msg):
+        capture = self._channel.capture
+        if capture is not None:
+            capture.write(msg)
+
+        tags = msg.tags
+        tag = tags.decode("utf-8") if tags else ""
+
+        reactors = self._router.route(tag)
+        if not reactors:
+            return ConsumeStatus.CONSUME_SUCCESS
+
+        msg_id = get_msg_property(msg, "ORIGIN_MESSAGE_ID") or msg.id
+        completed = None
+        if msg.reconsume_times > 0:
+            with self._completed_lock:
+                completed = self._completed.get(msg_id)
+
+        status = ConsumeStatus.CONSUME_SUCCESS
+        for reactor in reactors:
+            if completed is not None and reactor.reactor_id in completed:
+                continue
+
+            if reactor.consume(msg) == ConsumeStatus.CONSUME_SUCCESS:
+                if completed is None:
+                    completed = set()
+                completed.add(reactor.reactor_id)
+            else:
+                status = ConsumeStatus.RECONSUME_LATER
+
+        with self._completed_lock:
+            if status == ConsumeStatus.CONSUME_SUCCESS:
+                self._completed.pop(msg_id, None)
+            else:
+                self._completed[msg_id] = completed or set()
+                self._completed.move_to_end(msg_id)
+                while len(self._completed) > self._max_tracked_messages:
+                    self._completed.popitem(last=False)
+
+        return status
@@ -16,3 +16,16 @@ class ActionError(Exception):
 class TrasnactionPreparingError(ActionError):
     ...
 
+class RequestError(ActionError):
+    ...
+
+class RequestTimeoutError(RequestError):
+    ...
+
+
+class MessageSchemaError(ValueError):
+    ...
+
+
+class NotReadyError(Exception):
+    ...
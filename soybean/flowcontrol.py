@@ -0,0 +1,512 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from .stats import LogHistogram
+
+logger = logging.getLogger("soybean.flowcontrol")
+
+
+class TokenBucket:
+    """令牌桶限流器，线程安全。
+
+    rate为每秒产生的令牌数，burst为桶的容量，缺省与rate相同（至少为1）。
+    令牌可以预支，预支的调用者按照先后次序依次等待，因此长期速率不会超过rate。
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        if rate <= 0:
+            raise ValueError(f"the rate of token bucket should be positive: {rate}")
+
+        self._rate = float(rate)
+        self._capacity = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self._capacity
+        self._timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def reserve(self, tokens: float = 1) -> float:
+        """预定令牌，返回在使用令牌前需要等待的秒数，返回0则表示可立即使用"""
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+
+            return -self._tokens / self._rate
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """如果桶内有足够的令牌则取走并返回True，否则不预支令牌，返回False"""
+        with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+
+            self._tokens -= tokens
+            return True
+
+    def time_to_available(self, tokens: float = 1) -> float:
+        """桶内积累足够的令牌还需要等待的秒数"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                return 0.0
+
+            return (tokens - self._tokens) / self._rate
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._timestamp
+        self._timestamp = now
+        self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+
+    def acquire(self, tokens: float = 1) -> float:
+        """阻塞当前线程直到获得令牌，返回等待的秒数"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """协程方式等待获得令牌，返回等待的秒数"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class InflightLimiter:
+    """在途消息数量的限制，线程安全。
+
+    acquire()占用一个名额，如果名额已经用完则阻塞等待；release()归还名额。
+    """
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError(f"the in-flight limit should be at least 1: {limit}")
+
+        self._limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._inflight = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def acquire(self):
+        self._semaphore.acquire()
+        with self._lock:
+            self._inflight += 1
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+        self._semaphore.release()
+
+
+class PauseGate:
+    """消费闸门。
+
+    pause()关闭闸门后，消费线程在wait()处阻塞，直到resume()重新打开闸门。
+    """
+
+    def __init__(self):
+        self._opened = threading.Event()
+        self._opened.set()
+
+    def is_paused(self) -> bool:
+        return not self._opened.is_set()
+
+    def pause(self):
+        self._opened.clear()
+
+    def resume(self):
+        self._opened.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._opened.wait(timeout)
+
+
+class LoopLagMonitor:
+    """事件循环延迟监视器。
+
+    周期性地在loop中休眠interval秒，实际唤醒时刻与预期时刻之差即为loop的延迟。
+    延迟超过max_lag时关闭消费闸门，连续resume_samples次回落到resume_lag以下后
+    再重新打开，避免闸门频繁开关。
+    """
+
+    def __init__(self, gate: PauseGate,
+                 max_lag: float,
+                 resume_lag: float = None,
+                 interval: float = 0.1,
+                 resume_samples: int = 3):
+
+        self._gate = gate
+        self._max_lag = max_lag
+        self._resume_lag = resume_lag if resume_lag is not None else max_lag / 2
+        self._interval = interval
+        self._resume_samples = resume_samples
+        self._lag = 0.0
+        self._task = None
+
+    @property
+    def lag(self) -> float:
+        return self._lag
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run(loop))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self._gate.resume()
+
+    async def _run(self, loop):
+        gate = self._gate
+        interval = self._interval
+        recovered = 0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = loop.time() - started - interval
+            self._lag = lag
+
+            if not gate.is_paused():
+                if lag > self._max_lag:
+                    gate.pause()
+                    recovered = 0
+                    logger.warning("event loop lags %.3fs behind, "
+                                   "consumers paused", lag)
+                continue
+
+            if lag >= self._resume_lag:
+                recovered = 0
+                continue
+
+            recovered += 1
+            if recovered >= self._resume_samples:
+                gate.resume()
+                logger.info("event loop lag recovered to %.3fs, "
+                            "consumers resumed", lag)
+
+
+class FlowController:
+    """消费流控，消费线程在处理消息之前调用enter()，处理之后调用leave()。
+
+    enter()依次经过消费闸门、速率限制和在途数量限制，任何一个条件不满足都会阻塞
+    消费线程，消费线程被阻塞后便不再从broker获取新的消息，从而形成背压。
+    """
+
+    __slots__ = ("_gate", "_rate_limiter", "_inflight_limiters")
+
+    def __init__(self,
+                 gate: PauseGate = None,
+                 rate_limiter: TokenBucket = None,
+                 inflight_limiters=()):
+
+        self._gate = gate
+        self._rate_limiter = rate_limiter
+        self._inflight_limiters = tuple(l for l in inflight_limiters
+                                        if l is not None)
+
+    def enter(self):
+        if self._gate is not None:
+            self._gate.wait()
+
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+
+        for limiter in self._inflight_limiters:
+            limiter.acquire()
+
+    def leave(self):
+        for limiter in reversed(self._inflight_limiters):
+            limiter.release()
+
+
+PRIORITY_ONLINE = "online"
+PRIORITY_BULK = "bulk"
+
+SEND_PRIORITIES = (PRIORITY_ONLINE, PRIORITY_BULK)
+
+
+def check_send_priority(priority):
+    if priority not in SEND_PRIORITIES:
+        raise ValueError(f"unknown sending priority '{priority}', "
+                         f"expected one of {SEND_PRIORITIES}")
+
+
+class ThrottleStats:
+    """发送限流的统计：发送次数、被限流的次数、累计和最大的限流等待秒数"""
+
+    __slots__ = ("count", "throttled", "total_delay", "max_delay")
+
+    def __init__(self):
+        self.count = 0
+        self.throttled = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    def record(self, delay: float):
+        self.count += 1
+        if delay <= 0:
+            return
+
+        self.throttled += 1
+        self.total_delay += delay
+        if delay > self.max_delay:
+            self.max_delay = delay
+
+    def as_dict(self):
+        mean = self.total_delay / self.throttled if self.throttled else 0.0
+        return {
+            "count": self.count,
+            "throttled": self.throttled,
+            "total_delay": self.total_delay,
+            "mean_delay": mean,
+            "max_delay": self.max_delay,
+        }
+
+
+class SendScheduler:
+    """领域内消息发送的调度器。
+
+    限制领域内所有动作的发送速率，令牌不足时发送按照优先级排队：在线(online)和
+    批量(bulk)两类发送同时排队时，总是优先放行在线发送，批量任务因此不会挤占
+    对延迟敏感的在线业务。未设置速率时不做任何限制。
+    """
+
+    def __init__(self, rate: float = None, burst: float = None):
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._queues = {p: deque() for p in SEND_PRIORITIES}
+        self._stats = {p: ThrottleStats() for p in SEND_PRIORITIES}
+        self._dispatcher = None
+
+    def stats(self):
+        return {p: s.as_dict() for p, s in self._stats.items()}
+
+    @property
+    def limited(self) -> bool:
+        return self._bucket is not None
+
+    async def acquire(self, priority: str = PRIORITY_ONLINE) -> float:
+        """等待发送许可，返回被限流等待的秒数"""
+        if self._bucket is None:
+            return 0.0
+
+        stats = self._stats[priority]
+        if not self._has_waiters() and self._bucket.try_acquire():
+            stats.record(0.0)
+            return 0.0
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        waiter = loop.create_future()
+        self._queues[priority].append(waiter)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        await waiter
+
+        delay = loop.time() - started
+        stats.record(delay)
+        return delay
+
+    def _has_waiters(self):
+        return any(self._queues.values())
+
+    def _next_waiter(self):
+        for priority in SEND_PRIORITIES:
+            queue = self._queues[priority]
+            while queue and queue[0].done():  # 已被取消的等待
+                queue.popleft()
+            if queue:
+                return queue
+        return None
+
+    async def _dispatch(self):
+        bucket = self._bucket
+        while True:
+            queue = self._next_waiter()
+            if queue is None:
+                return
+
+            delay = bucket.time_to_available()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue  # 等待期间可能有更高优先级的发送加入排队
+
+            if bucket.try_acquire():
+                queue.popleft().set_result(None)
+
+
+DEFAULT_PRIORITY_WEIGHTS = {PRIORITY_ONLINE: 4, PRIORITY_BULK: 1}
+
+
+class _SlotWaiter:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = threading.Event()
+
+
+class PriorityScheduler:
+    """领域内反应器处理名额的加权调度，线程安全。
+
+    slots为领域的处理名额，即领域的max_inflight，None表示不限。名额用完后消费线程
+    按照反应器的优先级排队，名额空出时在有消息排队的优先级之间按权重平滑轮转地分配：
+    权重为4:1时，持续排队的online和bulk消息按4:1获得名额，bulk不会饿死。
+    quotas限制各个优先级同时占用的名额，达到配额的优先级即使有空闲名额也要排队。
+    """
+
+    def __init__(self, slots: int = None, weights=None, quotas=None):
+        if slots is not None and slots < 1:
+            raise ValueError(f"the in-flight limit should be at least 1: {slots}")
+
+        weights = dict(weights or DEFAULT_PRIORITY_WEIGHTS)
+        for priority, weight in weights.items():
+            if weight <= 0:
+                raise ValueError(f"the weight of priority '{priority}' "
+                                 f"should be positive: {weight}")
+
+        quotas = dict(quotas or {})
+        for priority, quota in quotas.items():
+            if priority not in weights:
+                raise ValueError(f"unknown priority '{priority}' in the quotas")
+            if quota < 1:
+                raise ValueError(f"the quota of priority '{priority}' "
+                                 f"should be at least 1: {quota}")
+
+        self._slots = slots
+        self._weights = weights
+        self._quotas = quotas
+
+        self._lock = threading.Lock()
+        self._used = 0
+        self._inflight = {p: 0 for p in weights}
+        self._queues = {p: deque() for p in weights}
+        self._credits = {p: 0 for p in weights}
+        self._delayed = {p: 0 for p in weights}
+        self._queue_delays = {p: LogHistogram() for p in weights}
+
+    @property
+    def priorities(self):
+        return tuple(self._weights)
+
+    def check_priority(self, priority):
+        if priority not in self._weights:
+            raise ValueError(f"unknown reacting priority '{priority}', "
+                             f"expected one of {self.priorities}")
+
+    def slot(self, priority: str) -> "PrioritySlot":
+        """返回该优先级的名额，与InflightLimiter相同的接口，用于FlowController"""
+        self.check_priority(priority)
+        return PrioritySlot(self, priority)
+
+    def _has_room(self, priority) -> bool:
+        if self._slots is not None and self._used >= self._slots:
+            return False
+        quota = self._quotas.get(priority)
+        return quota is None or self._inflight[priority] < quota
+
+    def _take(self, priority):
+        self._used += 1
+        self._inflight[priority] += 1
+
+    def acquire(self, priority: str) -> float:
+        """阻塞当前线程直到获得名额，返回排队等待的秒数"""
+        with self._lock:
+            # 有空闲名额时排队的只会是达到配额的优先级，不妨碍其它优先级
+            if not self._queues[priority] and self._has_room(priority):
+                self._take(priority)
+                self._queue_delays[priority].record(0.0)
+                return 0.0
+
+            waiter = _SlotWaiter()
+            self._queues[priority].append(waiter)
+
+        started = time.monotonic()
+        waiter.granted.wait()
+        delay = time.monotonic() - started
+
+        with self._lock:
+            self._delayed[priority] += 1
+            self._queue_delays[priority].record(delay)
+        return delay
+
+    def release(self, priority: str):
+        with self._lock:
+            self._used -= 1
+            self._inflight[priority] -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """将空出的名额分配给排队的消费线程，调用者持有锁"""
+        while True:
+            candidates = [p for p, queue in self._queues.items()
+                          if queue and self._has_room(p)]
+            if not candidates:
+                return
+
+            # 平滑加权轮转(smooth weighted round-robin)
+            total = 0
+            for priority in candidates:
+                self._credits[priority] += self._weights[priority]
+                total += self._weights[priority]
+            chosen = max(candidates, key=self._credits.__getitem__)
+            self._credits[chosen] -= total
+
+            self._take(chosen)
+            self._queues[chosen].popleft().granted.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                p: {
+                    "weight": self._weights[p],
+                    "quota": self._quotas.get(p),
+                    "inflight": self._inflight[p],
+                    "queued": len(self._queues[p]),
+                    "delayed": self._delayed[p],
+                    "queue_delay": self._queue_delays[p].summary(),
+                }
+                for p in self._weights
+            }
+
+
+class PrioritySlot:
+    """一个优先级的处理名额"""
+
+    __slots__ = ("_scheduler", "_priority")
+
+    def __init__(self, scheduler: PriorityScheduler, priority: str):
+        self._scheduler = scheduler
+        self._priority = priority
+
+    @property
+    def priority(self) -> str:
+        return self._priority
+
+    def acquire(self) -> float:
+        return self._scheduler.acquire(self._priority)
+
+    def release(self):
+        self._scheduler.release(self._priority)
@@ -0,0 +1,119 @@
+"""
+就绪与存活检查。
+
+原生的rocketmq-client-cpp启动消费者和生产者时只是创建了后台线程，并不报告是否已经
+连接broker。就绪检查由以下几项组成，全部通过时领域才可以接收流量：
+* started   领域已经启动完毕；
+* namesrv   至少一个名字服务器的地址可以建立TCP连接（本地broker总是通过）；
+* consumers 所有反应器的消费者都已经启动；
+* loops     每个事件循环都能在loop_timeout秒内执行协程。
+
+存活检查只判断进程是否需要重启：
+* loops     同上，事件循环卡住时消费线程桥接到事件循环的调用都会阻塞；
+* reactors  有消息在途、却在stall_timeout秒内没有处理完成任何消息的反应器，
+            通常是处理函数或消费线程被阻塞。
+主事件循环卡住时管理端点本身无法应答，由探测方的超时发现。
+"""
+import asyncio
+import logging
+
+from .looppool import run_in_loop
+
+logger = logging.getLogger("soybean.health")
+
+
+class HealthChecker:
+    """
+    loop_timeout 事件循环执行探测协程的超时秒数；
+    stall_timeout 反应器没有进展的秒数超过该值时存活检查失败；
+    connect_timeout 连接名字服务器的超时秒数。
+    """
+
+    def __init__(self, channel, loop_timeout: float = 5.0,
+                 stall_timeout: float = 300.0,
+                 connect_timeout: float = 2.0):
+        self._channel = channel
+        self._loop_timeout = loop_timeout
+        self._stall_timeout = stall_timeout
+        self._connect_timeout = connect_timeout
+
+    async def readiness(self):
+        """返回(是否就绪, 各项检查的结果)"""
+        channel = self._channel
+        checks = {"started": channel.running}
+        if not checks["started"]:
+            return False, checks
+
+        checks["namesrv"] = await self._check_namesrv()
+        checks["consumers"] = self._check_consumers()
+        checks["loops"] = await self._check_loops()
+        return all(checks.values()), checks
+
+    async def liveness(self):
+        """返回(是否存活, 各项检查的结果)，领域没有启动时总是存活"""
+        if not self._channel.running:
+            return True, {"started": False}
+
+        stalled = self._stalled_reactors()
+        checks = {
+            "loops": await self._check_loops(),
+            "reactors": not stalled,
+        }
+        if stalled:
+            checks["stalled"] = stalled
+        return checks["loops"] and not stalled, checks
+
+    async def _check_namesrv(self) -> bool:
+        channel = self._channel
+        if channel.is_local:
+            return True
+
+        for addr in channel.namesrv_addr.split(";"):
+            host, _, port = addr.strip().rpartition(":")
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, int(port)),
+                    self._connect_timeout)
+            except (OSError, ValueError, asyncio.TimeoutError) as exc:
+                logger.debug("name server '%s' is unreachable: %s", addr, exc)
+                continue
+
+            writer.close()
+            return True
+
+        return False
+
+    def _check_consumers(self) -> bool:
+        for reactor in self._channel.reactors():
+            if reactor.shared is None and not reactor.started:
+                return False
+
+        return all(shared_consumer.started
+                   for shared_consumer in self._channel.shared_consumers())
+
+    async def _check_loops(self) -> bool:
+        loop_pool = self._channel.loop_pool
+        if loop_pool is None:
+            return True
+
+        for loop in loop_pool.loops:
+            try:
+                await asyncio.wait_for(run_in_loop(loop, _ping()),
+                                       self._loop_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("an event loop did not respond in %.1fs",
+                               self._loop_timeout)
+                return False
+        return True
+
+    def _stalled_reactors(self):
+        stalled = {}
+        for reactor in self._channel.reactors():
+            seconds = reactor.stats.stalled()
+            if seconds > self._stall_timeout:
+                stalled[reactor.reactor_id] = seconds
+        return stalled
+
+
+async def _ping():
+    return True
@@ -0,0 +1,271 @@
+"""
+压测工具：按目标速率发送消息，或者消费消息并统计端到端的延迟。
+
+    python -m soybean.loadgen publish --domain 压测 --topic Order --tag Created \\
+        --rate 1000 --producers 4 --duration 60 --payload '{"amount": 100}'
+    python -m soybean.loadgen sink --domain 压测 --topic Order --duration 60
+    python -m soybean.loadgen both --namesrv local --rate 0 --duration 10
+
+--namesrv local使用进程内的本地broker，此时应使用both模式在同一进程内发送和消费。
+每个发送者在自己的线程和事件循环中用SendingAction发送，--rate为0表示不限速。
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+from .channel import DomainChannel
+from .action.simple import SendingAction
+from .exceptions import ActionError
+from .stats import LogHistogram
+
+
+class LoadStats:
+    """多个线程共享的计数和延迟直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._errors = 0
+        self._latency = LogHistogram()
+        self._last_error = None
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def record(self, latency: float):
+        with self._lock:
+            self._count += 1
+            self._latency.record(latency)
+
+    def error(self, exc):
+        with self._lock:
+            self._errors += 1
+            self._last_error = exc
+
+    def summary(self):
+        with self._lock:
+            summary = self._latency.summary()
+            summary["errors"] = self._errors
+            summary["last_error"] = str(self._last_error or "")
+            return summary
+
+
+async def publish(channel, topic, tag, payload, stats: LoadStats,
+                  rate: float = None, count: int = None,
+                  deadline: float = None):
+    """发送count条消息或者直到deadline时刻，rate为每秒发送的上限"""
+    action = SendingAction(channel, topic, tag, rate_limit=rate or None)
+
+    seq = 0
+    while (count is None or seq < count) and \
+            (deadline is None or time.time() < deadline):
+        msg = {"seq": seq, "sent_at": time.time(), "payload": payload}
+        seq += 1
+
+        started = time.perf_counter()
+        try:
+            await action.send(msg)
+        except ActionError as exc:
+            stats.error(exc)
+            continue
+        stats.record(time.perf_counter() - started)
+
+
+def make_sink(stats: LoadStats):
+    """消费压测消息的处理函数，统计从发送到开始处理的端到端延迟"""
+
+    async def loadgen_sink(message):
+        stats.record(max(time.time() - message["sent_at"], 0.0))
+
+    # 消费组的名称由处理函数的限定名称生成，不能含有'<locals>'
+    loadgen_sink.__qualname__ = "loadgen_sink"
+    return loadgen_sink
+
+
+def _run_publisher(args, index, stats, deadline):
+    # 同一进程内的生产者组不能重复，每个发送者使用各自的领域名称
+    domain = args.domain if index == 0 else f"{args.domain}_{index}"
+    rate = args.rate / args.producers if args.rate else None
+    count = None
+    if args.count:
+        count = args.count // args.producers
+        if index < args.count % args.producers:
+            count += 1
+
+    async def _main():
+        channel = DomainChannel(domain, args.namesrv)
+        await channel.start()
+        try:
+            await publish(channel, args.topic, args.tag, args.payload, stats,
+                          rate=rate, count=count, deadline=deadline)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_main())
+
+
+def _run_sink(args, stats, stopping: threading.Event, started: threading.Event,
+              errors: list):
+    async def _main():
+        channel = DomainChannel(args.domain, args.namesrv)
+        channel.topic(args.topic).react(args.expression,
+                                        max_inflight=args.threads)(make_sink(stats))
+        await channel.start()
+        started.set()
+        try:
+            while not stopping.is_set():
+                await asyncio.sleep(0.1)
+        finally:
+            await channel.stop()
+
+    try:
+        asyncio.run(_main())
+    except Exception as exc:
+        errors.append(exc)
+    finally:
+        # 启动失败时也要唤醒等待的主线程
+        started.set()
+
+
+def _start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def _format(name, stats: LoadStats, elapsed, last_count):
+    summary = stats.summary()
+    rate = (stats.count - last_count) / elapsed if elapsed else 0.0
+    return (f"{name:<8s} count={stats.count:<10d} rate={rate:10.1f}/s "
+            f"errors={summary['errors']:<6d} "
+            f"p50={summary['p50'] * 1000:8.2f}ms "
+            f"p99={summary['p99'] * 1000:8.2f}ms "
+            f"max={summary['max'] * 1000:8.2f}ms")
+
+
+def _report(name, stats, started):
+    summary = stats.summary()
+    elapsed = time.time() - started
+    print(f"== {name}: {stats.count} messages in {elapsed:.1f}s, "
+          f"{stats.count / elapsed if elapsed else 0:.1f}/s, "
+          f"{summary['errors']} errors")
+    for key in ("mean", "p50", "p90", "p99", "p999", "max"):
+        print(f"   {key:>5s} {summary[key] * 1000:10.3f}ms")
+    if summary["last_error"]:
+        print(f"   last error: {summary['last_error']}")
+
+
+def run(args):
+    sending = args.mode in ("publish", "both")
+    sinking = args.mode in ("sink", "both")
+
+    publish_stats, sink_stats = LoadStats(), LoadStats()
+    stopping, sink_started = threading.Event(), threading.Event()
+    sink_errors = []
+
+    sink_thread = None
+    if sinking:
+        sink_thread = _start_thread(_run_sink, args, sink_stats,
+                                    stopping, sink_started, sink_errors)
+        sink_started.wait()
+        if sink_errors:
+            print(f"the sink failed to start: {sink_errors[0]!r}",
+                  file=sys.stderr)
+            return 1
+
+    started = time.time()
+    deadline = None if args.count else started + args.duration
+
+    publishers = []
+    if sending:
+        publishers = [_start_thread(_run_publisher, args, i,
+                                    publish_stats, deadline)
+                      for i in range(args.producers)]
+
+    last = {"publish": 0, "sink": 0}
+    try:
+        while True:
+            time.sleep(args.interval)
+            if sending:
+                print(_format("publish", publish_stats, args.interval,
+                              last["publish"]))
+                last["publish"] = publish_stats.count
+            if sinking:
+                print(_format("sink", sink_stats, args.interval, last["sink"]))
+                last["sink"] = sink_stats.count
+
+            if sending:
+                if not any(t.is_alive() for t in publishers):
+                    break
+            elif time.time() >= started + args.duration:
+                break
+
+        if args.mode == "both":
+            # 等待消费完已经发送的消息
+            grace = time.time() + args.drain_timeout
+            while sink_stats.count < publish_stats.count and time.time() < grace:
+                time.sleep(0.1)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        stopping.set()
+        if sink_thread is not None:
+            sink_thread.join()
+
+    if sending:
+        _report("publish", publish_stats, started)
+    if sinking:
+        _report("sink (end-to-end)", sink_stats, started)
+        if sink_errors:
+            print(f"the sink failed: {sink_errors[0]!r}", file=sys.stderr)
+            return 1
+
+
+def _load_payload(value):
+    if value.startswith("@"):
+        with open(value[1:], "r", encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m soybean.loadgen",
+                                     description="soybean load generator")
+    parser.add_argument("mode", choices=("publish", "sink", "both"))
+    parser.add_argument("--namesrv", default="localhost:9876",
+                        help="name server address, 'local' for the in-process broker")
+    parser.add_argument("--domain", default="loadgen")
+    parser.add_argument("--topic", default="LoadGen")
+    parser.add_argument("--tag", default="Load")
+    parser.add_argument("--expression", default="*",
+                        help="tag expression of the sink")
+    parser.add_argument("--payload", default="{}", type=_load_payload,
+                        help="JSON payload template, or @file")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="messages per second in total, 0 for max rate")
+    parser.add_argument("--producers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=4,
+                        help="consuming threads of the sink")
+    parser.add_argument("--count", type=int, default=None,
+                        help="messages to publish in total, instead of duration")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--interval", type=float, default=1,
+                        help="seconds between progress reports")
+    parser.add_argument("--drain-timeout", type=float, default=10,
+                        help="seconds to wait for the sink in both mode")
+
+    args = parser.parse_args(argv)
+    if args.producers < 1:
+        parser.error("--producers should be at least 1")
+
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
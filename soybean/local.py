@@ -0,0 +1,297 @@
+"""
+进程内的本地broker。
+
+名称服务器地址为"local"或以"local://"开头时，领域使用进程内的本地broker代替RocketMQ，
+用于测试、压测和本地开发。本地broker模拟集群消费：每条消息投递给订阅了该主题且标签匹配的
+每个消费组，组内的多个消费者轮流接收；处理失败的消息延迟后重新投递，超过最大次数后放入死信。
+消息只保存在内存中，也不保存消费位点，发送时没有订阅者的消息被丢弃。
+"""
+import time
+import uuid
+import queue
+import logging
+import itertools
+import threading
+from rocketmq.client import ConsumeStatus, SendStatus, SendResult
+
+from .router import parse_tag_expression
+from .scheduler import DELAY_LEVELS
+from .prefetch import RETRY_TOPIC_PREFIX, RETRY_TOPIC_PROPERTY, RETRIES_PROPERTY
+
+logger = logging.getLogger("soybean.local")
+
+
+_MAX_RECONSUME_TIMES = 16
+
+
+def is_local_addr(namesrv_addr: str) -> bool:
+    return namesrv_addr == "local" or namesrv_addr.startswith("local://")
+
+
+class LocalMessage:
+    """与rocketmq.client.Message相同的接口"""
+
+    __slots__ = ("topic", "keys", "tags", "body", "props", "delay_level")
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.keys = b""
+        self.tags = b""
+        self.body = b""
+        self.props = {}
+        self.delay_level = 0
+
+    def set_keys(self, keys):
+        self.keys = _to_bytes(keys)
+
+    def set_tags(self, tags):
+        self.tags = _to_bytes(tags)
+
+    def set_body(self, body):
+        self.body = _to_bytes(body)
+
+    def set_property(self, key, value):
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        self.props[key] = _to_bytes(value)
+
+    def set_delay_time_level(self, delay_level: int):
+        self.delay_level = delay_level
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return bytes(value)
+
+
+class LocalReceivedMessage:
+    """与rocketmq.client.ReceivedMessage相同的接口"""
+
+    __slots__ = ("id", "topic", "keys", "tags", "body", "_props",
+                 "reconsume_times", "born_timestamp", "store_timestamp")
+
+    def __init__(self, msg_id, msg: LocalMessage, born_timestamp,
+                 store_timestamp, reconsume_times=0):
+        self.id = msg_id
+        self.topic = msg.topic
+        self.keys = msg.keys
+        self.tags = msg.tags
+        self.body = msg.body
+        self._props = msg.props
+        self.reconsume_times = reconsume_times
+        self.born_timestamp = born_timestamp
+        self.store_timestamp = store_timestamp
+
+    def get_property(self, name):
+        return self._props.get(name, b"")
+
+    def redelivered(self):
+        return LocalReceivedMessage(self.id, self, self.born_timestamp,
+                                    self.store_timestamp,
+                                    self.reconsume_times + 1)
+
+    @property
+    def props(self):
+        return self._props
+
+
+class _ConsumerGroup:
+    __slots__ = ("tags", "consumers", "_next")
+
+    def __init__(self, expression):
+        self.tags = parse_tag_expression(expression)
+        self.consumers = []
+        self._next = itertools.count()
+
+    def accepts(self, tag: str) -> bool:
+        return self.tags is None or tag in self.tags
+
+    def pick(self):
+        return self.consumers[next(self._next) % len(self.consumers)]
+
+
+class LocalBroker:
+    """按照名称在进程内共享的本地broker"""
+
+    _brokers = {}
+    _brokers_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, namesrv_addr: str = "local") -> "LocalBroker":
+        with cls._brokers_lock:
+            broker = cls._brokers.get(namesrv_addr)
+            if broker is None:
+                broker = cls(namesrv_addr)
+                cls._brokers[namesrv_addr] = broker
+            return broker
+
+    def __init__(self, name: str):
+        self._name = name
+        self._lock = threading.Lock()
+        self._topics = {}  # topic => {group_id => _ConsumerGroup}
+        self._dead_letters = []
+
+    @property
+    def dead_letters(self):
+        """超过最大重新投递次数的消息"""
+        return self._dead_letters
+
+    def subscribe(self, topic, group_id, expression, consumer):
+        with self._lock:
+            groups = self._topics.setdefault(topic, {})
+            group = groups.get(group_id)
+            if group is None:
+                group = _ConsumerGroup(expression)
+                groups[group_id] = group
+            group.consumers.append(consumer)
+
+    def unsubscribe(self, topic, group_id, consumer):
+        with self._lock:
+            groups = self._topics.get(topic, {})
+            group = groups.get(group_id)
+            if group is None:
+                return
+
+            group.consumers.remove(consumer)
+            if not group.consumers:
+                del groups[group_id]
+
+    def publish(self, msg: LocalMessage) -> str:
+        now = int(time.time() * 1000)
+        msg_id = uuid.uuid4().hex.upper()
+        received = LocalReceivedMessage(msg_id, msg, now, now)
+
+        if msg.topic.startswith(RETRY_TOPIC_PREFIX):
+            # 与redeliver()相同，重试的延时缩短为重试次数的秒数
+            retries = int(received.get_property(RETRIES_PROPERTY) or 1)
+            self._call_later(retries, self._deliver, received)
+        elif msg.delay_level:
+            delay = DELAY_LEVELS[min(msg.delay_level, len(DELAY_LEVELS)) - 1]
+            self._call_later(delay, self._deliver, received)
+        else:
+            self._deliver(received)
+
+        return msg_id
+
+    def _deliver(self, msg: LocalReceivedMessage):
+        if msg.topic.startswith(RETRY_TOPIC_PREFIX):
+            # 重试主题的消息只投递给该消费组，并恢复原来的主题
+            group_id = msg.topic[len(RETRY_TOPIC_PREFIX):]
+            msg.topic = msg.get_property(RETRY_TOPIC_PROPERTY).decode("utf-8")
+            with self._lock:
+                group = self._topics.get(msg.topic, {}).get(group_id)
+                targets = [group.pick()] if group is not None else []
+        else:
+            tag = msg.tags.decode("utf-8")
+            with self._lock:
+                groups = self._topics.get(msg.topic, {})
+                targets = [group.pick() for group in groups.values()
+                           if group.accepts(tag)]
+
+        for consumer in targets:
+            consumer._enqueue(msg)
+
+    def redeliver(self, consumer, msg: LocalReceivedMessage):
+        if msg.reconsume_times >= _MAX_RECONSUME_TIMES:
+            logger.warning("message '%s' is moved to dead letters after %d "
+                           "retries", msg.id, msg.reconsume_times)
+            self._dead_letters.append(msg)
+            return
+
+        # RocketMQ的重新投递从10秒开始逐渐延长，本地broker缩短为重试次数的秒数
+        msg = msg.redelivered()
+        self._call_later(msg.reconsume_times, consumer._enqueue, msg)
+
+    def _call_later(self, delay, func, *args):
+        timer = threading.Timer(delay, func, args)
+        timer.daemon = True
+        timer.start()
+
+
+class LocalProducer:
+    """与rocketmq.client.Producer相同的接口"""
+
+    def __init__(self, group_id, orderly=False, **kwargs):
+        self._group_id = group_id
+        self._broker = None
+
+    def set_name_server_address(self, addr):
+        self._broker = LocalBroker.get(addr)
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def send_sync(self, msg: LocalMessage):
+        msg_id = self._broker.publish(msg)
+        return SendResult(SendStatus.OK, msg_id, 0)
+
+    def send_orderly_with_sharding_key(self, msg: LocalMessage, sharding_key):
+        # 本地broker的消费组内不区分队列，只保证单个消费线程时的顺序
+        return self.send_sync(msg)
+
+
+class LocalPushConsumer:
+    """与rocketmq.client.PushConsumer相同的接口"""
+
+    def __init__(self, group_id, **kwargs):
+        self._group_id = group_id
+        self._broker = None
+        self._thread_count = 1
+        self._subscriptions = []
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def set_name_server_address(self, addr):
+        self._broker = LocalBroker.get(addr)
+
+    def set_thread_count(self, thread_count):
+        self._thread_count = thread_count
+
+    def subscribe(self, topic, callback, expression="*"):
+        self._subscriptions.append((topic, callback, expression))
+
+    def start(self):
+        for topic, _, expression in self._subscriptions:
+            self._broker.subscribe(topic, self._group_id, expression, self)
+
+        for i in range(self._thread_count):
+            thread = threading.Thread(target=self._consume,
+                                      name=f"soybean-local-{self._group_id}-{i}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self):
+        for topic, _, _ in self._subscriptions:
+            self._broker.unsubscribe(topic, self._group_id, self)
+
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _enqueue(self, msg):
+        self._queue.put(msg)
+
+    def _consume(self):
+        callbacks = {topic: callback
+                     for topic, callback, _ in self._subscriptions}
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+
+            try:
+                status = callbacks[msg.topic](msg)
+            except Exception as exc:
+                logger.error("caught an error in consumer '%s': %s",
+                             self._group_id, exc, exc_info=exc)
+                status = ConsumeStatus.RECONSUME_LATER
+
+            if status != ConsumeStatus.CONSUME_SUCCESS:
+                self._broker.redeliver(self, msg)
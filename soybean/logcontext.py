@@ -0,0 +1,113 @@
+"""
+日志的上下文。
+
+反应器处理每条消息、动作每次执行时，在contextvars中绑定消息id、主题、标签和group_id，
+处理函数及其调用的代码里记录的日志都可以带上这些字段，不必层层传递。
+上下文只在记录日志时由ContextFilter读取；日志参数采用%格式延迟到输出时才格式化，
+日志级别未开启时没有格式化的开销。
+
+    handler = logging.StreamHandler()
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(StructuredFormatter())
+    logging.getLogger().addHandler(handler)
+"""
+import json
+import time
+import logging
+import itertools
+from contextvars import ContextVar
+
+
+_log_context = ContextVar("soybean_log_context", default=None)
+
+
+class LogContext:
+    __slots__ = ("kind", "group", "topic", "tag", "msg_id")
+
+    def __init__(self, kind, group, topic, tag=None, msg_id=None):
+        self.kind = kind
+        self.group = group
+        self.topic = topic
+        self.tag = tag
+        self.msg_id = msg_id
+
+
+def bind_context(kind, group, topic, tag=None, msg_id=None):
+    """绑定当前的日志上下文，返回用于reset_context()的token"""
+    return _log_context.set(LogContext(kind, group, topic, tag, msg_id))
+
+
+def reset_context(token):
+    _log_context.reset(token)
+
+
+def current_context() -> LogContext:
+    return _log_context.get()
+
+
+class ContextFilter(logging.Filter):
+    """将当前的日志上下文设置为日志记录的soybean_*属性"""
+
+    def filter(self, record):
+        context = _log_context.get()
+        if context is None:
+            record.soybean_kind = None
+            record.soybean_group = None
+            record.soybean_topic = None
+            record.soybean_tag = None
+            record.soybean_msg_id = None
+        else:
+            record.soybean_kind = context.kind
+            record.soybean_group = context.group
+            record.soybean_topic = context.topic
+            record.soybean_tag = context.tag
+            record.soybean_msg_id = context.msg_id
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """每条日志输出为一行json，需要配合ContextFilter使用"""
+
+    _fields = ("kind", "group", "topic", "tag", "msg_id")
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S",
+                                  time.localtime(record.created))
+                    + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self._fields:
+            value = getattr(record, "soybean_" + field, None)
+            if value is not None:
+                entry[field] = value
+
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogSampler:
+    """
+    对大量的日志采样，每every条记录一条。
+    先判断日志级别是否开启，未开启时不计数。
+    """
+
+    __slots__ = ("_logger", "_level", "_every", "_counter")
+
+    def __init__(self, logger: logging.Logger, every: int = 100,
+                 level: int = logging.DEBUG):
+        self._logger = logger
+        self._level = level
+        self._every = max(every, 1)
+        self._counter = itertools.count()  # 在多个消费线程中计数是原子的
+
+    def __call__(self, msg, *args):
+        if not self._logger.isEnabledFor(self._level):
+            return
+
+        if next(self._counter) % self._every == 0:
+            self._logger.log(self._level, msg, *args)
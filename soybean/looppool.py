@@ -0,0 +1,112 @@
+"""
+多个事件循环。
+
+缺省所有反应器的处理函数都在领域启动时所在的事件循环(主事件循环)中执行，处理函数的
+Python计算较多时，这一个线程就是消费的上限。开启多个事件循环后，每个事件循环运行在
+自己的线程中，反应器按照group_id固定分配到其中一个，也可以按照消息的键分配，
+同一个键的消息总在同一个事件循环中处理；一个繁忙的反应器不会拖慢其它事件循环中的反应器。
+
+领域的各项服务与多个事件循环：
+* 本地发件箱、发送调度（限流）、延时消息和请求/应答只属于主事件循环，其它事件循环中的
+  调用由DomainChannel.run_in_main_loop()转到主事件循环执行；
+* 发件箱模式的动作在调用者的事件循环中执行数据库事务，中继在主事件循环中运行，
+  notify()可以在任何线程中调用；
+* 事务性消息的动作在调用者的事件循环中等待准备消息的结果，事务回查在主事件循环中执行；
+* 窗口聚合在反应器的事件循环中记录事件，在主事件循环中关闭窗口、发送结果，状态由锁保护；
+* 性能剖析按线程记录正在运行的处理函数，采样所有事件循环线程；
+* 流量录制、动作结果缓存和反应器统计都是线程安全的。
+
+处理函数自身使用的数据库连接池等资源只能在创建它们的事件循环中使用，需要在各自的
+事件循环中创建。安装了uvloop时采用uvloop的事件循环。
+"""
+import zlib
+import asyncio
+import logging
+import threading
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger("soybean.looppool")
+
+
+class LoopPool:
+
+    def __init__(self, size: int, use_uvloop: bool = True):
+        if size < 1:
+            raise ValueError(f"the size of the loop pool should be at least 1: {size}")
+
+        self._size = size
+        self._use_uvloop = use_uvloop and uvloop is not None
+        self._loops = []
+        self._threads = []
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def loops(self):
+        return list(self._loops)
+
+    def pick(self, key) -> asyncio.AbstractEventLoop:
+        """按照键的crc32固定地选择一个事件循环，键为str或bytes"""
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return self._loops[zlib.crc32(key or b"") % self._size]
+
+    def _new_loop(self):
+        if self._use_uvloop:
+            return uvloop.new_event_loop()
+        return asyncio.new_event_loop()
+
+    def start(self):
+        """启动所有事件循环的线程，等待它们开始运行后返回"""
+        for index in range(self._size):
+            loop = self._new_loop()
+            started = threading.Event()
+            thread = threading.Thread(target=self._run_loop,
+                                      args=(loop, started),
+                                      name=f"soybean-loop-{index}",
+                                      daemon=True)
+            thread.start()
+            started.wait()
+
+            self._loops.append(loop)
+            self._threads.append(thread)
+
+        logger.debug("started %d event loops%s", self._size,
+                     " (uvloop)" if self._use_uvloop else "")
+
+    @staticmethod
+    def _run_loop(loop, started):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(started.set)
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    async def stop(self):
+        """停止所有事件循环，调用前反应器应已处理完所有消息"""
+        for loop in self._loops:
+            loop.call_soon_threadsafe(loop.stop)
+
+        threads = self._threads
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [thread.join() for thread in threads])
+
+        self._loops = []
+        self._threads = []
+
+
+async def run_in_loop(loop, coroutine):
+    """在loop中执行协程并等待结果，loop即是当前的事件循环时直接执行"""
+    if loop is asyncio.get_running_loop():
+        return await coroutine
+
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    return await asyncio.wrap_future(future)
@@ -0,0 +1,47 @@
+"""
+处理函数的中间件。
+
+中间件是一个工厂函数middleware(call_next, info)，返回包装了call_next的协程函数，
+参数与处理函数相同。info为HandlerInfo，描述被包装的反应器或动作。
+领域和主题上注册的中间件在启动时为每个反应器和动作编译成一条调用链，
+处理消息时不再查找或组装中间件；与该处理函数无关的中间件可以直接返回call_next。
+
+    def timing(call_next, info):
+        async def _timing(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await call_next(*args, **kwargs)
+            finally:
+                logger.info("%s took %.3fs", info.name, time.perf_counter() - started)
+        return _timing
+
+    mq.use(timing)
+
+领域的中间件在外层，主题的中间件在内层，同一层按照注册的先后由外到内。
+处理函数的参数仍按照处理函数本身的签名注入，不受中间件的影响。
+"""
+
+KIND_REACTOR = "reactor"
+KIND_ACTION = "action"
+
+
+class HandlerInfo:
+    __slots__ = ("kind", "name", "topic", "tag", "handler")
+
+    def __init__(self, kind: str, name: str, topic: str, tag: str, handler):
+        self.kind = kind        # KIND_REACTOR或KIND_ACTION
+        self.name = name        # 反应器或动作的group_id
+        self.topic = topic
+        self.tag = tag          # 反应器的标签表达式，或者动作发送消息的标签
+        self.handler = handler
+
+    def __repr__(self):
+        return f"<HandlerInfo {self.kind} '{self.name}'>"
+
+
+def compile_chain(handler, info: HandlerInfo, middlewares):
+    """将中间件由内到外依次包装处理函数，返回最外层的协程函数"""
+    call = handler
+    for middleware in reversed(middlewares):
+        call = middleware(call, info)
+    return call
@@ -0,0 +1,379 @@
+"""
+本地持久化的发件箱。
+
+broker不可用时，动作发送的消息先记入本地发件箱，由后台任务在broker恢复后按顺序补发，
+动作本身不再等待broker超时，延迟保持在较低且有界的水平。
+
+发件箱由追加写的段文件和内存映射的索引文件组成：
+* 段文件seg-XXXXXXXX.log依次追加记录，记录为头部(元数据长度、消息体长度、crc32)、
+  json元数据(主题、标签、属性等)和消息体；写满segment_size后滚动到新的段文件；
+* 索引文件index的头部为记录总数和补发游标，其后每条记录一个定长的条目
+  (段号、偏移、长度、状态)，标记已发送只需改写映射内存中的一个字节；
+* 追加的记录在fsync_interval内成批fsync（组提交），追加者等待所在批次落盘后返回。
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("soybean.outbox")
+
+
+_RECORD_HEADER = struct.Struct("<III")      # meta_len, body_len, crc32
+_INDEX_HEADER = struct.Struct("<QQ")        # count, cursor
+_INDEX_ENTRY = struct.Struct("<IQIB3x")     # segment, offset, length, state
+
+_STATE_PENDING = 0
+_STATE_SENT = 1
+
+
+class OutboxRecord:
+    __slots__ = ("topic", "tag", "keys", "props", "body",
+                 "orderly", "priority", "delay_level")
+
+    def __init__(self, topic, tag=None, keys=None, props=None, body=b"",
+                 orderly=False, priority=None, delay_level=None):
+        self.topic = topic
+        self.tag = tag
+        self.keys = keys
+        self.props = props
+        self.body = body
+        self.orderly = orderly
+        self.priority = priority
+        self.delay_level = delay_level
+
+    def encode(self) -> bytes:
+        meta = json.dumps({
+            "topic": self.topic,
+            "tag": self.tag,
+            "keys": self.keys,
+            "props": self.props,
+            "orderly": self.orderly,
+            "priority": self.priority,
+            "delay_level": self.delay_level,
+        }).encode("utf-8")
+        body = self.body
+        crc = zlib.crc32(body, zlib.crc32(meta))
+        return _RECORD_HEADER.pack(len(meta), len(body), crc) + meta + body
+
+    @classmethod
+    def decode(cls, data: bytes):
+        meta_len, body_len, crc = _RECORD_HEADER.unpack_from(data)
+        start = _RECORD_HEADER.size
+        meta = data[start:start + meta_len]
+        body = data[start + meta_len:start + meta_len + body_len]
+        if zlib.crc32(body, zlib.crc32(meta)) != crc:
+            raise ValueError("the outbox record is corrupted")
+
+        return cls(body=bytes(body), **json.loads(meta))
+
+
+class OutboxLog:
+    """
+    段文件和索引文件，只在事件循环线程中访问，fsync可以在其它线程中执行；
+    fsync与替换索引的映射、关闭文件由锁互斥。
+    """
+
+    def __init__(self, path: str, segment_size: int = 64 * 1024 * 1024):
+        self._path = path
+        self._segment_size = segment_size
+
+        self._index_file = None
+        self._index = None
+        self._capacity = 0
+        self._count = 0
+        self._cursor = 0
+
+        self._segments = {}  # 段号 => 文件对象
+        self._active_no = 0
+        self._active_size = 0
+
+        self._lock = threading.Lock()
+        self._dirty_segments = set()  # 上次fsync之后写入过的段号
+
+    @property
+    def pending(self) -> int:
+        return self._count - self._cursor
+
+    def open(self):
+        os.makedirs(self._path, exist_ok=True)
+
+        index_path = os.path.join(self._path, "index")
+        exists = os.path.exists(index_path)
+        self._index_file = open(index_path, "r+b" if exists else "w+b")
+        if not exists:
+            self._resize_index(1024)
+        else:
+            size = os.fstat(self._index_file.fileno()).st_size
+            self._capacity = (size - _INDEX_HEADER.size) // _INDEX_ENTRY.size
+            self._index = mmap.mmap(self._index_file.fileno(), size)
+            self._count, self._cursor = _INDEX_HEADER.unpack_from(self._index)
+
+        segment_nos = sorted(int(name[4:-4]) for name in os.listdir(self._path)
+                             if name.startswith("seg-") and name.endswith(".log"))
+        if self._cursor == self._count:
+            # 全部已经发送，从头开始
+            for segment_no in segment_nos:
+                os.remove(self._segment_path(segment_no))
+            segment_nos = []
+            self._count = self._cursor = 0
+            self._write_index_header()
+
+        for segment_no in segment_nos:
+            self._segments[segment_no] = open(self._segment_path(segment_no),
+                                              "r+b")
+
+        if segment_nos:
+            self._active_no = segment_nos[-1]
+            self._active_size = os.fstat(
+                self._segments[self._active_no].fileno()).st_size
+        else:
+            self._active_no = 1
+            self._segments[1] = open(self._segment_path(1), "w+b")
+            self._active_size = 0
+
+    def close(self):
+        with self._lock:
+            for f in self._segments.values():
+                f.close()
+            self._segments.clear()
+            self._dirty_segments.clear()
+
+            if self._index is not None:
+                self._index.flush()
+                self._index.close()
+                self._index = None
+                self._index_file.close()
+
+    def _segment_path(self, segment_no):
+        return os.path.join(self._path, f"seg-{segment_no:08d}.log")
+
+    def _resize_index(self, capacity):
+        size = _INDEX_HEADER.size + capacity * _INDEX_ENTRY.size
+        with self._lock:
+            if self._index is not None:
+                self._index.flush()
+                self._index.close()
+
+            self._index_file.truncate(size)
+            self._index = mmap.mmap(self._index_file.fileno(), size)
+            self._capacity = capacity
+            self._write_index_header()
+
+    def _write_index_header(self):
+        _INDEX_HEADER.pack_into(self._index, 0, self._count, self._cursor)
+
+    def _entry_offset(self, seq):
+        return _INDEX_HEADER.size + seq * _INDEX_ENTRY.size
+
+    def append(self, record: OutboxRecord):
+        data = record.encode()
+        if self._active_size and self._active_size + len(data) > self._segment_size:
+            self._active_no += 1
+            self._segments[self._active_no] = open(
+                self._segment_path(self._active_no), "w+b")
+            self._active_size = 0
+
+        segment = self._segments[self._active_no]
+        offset = self._active_size
+        os.pwrite(segment.fileno(), data, offset)
+        self._active_size += len(data)
+        self._dirty_segments.add(self._active_no)
+
+        if self._count == self._capacity:
+            self._resize_index(self._capacity * 2)
+
+        _INDEX_ENTRY.pack_into(self._index, self._entry_offset(self._count),
+                               self._active_no, offset, len(data),
+                               _STATE_PENDING)
+        self._count += 1
+        self._write_index_header()
+
+    def sync(self):
+        """将已经追加的记录落盘，包括同一批次中滚动之前的段文件"""
+        with self._lock:
+            if self._index is None:
+                return  # 已经关闭
+
+            dirty, self._dirty_segments = self._dirty_segments, set()
+            for segment_no in sorted(dirty):
+                segment = self._segments.get(segment_no)
+                if segment is not None:  # 已经补发完并删除的段不需要落盘
+                    os.fsync(segment.fileno())
+            self._index.flush()
+
+    def peek(self):
+        """返回下一条尚未发送的记录，没有时返回None"""
+        while self._cursor < self._count:
+            segment_no, offset, length, state = _INDEX_ENTRY.unpack_from(
+                self._index, self._entry_offset(self._cursor))
+            if state == _STATE_PENDING:
+                data = os.pread(self._segments[segment_no].fileno(),
+                                length, offset)
+                return OutboxRecord.decode(data)
+
+            self._advance()
+
+        return None
+
+    def mark_sent(self):
+        """标记peek()返回的记录已经发送"""
+        offset = self._entry_offset(self._cursor)
+        segment_no = _INDEX_ENTRY.unpack_from(self._index, offset)[0]
+        self._index[offset + 16] = _STATE_SENT  # state字节在条目中的偏移
+        self._advance()
+
+        # 补发完的非活动段文件可以删除
+        next_segment_no = self._active_no
+        if self._cursor < self._count:
+            next_segment_no = _INDEX_ENTRY.unpack_from(
+                self._index, self._entry_offset(self._cursor))[0]
+        if segment_no != next_segment_no and segment_no != self._active_no:
+            with self._lock:
+                self._segments.pop(segment_no).close()
+                self._dirty_segments.discard(segment_no)
+            os.remove(self._segment_path(segment_no))
+
+    def _advance(self):
+        self._cursor += 1
+        self._write_index_header()
+
+
+class LocalOutbox:
+    """
+    mode为"failed"时只记录发送失败的消息；为"all"时所有消息先记入发件箱再补发。
+    发件箱中还有未补发的消息时，新的消息也直接记入发件箱，以保持消息的先后次序。
+    """
+
+    def __init__(self, path: str,
+                 mode: str = "failed",
+                 fsync_interval: float = 0.01,
+                 segment_size: int = 64 * 1024 * 1024,
+                 min_backoff: float = 0.5,
+                 max_backoff: float = 30):
+
+        if mode not in ("failed", "all"):
+            raise ValueError(f"unknown outbox mode '{mode}', "
+                             f"expected 'failed' or 'all'")
+
+        self._mode = mode
+        self._log = OutboxLog(path, segment_size)
+        self._fsync_interval = fsync_interval
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+
+        self._send = None
+        self._flusher = None
+        self._drainer = None
+        self._flush_waiters = []
+        self._dirty = None
+        self._wakeup = None
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @property
+    def pending(self) -> int:
+        return self._log.pending
+
+    def accepts(self) -> bool:
+        """新的消息是否应当直接记入发件箱"""
+        return self._mode == "all" or self._log.pending > 0
+
+    async def start(self, send):
+        """send(record)为补发记录的协程函数，发送失败时抛出异常"""
+        self._send = send
+        self._log.open()
+
+        loop = asyncio.get_running_loop()
+        self._dirty = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._flusher = loop.create_task(self._flush_forever(loop))
+        self._drainer = loop.create_task(self._drain_forever())
+
+        if self._log.pending:
+            logger.info("%d messages in the outbox to be sent",
+                        self._log.pending)
+            self._wakeup.set()
+
+    async def stop(self):
+        for task in (self._drainer, self._flusher):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._drainer = self._flusher = None
+
+        if self._flush_waiters:
+            self._log.sync()
+            for waiter in self._flush_waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._flush_waiters = []
+
+        self._log.close()
+
+    async def append(self, record: OutboxRecord):
+        """记入发件箱，等待记录落盘后返回"""
+        self._log.append(record)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._flush_waiters.append(waiter)
+        self._dirty.set()
+        self._wakeup.set()
+        await waiter
+
+    async def _flush_forever(self, loop):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self._fsync_interval)
+            self._dirty.clear()
+
+            waiters, self._flush_waiters = self._flush_waiters, []
+            try:
+                await loop.run_in_executor(None, self._log.sync)
+            except Exception as exc:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(exc)
+                continue
+
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def _drain_forever(self):
+        backoff = self._min_backoff
+        while True:
+            await self._wakeup.wait()
+
+            try:
+                record = self._log.peek()
+            except (ValueError, struct.error) as exc:
+                # 写入时被中断的记录无法补发，跳过
+                logger.error("skipped a record in the outbox: %s", exc)
+                self._log.mark_sent()
+                continue
+
+            if record is None:
+                self._wakeup.clear()
+                continue
+
+            try:
+                await self._send(record)
+            except Exception as exc:
+                logger.warning("failed to send the message in the outbox, "
+                               "retry in %.1fs: %s", backoff, exc)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+                continue
+
+            backoff = self._min_backoff
+            self._log.mark_sent()
@@ -0,0 +1,168 @@
+"""
+预取模式。
+
+缺省每个消费线程阻塞到处理函数完成才返回，broker客户端在处理期间不能继续拉取。
+预取模式下消费线程只复制消息的内容(快照)，放入有界的缓冲区后立即确认，
+由事件循环中的max_inflight个工作协程从缓冲区取出处理。缓冲区同时限制消息的数量
+和消息体的总字节数，满了以后消费线程阻塞，内存占用因此有固定的上限。
+
+消息在处理之前已经确认，处理失败的消息以重试主题(%RETRY%group_id)重新发送给本消费组，
+延时逐次加长，超过最大重试次数后丢弃；进程崩溃时缓冲区中尚未处理的消息丢失。
+快照只保留soybean使用的消息属性，重新发送的消息也只带有这些属性。
+"""
+import logging
+import threading
+
+from .blobstore import CLAIM_CHECK_PROPERTY
+from .compression import COMPRESSION_PROPERTY
+from .rpc import CORRELATION_PROPERTY, REPLY_TO_PROPERTY, REPLY_ERROR_PROPERTY
+from .scheduler import DELAY_LEVELS
+from .utils import create_msg
+
+logger = logging.getLogger("soybean.prefetch")
+
+
+RETRY_TOPIC_PREFIX = "%RETRY%"
+RETRY_TOPIC_PROPERTY = "RETRY_TOPIC"  # 与RocketMQ相同，消费时据此恢复原来的主题
+RETRIES_PROPERTY = "soybean_retries"
+MAX_RETRIES = 16
+
+SNAPSHOT_PROPERTIES = (CLAIM_CHECK_PROPERTY, COMPRESSION_PROPERTY,
+                       CORRELATION_PROPERTY, REPLY_TO_PROPERTY,
+                       REPLY_ERROR_PROPERTY, RETRIES_PROPERTY,
+                       "ORIGIN_MESSAGE_ID")
+
+
+class PrefetchedMessage:
+    """消息的快照，与rocketmq.client.ReceivedMessage相同的接口"""
+
+    __slots__ = ("id", "topic", "keys", "tags", "body", "_props",
+                 "reconsume_times", "born_timestamp", "store_timestamp")
+
+    def __init__(self, msg_id, topic, keys, tags, body, props,
+                 reconsume_times, born_timestamp, store_timestamp):
+        self.id = msg_id
+        self.topic = topic
+        self.keys = keys
+        self.tags = tags
+        self.body = body
+        self._props = props
+        self.reconsume_times = reconsume_times
+        self.born_timestamp = born_timestamp
+        self.store_timestamp = store_timestamp
+
+    def get_property(self, name):
+        return self._props.get(name, b"")
+
+    @property
+    def props(self):
+        return self._props
+
+
+def snapshot_message(msg) -> PrefetchedMessage:
+    """在消费线程中复制消息，回调返回之后原生的消息对象即被释放"""
+    props = {}
+    for name in SNAPSHOT_PROPERTIES:
+        value = msg.get_property(name)
+        if value:
+            props[name] = value
+
+    # 预取模式的重试由本模块重新发送，broker的重新投递次数总是0
+    retries = props.get(RETRIES_PROPERTY)
+    reconsume_times = max(msg.reconsume_times, int(retries) if retries else 0)
+
+    return PrefetchedMessage(msg.id, msg.topic, msg.keys, msg.tags, msg.body,
+                             props, reconsume_times,
+                             msg.born_timestamp, msg.store_timestamp)
+
+
+def create_retry_msg(msg: PrefetchedMessage, group_id: str, message_factory):
+    """
+    返回重新发送给本消费组的消息，超过最大重试次数时返回None。
+    与broker的重新投递相同，第n次重试的延时级别为n + 2（10秒起）。
+    """
+    retries = msg.reconsume_times + 1
+    if retries > MAX_RETRIES:
+        return None
+
+    topic = msg.topic
+    if isinstance(topic, bytes):
+        topic = topic.decode("utf-8")
+
+    props = dict(msg.props)
+    props[RETRY_TOPIC_PROPERTY] = topic
+    props[RETRIES_PROPERTY] = str(retries)
+
+    keys = msg.keys.decode("utf-8") if msg.keys else None
+    tag = msg.tags.decode("utf-8") if msg.tags else None
+    msg_obj = create_msg(RETRY_TOPIC_PREFIX + group_id, msg.body, keys, tag,
+                         props, message_factory=message_factory)
+    msg_obj.set_delay_time_level(min(retries + 2, len(DELAY_LEVELS)))
+    return msg_obj
+
+
+class PrefetchBuffer:
+    """
+    预取缓冲区的容量，线程安全。消费线程acquire()占用容量，缓冲区满时阻塞；
+    工作协程处理完消息后release()。单条消息超过字节上限时，只在缓冲区为空时放行。
+    """
+
+    def __init__(self, max_messages: int, max_bytes: int = None):
+        if max_messages < 1:
+            raise ValueError(f"the prefetch should be at least 1: {max_messages}")
+
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._messages = 0
+        self._bytes = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def messages(self) -> int:
+        return self._messages
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def _has_room(self, size):
+        if self._messages == 0:
+            return True
+        if self._messages >= self._max_messages:
+            return False
+        return self._max_bytes is None or self._bytes + size <= self._max_bytes
+
+    def acquire(self, size: int) -> bool:
+        """占用容量，缓冲区关闭后返回False"""
+        with self._cond:
+            while not self._closed and not self._has_room(size):
+                self._cond.wait()
+
+            if self._closed:
+                return False
+
+            self._messages += 1
+            self._bytes += size
+            return True
+
+    def release(self, size: int):
+        with self._cond:
+            self._messages -= 1
+            self._bytes -= size
+            self._cond.notify_all()
+
+    def open(self):
+        with self._cond:
+            self._closed = False
+
+    def close(self):
+        """唤醒所有阻塞的消费线程，之后的acquire()都返回False"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def as_dict(self):
+        return {"messages": self._messages, "bytes": self._bytes,
+                "max_messages": self._max_messages,
+                "max_bytes": self._max_bytes}
@@ -0,0 +1,254 @@
+"""
+处理函数的性能剖析。
+
+反应器和动作的处理函数协程被逐步驱动，每一步即是该协程在事件循环中不间断运行的一段，
+统计每一步的墙钟时间、CPU时间和内存分配，超过slow_callback秒的一步即阻塞了事件循环，
+记入该处理函数名下（名称即make_group_id生成的group_id）。
+
+可选的采样线程以固定间隔抓取各个事件循环线程的调用栈，按处理函数名称归并成折叠栈格式，
+可以直接用flamegraph.pl等工具生成火焰图。开启多个事件循环时，处理函数在多个线程中
+同时运行，统计由锁保护；tracemalloc统计的是整个进程的内存分配，此时各个处理函数的
+分配量会相互混杂。
+"""
+import sys
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger("soybean.profiling")
+
+
+class HandlerProfile:
+    __slots__ = (
+        "name",
+        "calls",
+        "errors",
+        "wall_time",
+        "cpu_time",
+        "alloc_bytes",
+        "blocking_count",
+        "blocking_time",
+        "max_blocking",
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.alloc_bytes = 0
+        self.blocking_count = 0
+        self.blocking_time = 0.0
+        self.max_blocking = 0.0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Profiler:
+    """
+    slow_callback 处理函数一步运行超过该秒数，视为阻塞了事件循环；
+    trace_malloc 是否用tracemalloc统计内存分配，会明显降低运行速度；
+    sample_interval 采样调用栈的间隔秒数，None则不采样。
+    """
+
+    def __init__(self,
+                 slow_callback: float = 0.1,
+                 trace_malloc: bool = False,
+                 sample_interval: float = None):
+
+        self._slow_callback = slow_callback
+        self._trace_malloc = trace_malloc
+        self._sample_interval = sample_interval
+
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._stacks = Counter()
+        # 线程id => 该线程中正在运行的处理函数名称，嵌套调用时为多个
+        self._running = {}
+
+        self._sampler = None
+        self._sampling = threading.Event()
+        self._started_malloc = False
+
+    def start(self):
+        if self._trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_malloc = True
+
+        if self._sample_interval:
+            self._sampling.set()
+            self._sampler = threading.Thread(target=self._sample,
+                                             name="soybean-profiler",
+                                             daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        if self._sampler is not None:
+            self._sampling.clear()
+            self._sampler.join()
+            self._sampler = None
+
+        if self._started_malloc:
+            tracemalloc.stop()
+            self._started_malloc = False
+
+    def reset(self):
+        with self._lock:
+            self._profiles.clear()
+            self._stacks.clear()
+
+    def get_profile(self, name) -> HandlerProfile:
+        profile = self._profiles.get(name)
+        if profile is None:
+            with self._lock:
+                profile = self._profiles.setdefault(name, HandlerProfile(name))
+        return profile
+
+    def _running_stack(self):
+        """当前线程中正在运行的处理函数名称"""
+        return self._running.setdefault(threading.get_ident(), [])
+
+    async def run(self, name: str, coroutine):
+        """运行并剖析处理函数的协程"""
+        return await _ProfiledCoroutine(self, self.get_profile(name), coroutine)
+
+    def report(self):
+        with self._lock:
+            return {name: p.as_dict() for name, p in self._profiles.items()}
+
+    def format_report(self) -> str:
+        lines = [f"{'handler':<60s} {'calls':>8s} {'errors':>6s} "
+                 f"{'wall(s)':>9s} {'cpu(s)':>9s} {'alloc(KB)':>10s} "
+                 f"{'blocking':>8s} {'max(s)':>8s}"]
+
+        with self._lock:
+            profiles = sorted(self._profiles.values(),
+                              key=lambda p: p.cpu_time, reverse=True)
+        for p in profiles:
+            lines.append(f"{p.name:<60s} {p.calls:8d} {p.errors:6d} "
+                         f"{p.wall_time:9.3f} {p.cpu_time:9.3f} "
+                         f"{p.alloc_bytes / 1024:10.1f} "
+                         f"{p.blocking_count:8d} {p.max_blocking:8.3f}")
+
+        return "\n".join(lines)
+
+    def collapsed_stacks(self) -> str:
+        """折叠栈格式的采样结果，每行为分号分隔的调用栈和采样次数"""
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in stacks)
+
+    def _sample(self):
+        interval = self._sample_interval
+        while self._sampling.is_set():
+            time.sleep(interval)
+
+            current_frames = None
+            for thread_id, running in list(self._running.items()):
+                running = tuple(running)
+                if not running:
+                    continue
+
+                if current_frames is None:
+                    current_frames = sys._current_frames()
+                frame = current_frames.get(thread_id)
+                frames = []
+                while frame is not None and frame.f_code is not _AWAIT_CODE:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({code.co_filename}:"
+                                  f"{frame.f_lineno})")
+                    frame = frame.f_back
+
+                if frame is None:
+                    # 采样时处理函数的这一步已经结束
+                    continue
+
+                frames.extend(reversed(running))
+                with self._lock:
+                    self._stacks[";".join(reversed(frames))] += 1
+
+
+class _ProfiledCoroutine:
+    __slots__ = ("_profiler", "_profile", "_coroutine")
+
+    def __init__(self, profiler, profile, coroutine):
+        self._profiler = profiler
+        self._profile = profile
+        self._coroutine = coroutine
+
+    def __await__(self):
+        profiler = self._profiler
+        profile = self._profile
+        lock = profiler._lock
+        # 协程总在同一个事件循环线程中运行
+        running = profiler._running_stack()
+        slow_callback = profiler._slow_callback
+        trace_malloc = tracemalloc.is_tracing()
+
+        send = self._coroutine.send
+        throw = self._coroutine.throw
+        value, error = None, None
+
+        with lock:
+            profile.calls += 1
+        started = time.perf_counter()
+        try:
+            while True:
+                step_started = time.perf_counter()
+                cpu_started = time.thread_time()
+                if trace_malloc:
+                    mem_started = tracemalloc.get_traced_memory()[0]
+
+                running.append(profile.name)
+                try:
+                    if error is None:
+                        future = send(value)
+                    else:
+                        future = throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    running.pop()
+
+                    step_time = time.perf_counter() - step_started
+                    cpu_time = time.thread_time() - cpu_started
+                    allocated = 0
+                    if trace_malloc:
+                        allocated = tracemalloc.get_traced_memory()[0] - mem_started
+
+                    blocking = step_time > slow_callback
+                    with lock:
+                        profile.cpu_time += cpu_time
+                        if allocated > 0:
+                            profile.alloc_bytes += allocated
+                        if blocking:
+                            profile.blocking_count += 1
+                            profile.blocking_time += step_time
+                            if step_time > profile.max_blocking:
+                                profile.max_blocking = step_time
+
+                    if blocking:
+                        logger.warning("handler '%s' blocked the event loop "
+                                       "for %.3fs", profile.name, step_time)
+
+                try:
+                    value, error = (yield future), None
+                except BaseException as exc:
+                    value, error = None, exc
+
+        except BaseException:
+            with lock:
+                profile.errors += 1
+            raise
+
+        finally:
+            wall_time = time.perf_counter() - started
+            with lock:
+                profile.wall_time += wall_time
+
+
+_AWAIT_CODE = _ProfiledCoroutine.__await__.__code__
@@ -1,18 +1,39 @@
 import inspect
 import asyncio
 import logging
-from rocketmq.client import PushConsumer, ConsumeStatus
+from rocketmq.client import ConsumeStatus
 
-from .utils import make_group_id, json_loads
+from .utils import make_group_id, json_loads, read_msg_body, get_msg_property
+from .blobstore import CLAIM_CHECK_PROPERTY
 from .event import OccupiedEvent
 from .typing import HandlerType
-from .exceptions import UnkownArgumentError
+from .exceptions import UnkownArgumentError, MessageSchemaError
+from .flowcontrol import FlowController, TokenBucket, InflightLimiter
+from .flowcontrol import PRIORITY_ONLINE
+from .rpc import get_reply_target, send_reply
+from .stats import ReactorStats
+from .middleware import HandlerInfo, KIND_REACTOR
+from .logcontext import bind_context, reset_context, LogSampler
+from .looppool import run_in_loop
+from .prefetch import PrefetchBuffer, snapshot_message, create_retry_msg
+from .prefetch import RETRY_TOPIC_PREFIX
+from .action.simple import SendingAction
+from .action.transactional import producer_executor
 
 logger = logging.getLogger("soybean.reactor")
 
 class Reactor:
     def __init__(self, channel, topic: str, expression: str,
-                 handler: HandlerType, depth: int):
+                 handler: HandlerType, depth: int,
+                 max_inflight: int = 1,
+                 rate_limit: float = None,
+                 shared: str = None,
+                 reply: bool = False,
+                 schema=None,
+                 shard_by_key: bool = False,
+                 prefetch: int = None,
+                 prefetch_bytes: int = None,
+                 priority: str = PRIORITY_ONLINE):
 
         self._channel = channel
         self._topic = topic
@@ -21,76 +42,419 @@ class Reactor:
 
         self._reactor_id = make_group_id(channel.name, handler, depth)
         self._consumer = None
+        self._callback = None
+        self._shared = shared
+        self._reply = reply
+        self._shard_by_key = shard_by_key
+        self._priority = priority
 
-        argvals_getter = build_argvals_getter(handler)
+        argvals_getter = build_argvals_getter(handler, channel, schema)
         self._handler_argvals_getter = argvals_getter
 
-        self._busy_event = None
+        self._busy_events = {}  # 事件循环 => 该事件循环中的OccupiedEvent
+        self._stats = ReactorStats()
+
+        if max_inflight < 1:
+            raise ValueError(f"max_inflight should be at least 1: {max_inflight}")
+        self._max_inflight = max_inflight
+
+        self._prefetch_buffer = None
+        self._prefetch_queue = None
+        self._prefetch_workers = []
+        self._home_loop = None
+        if prefetch is not None or prefetch_bytes is not None:
+            if shared or shard_by_key:
+                raise ValueError("the prefetch mode is not supported by shared "
+                                 "consumers or sharding by key")
+            if prefetch is None:
+                prefetch = max_inflight * 16
+            self._prefetch_buffer = PrefetchBuffer(prefetch, prefetch_bytes)
+
+        # 独占消费者时，每个消费线程同时只处理一条消息，因此消费线程数即是该反应器的
+        # 在途消息上限；共享消费者的线程由多个反应器共用，需要单独限制在途消息数量。
+        # 领域的处理名额按反应器的优先级调度
+        reactor_limiter = InflightLimiter(max_inflight) if shared else None
+        priority_slot = channel.priority_scheduler.slot(priority)
+        self._flow = FlowController(
+            gate=channel.consume_gate,
+            rate_limiter=TokenBucket(rate_limit) if rate_limit else None,
+            inflight_limiters=(reactor_limiter, priority_slot))
 
     @property
     def reactor_id(self):
         return self._reactor_id
 
-    async def start(self):
-        import threading
-        print(
-            f"reacter-start thread: {threading.get_ident()}, loop: {id(asyncio.get_event_loop())}")
+    @property
+    def topic(self) -> str:
+        return self._topic
 
-        consumer = PushConsumer(group_id=self._reactor_id)
+    @property
+    def handler(self) -> HandlerType:
+        return self._handler
 
-        consumer.set_thread_count(1)
-        consumer.set_name_server_address(self._channel.namesrv_addr)
+    @property
+    def expression(self) -> str:
+        return self._expression
 
-        self._busy_event = OccupiedEvent()
+    @property
+    def shared(self) -> str:
+        """共享消费者的名称，独占消费者时为None"""
+        return self._shared
 
-        loop = asyncio.get_running_loop()
-        def run_coroutine(coroutine):
+    @property
+    def max_inflight(self) -> int:
+        return self._max_inflight
+
+    @property
+    def priority(self) -> str:
+        return self._priority
+
+    @property
+    def started(self) -> bool:
+        """独占的消费者已经启动，共享消费者的反应器总是False"""
+        return self._consumer is not None
+
+    @property
+    def stats(self) -> ReactorStats:
+        return self._stats
+
+    @property
+    def prefetch_buffer(self) -> PrefetchBuffer:
+        """预取模式的缓冲区，没有开启预取时为None"""
+        return self._prefetch_buffer
+
+    def consume(self, msg) -> ConsumeStatus:
+        """在消费线程中处理消息，阻塞直到处理完成"""
+        return self._callback(msg)
+
+    async def wait_idle(self):
+        for loop, busy_event in self._busy_events.items():
+            await run_in_loop(loop, busy_event.wait_idle())
+
+    async def start(self):
+        # 开启了多个事件循环时，反应器固定在其中一个，或者按消息的键分配到各个事件循环
+        loop_pool = self._channel.loop_pool
+        if loop_pool is None:
+            loops = [asyncio.get_running_loop()]
+        elif self._shard_by_key:
+            loops = loop_pool.loops
+        else:
+            loops = [loop_pool.pick(self._reactor_id)]
+
+        busy_events = {}
+        for loop in loops:
+            busy_events[loop] = await run_in_loop(loop, _create_occupied_event())
+        self._busy_events = busy_events
+
+        if len(loops) == 1:
+            home_loop = self._home_loop = loops[0]
+            pick_loop = lambda msg: home_loop
+        else:
+            pick_loop = lambda msg: loop_pool.pick(msg.keys)
+
+        def run_coroutine(coroutine, loop):
             # 在其它线程以线程安全的方式执行协程，并阻塞等待执行结果
             future = asyncio.run_coroutine_threadsafe(coroutine, loop)
-            return future.result
+            return future.result()
+
+        flow = self._flow
+        profiler = self._channel.profiler
+        stats = self._stats
+
+        info = HandlerInfo(KIND_REACTOR, self._reactor_id, self._topic,
+                           self._expression, self._handler)
+        invoke = self._channel.compile_handler(self._handler, info)
+
+        reactor_id = self._reactor_id
+        topic = self._topic
+        log_success = LogSampler(logger, self._channel.log_sample_every)
+
+        # 共享消费者的消息由共享消费者录制
+        capture = self._channel.capture if self._shared is None else None
 
         def _callback(msg):
-            run_coroutine(self._busy_event.acquire())
+            if capture is not None:
+                capture.write(msg)
+
+            # 消费线程中绑定的上下文随run_coroutine复制到事件循环中的任务
+            tags = msg.tags
+            context_token = bind_context(KIND_REACTOR, reactor_id, topic,
+                                         tags.decode("utf-8") if tags else None,
+                                         msg.id)
+            # 只撤销实际完成的步骤：事件循环已经关闭时acquire()也会出错
+            entered = acquired = False
+            started = None
+            success = False
             try:
-                arg_values = self._handler_argvals_getter(msg)
-                run_coroutine( self._handler(*arg_values))
-
+                loop = pick_loop(msg)
+                busy_event = busy_events[loop]
+                flow.enter()
+                entered = True
+                run_coroutine(busy_event.acquire(), loop)
+                acquired = True
+                started = stats.begin(msg)
+
+                try:
+                    arg_values = self._handler_argvals_getter(msg)
+                except MessageSchemaError as exc:
+                    # 重新投递也无法处理不符合契约的消息，直接确认
+                    stats.reject()
+                    logger.error("rejected message '%s' in reactor '%s': %s",
+                                 msg.id, reactor_id, exc)
+                    if self._reply:
+                        run_coroutine(self._reply_error(msg, exc), loop)
+                    return ConsumeStatus.CONSUME_SUCCESS
+
+                coroutine = invoke(*arg_values)
+                if profiler is not None:
+                    coroutine = profiler.run(self._reactor_id, coroutine)
+                result = run_coroutine(coroutine, loop)
+
+                if self._reply:
+                    reply_to, correlation_id = get_reply_target(msg)
+                    if reply_to:
+                        run_coroutine(send_reply(self._channel, reply_to,
+                                                 correlation_id, result), loop)
+
+                blob_ref = get_msg_property(msg, CLAIM_CHECK_PROPERTY)
+                if blob_ref:
+                    self._channel.blob_store.release(blob_ref)
+
+                success = True
+                log_success("reactor '%s' handled message '%s'",
+                            reactor_id, msg.id)
                 return ConsumeStatus.CONSUME_SUCCESS
             except Exception as exc:
-                logger.error((f"caught an error in reactor "
-                              f"'{self._reactor_id}': {exc}"),
-                             exc_info=exc)
+                logger.error("caught an error in reactor '%s': %s",
+                             reactor_id, exc, exc_info=exc)
+
+                if acquired and self._reply and \
+                        run_coroutine(self._reply_error(msg, exc), loop):
+                    # 请求者已经得到错误应答，不再重新投递
+                    return ConsumeStatus.CONSUME_SUCCESS
+
                 return ConsumeStatus.RECONSUME_LATER
             finally:
-                run_coroutine(self._busy_event.release())
-
-        consumer.subscribe(self._topic, _callback, expression=self._expression)
+                try:
+                    if started is not None:
+                        stats.end(started, success)
+                    if acquired:
+                        run_coroutine(busy_event.release(), loop)
+                finally:
+                    if entered:
+                        flow.leave()
+                    reset_context(context_token)
+
+        self._callback = _callback
+        if self._prefetch_buffer is not None:
+            self._callback = await run_in_loop(
+                home_loop, self._start_prefetch(invoke, log_success))
+
+        if self._shared is not None:
+            # 消息由共享消费者分派
+            logger.debug("reactor '%s' is dispatched by the shared consumer "
+                         "'%s'", reactor_id, self._shared)
+            return
+
+        consumer = self._channel.create_consumer(self._reactor_id)
+        consumer.set_thread_count(self._max_inflight)
+
+        consumer.subscribe(self._topic, self._callback,
+                           expression=self._expression)
         consumer.start()
 
         self._consumer = consumer
+        logger.debug("reactor '%s' started with %d consuming threads",
+                     reactor_id, self._max_inflight)
+
+    async def _reply_error(self, msg, exc) -> bool:
+        reply_to, correlation_id = get_reply_target(msg)
+        if not reply_to:
+            return False
+
+        try:
+            await send_reply(self._channel, reply_to, correlation_id,
+                             error=str(exc) or type(exc).__name__)
+            return True
+        except Exception as reply_exc:
+            logger.error("failed to reply an error to '%s': %s",
+                         reply_to, reply_exc, exc_info=reply_exc)
+            return False
+
+    async def _start_prefetch(self, invoke, log_success):
+        """在反应器所在的事件循环中创建队列和工作协程，返回消费线程的回调"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        buffer = self._prefetch_buffer
+        buffer.open()
+        flow = self._flow
+        retry_action = SendingAction(self._channel,
+                                     RETRY_TOPIC_PREFIX + self._reactor_id)
+
+        capture = self._channel.capture
+
+        def _prefetch_callback(msg):
+            if capture is not None:
+                capture.write(msg)
+
+            flow.enter()
+            snapshot = snapshot_message(msg)
+            if not buffer.acquire(len(snapshot.body)):
+                # 反应器正在停止，由broker重新投递
+                flow.leave()
+                return ConsumeStatus.RECONSUME_LATER
 
-    async def stop(self):
-        await self._busy_event.wait_idle()
+            loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+            return ConsumeStatus.CONSUME_SUCCESS
+
+        async def _worker():
+            while True:
+                msg = await queue.get()
+                try:
+                    await self._process_prefetched(msg, invoke, log_success,
+                                                   retry_action)
+                finally:
+                    buffer.release(len(msg.body))
+                    flow.leave()
+                    queue.task_done()
+
+        self._prefetch_queue = queue
+        self._prefetch_workers = [loop.create_task(_worker())
+                                  for _ in range(self._max_inflight)]
+        logger.debug("reactor '%s' prefetches up to %d messages",
+                     self._reactor_id, buffer.as_dict()["max_messages"])
+        return _prefetch_callback
+
+    async def _process_prefetched(self, msg, invoke, log_success, retry_action):
+        tags = msg.tags
+        context_token = bind_context(KIND_REACTOR, self._reactor_id, self._topic,
+                                     tags.decode("utf-8") if tags else None,
+                                     msg.id)
+        busy_event = self._busy_events[self._home_loop]
+        acquired = False
+        started = None
+        success = False
+        try:
+            await busy_event.acquire()
+            acquired = True
+            started = self._stats.begin(msg)
+
+            try:
+                arg_values = self._handler_argvals_getter(msg)
+            except MessageSchemaError as exc:
+                self._stats.reject()
+                logger.error("rejected message '%s' in reactor '%s': %s",
+                             msg.id, self._reactor_id, exc)
+                if self._reply:
+                    await self._reply_error(msg, exc)
+                return
+
+            coroutine = invoke(*arg_values)
+            profiler = self._channel.profiler
+            if profiler is not None:
+                coroutine = profiler.run(self._reactor_id, coroutine)
+            result = await coroutine
+
+            if self._reply:
+                reply_to, correlation_id = get_reply_target(msg)
+                if reply_to:
+                    await send_reply(self._channel, reply_to, correlation_id,
+                                     result)
+
+            blob_ref = get_msg_property(msg, CLAIM_CHECK_PROPERTY)
+            if blob_ref:
+                self._channel.blob_store.release(blob_ref)
+
+            success = True
+            log_success("reactor '%s' handled message '%s'",
+                        self._reactor_id, msg.id)
+        except Exception as exc:
+            logger.error("caught an error in reactor '%s': %s",
+                         self._reactor_id, exc, exc_info=exc)
+
+            if self._reply and await self._reply_error(msg, exc):
+                return
+
+            await self._retry_prefetched(msg, retry_action)
+        finally:
+            try:
+                if started is not None:
+                    self._stats.end(started, success)
+                if acquired:
+                    await busy_event.release()
+            finally:
+                reset_context(context_token)
+
+    async def _retry_prefetched(self, msg, retry_action):
+        """消息已经确认，处理失败时以重试主题重新发送给本消费组"""
+        msg_obj = create_retry_msg(msg, self._reactor_id,
+                                   self._channel.message_factory)
+        if msg_obj is None:
+            logger.error("dropped message '%s' in reactor '%s' after %d retries",
+                         msg.id, self._reactor_id, msg.reconsume_times)
+            return
+
+        try:
+            # 同步发送会阻塞，放到生产者线程池中执行
+            await asyncio.get_running_loop().run_in_executor(
+                producer_executor, retry_action.send_msg_obj, msg_obj)
+        except Exception as exc:
+            logger.error("failed to retry message '%s' in reactor '%s': %s",
+                         msg.id, self._reactor_id, exc, exc_info=exc)
+
+    async def _stop_prefetch(self):
+        queue = self._prefetch_queue
+        await queue.join()
+
+        for worker in self._prefetch_workers:
+            worker.cancel()
+        await asyncio.gather(*self._prefetch_workers, return_exceptions=True)
+        self._prefetch_workers = []
+        self._prefetch_queue = None
 
-        # 问题：当前rocket-client-cpp实现在shutdown之前并不能保证工作线程正常结束
-        # 这会导致工作线程和asyncio死锁，所以得到callback线程里任务结束后，再多等待
-        # 一会儿，等待rocket-client-cpp处理完consumer工作线程，再关闭consumer
-        await asyncio.sleep(0.5)
+    async def stop(self):
+        if self._prefetch_buffer is not None:
+            # 唤醒阻塞在缓冲区上的消费线程，关闭消费者之后处理完缓冲区中的消息
+            self._prefetch_buffer.close()
+        else:
+            await self.wait_idle()
+
+        if self._consumer is not None:
+            # 问题：当前rocket-client-cpp实现在shutdown之前并不能保证工作线程正常结束
+            # 这会导致工作线程和asyncio死锁，所以得到callback线程里任务结束后，再多等待
+            # 一会儿，等待rocket-client-cpp处理完consumer工作线程，再关闭consumer
+            await asyncio.sleep(0.5)
 
-        if self._consumer:
             self._consumer.shutdown()
             self._consumer = None
 
+        # 共享消费者分派的反应器、或者消费者启动失败时，也要停止预取的工作协程
+        if self._prefetch_queue is not None:
+            await run_in_loop(self._home_loop, self._stop_prefetch())
+
 
-def build_argvals_getter(handler):
+async def _create_occupied_event():
+    # asyncio的同步原语在所属的事件循环中创建
+    return OccupiedEvent()
+
+
+def build_argvals_getter(handler, channel=None, schema=None):
+    """
+    schema为编译过的消息契约时，message参数是按契约解码的对象；
+    处理函数没有message参数时也按契约校验消息体。
+    """
     arguments = inspect.signature(handler).parameters
 
     getters = []
     unknowns = []
     for arg_name, arg_spec in arguments.items():
+        if arg_name == "message" and schema is not None:
+            getters.append(getter_schema_message(schema, channel))
+            continue
+
         getter_factory = _getter_factories.get(arg_name)
         if getter_factory is not None:
-            getters.append(getter_factory(arg_spec))
+            getters.append(getter_factory(arg_spec, channel))
             continue
 
         unknowns.append((arg_name, arg_spec))
@@ -102,46 +466,86 @@ def build_argvals_getter(handler):
         errmsg = f"Unknown arguments: {args} of '{func}' in '{mod}'"
         raise UnkownArgumentError(errmsg)
 
+    if schema is not None and "message" not in arguments:
+        validate = getter_schema_message(schema, channel)
+
+        def _validating_getter(msgobj):
+            validate(msgobj)
+            return tuple(arg_getter(msgobj) for arg_getter in getters)
+
+        return _validating_getter
+
     def _getter(msgobj):
-        return (arg_getter(msgobj) for arg_getter in getters)
+        # 在调用处理函数之前取得所有参数，不符合契约的消息在此被拒绝
+        return tuple(arg_getter(msgobj) for arg_getter in getters)
 
     return _getter
 
 
-def getter_message(arg_spec):
+def getter_message(arg_spec, channel):
+    # 存放在blob存储中的消息体只在处理函数需要时才读取
+    def _get_blob_store():
+        return channel.blob_store
+
+    def _read_body(msgobj):
+        return read_msg_body(msgobj, _get_blob_store)
+
     if arg_spec.annotation == str:
-        return lambda msgobj: msgobj.body.decode("utf-8")
+        return lambda msgobj: str(_read_body(msgobj), "utf-8")
     elif arg_spec.annotation == bytes:
-        return lambda msgobj: msgobj.body
+        return _read_body
     else:
-        return lambda msgobj: json_loads(msgobj.body.decode("utf-8"))
+        return lambda msgobj: json_loads(str(_read_body(msgobj), "utf-8"))
+
 
+def getter_schema_message(schema, channel):
+    def _get_blob_store():
+        return channel.blob_store
 
-def getter_msg_id(arg_spec):
+    decode = schema.decode
+
+    def _decode(msgobj):
+        try:
+            jsonobj = json_loads(str(read_msg_body(msgobj, _get_blob_store), "utf-8"))
+        except ValueError as exc:
+            raise MessageSchemaError(f"malformed message body: {exc}") from exc
+        return decode(jsonobj)
+
+    return _decode
+
+
+def getter_msg_id(arg_spec, channel):
     return lambda msgobj: getattr(msgobj, "id")
 
 
-def getter_msg_topic(arg_spec):
+def getter_msg_topic(arg_spec, channel):
     return lambda msgobj: getattr(msgobj, "tpoic").decode("utf-8")
 
 
-def getter_msg_keys(arg_spec):
+def getter_msg_keys(arg_spec, channel):
     return lambda msgobj: getattr(msgobj, "keys").decode("utf-8")
 
 
-def getter_msg_tags(arg_spec):
+def getter_msg_tags(arg_spec, channel):
     return lambda msgobj: getattr(msgobj, "tags").decode("utf-8")
 
 
+def getter_msg_born_timestamp(arg_spec, channel):
+    """消息产生的时刻，毫秒"""
+    return lambda msgobj: getattr(msgobj, "born_timestamp")
+
+
 _getter_factories = {
     "message": getter_message,
     "message_id": getter_msg_id,
     "message_topic": getter_msg_topic,
     "message_keys": getter_msg_keys,
     "message_tags": getter_msg_tags,
+    "message_born_timestamp": getter_msg_born_timestamp,
     "msg_id": getter_msg_id,
     "msg_topic": getter_msg_topic,
     "msg_keys": getter_msg_keys,
     "msg_tags": getter_msg_tags,
+    "msg_born_timestamp": getter_msg_born_timestamp,
 }
 
@@ -0,0 +1,252 @@
+"""
+事务性发件箱(transactional outbox)。
+
+事务性消息需要在数据库事务内完成一次与broker的半消息往返，事务持有的锁因此要多等一次网络往返。
+发件箱模式的动作改为在同一个数据库事务内将消息插入发件箱表，事务提交即意味着消息一定会被发送；
+中继任务在另外的短事务中用SELECT ... FOR UPDATE SKIP LOCKED成批认领发件箱表中的消息，
+在事务之外发送，发送成功后删除。多个进程的中继可以同时工作，互不阻塞，但是消息只保证至少投递一次。
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from .outbox import OutboxRecord
+
+logger = logging.getLogger("soybean.relay")
+
+
+class OutboxStore(ABC):
+    """发件箱表的存储接口，子类需要实现insert()和relay()"""
+
+    async def setup(self):
+        """中继启动时调用，例如创建发件箱表"""
+
+    @abstractmethod
+    async def insert(self, record: OutboxRecord):
+        """在动作处理函数所在的数据库事务中插入一条消息"""
+
+    @abstractmethod
+    async def relay(self, limit: int, send) -> int:
+        """
+        认领至多limit条消息，依次用协程函数send(record)发送，删除已经发送的消息，
+        返回发送的数量。send出错时已经发送的消息仍被删除，然后抛出该异常。
+        """
+
+
+class PostgresOutboxStore(OutboxStore):
+    """
+    基于sqlblock的PostgreSQL发件箱表。
+    中继在一个短事务中用FOR UPDATE SKIP LOCKED认领消息、写入租约的到期时刻后即提交，
+    在事务之外发送，再删除已经发送的消息，不在broker往返期间持有行锁和数据库连接；
+    lease为租约的秒数，中继崩溃后认领的消息在租约到期后由其它中继重新发送。
+    """
+
+    def __init__(self, database, table: str = "soybean_outbox",
+                 lease: float = 60):
+        self._database = database
+        self._table = table
+        self._lease = lease
+
+    def _get_conn(self):
+        # 当前数据库事务的连接
+        return self._database._sqlblock._conn
+
+    async def setup(self):
+        @self._database.transaction(renew=True)
+        async def _create_table():
+            conn = self._get_conn()
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self._table} (
+                    id BIGSERIAL PRIMARY KEY,
+                    topic TEXT NOT NULL,
+                    tag TEXT,
+                    keys TEXT,
+                    props JSONB,
+                    body BYTEA NOT NULL,
+                    orderly BOOLEAN NOT NULL DEFAULT false,
+                    priority TEXT,
+                    delay_level INTEGER,
+                    claimed_until TIMESTAMPTZ,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )""")
+            # 此前创建的发件箱表没有这些列
+            for column in ("keys TEXT", "orderly BOOLEAN NOT NULL DEFAULT false",
+                           "priority TEXT", "delay_level INTEGER",
+                           "claimed_until TIMESTAMPTZ"):
+                await conn.execute(f"ALTER TABLE {self._table} "
+                                   f"ADD COLUMN IF NOT EXISTS {column}")
+
+        await _create_table()
+
+    async def insert(self, record: OutboxRecord):
+        await self._get_conn().execute(
+            f"INSERT INTO {self._table} "
+            f"(topic, tag, keys, props, body, orderly, priority, delay_level) "
+            f"VALUES ($1, $2, $3, $4, $5, $6, $7, $8)",
+            record.topic, record.tag, record.keys, record.props, record.body,
+            record.orderly, record.priority, record.delay_level)
+
+    async def relay(self, limit: int, send) -> int:
+        table = self._table
+
+        @self._database.transaction(renew=True)
+        async def _claim():
+            return await self._get_conn().fetch(
+                f"UPDATE {table} "
+                f"SET claimed_until = now() + $2 * interval '1 second' "
+                f"WHERE id IN (SELECT id FROM {table} "
+                f"WHERE claimed_until IS NULL OR claimed_until < now() "
+                f"ORDER BY id LIMIT $1 FOR UPDATE SKIP LOCKED) "
+                f"RETURNING id, topic, tag, keys, props, body, "
+                f"orderly, priority, delay_level", limit, float(self._lease))
+
+        rows = sorted(await _claim(), key=lambda row: row["id"])
+
+        sent_ids, error = [], None
+        for row in rows:
+            record = OutboxRecord(row["topic"], row["tag"], keys=row["keys"],
+                                  props=row["props"], body=bytes(row["body"]),
+                                  orderly=row["orderly"],
+                                  priority=row["priority"],
+                                  delay_level=row["delay_level"])
+            try:
+                await send(record)
+            except Exception as exc:
+                error = exc
+                break
+            sent_ids.append(row["id"])
+
+        unsent_ids = [row["id"] for row in rows[len(sent_ids):]]
+
+        @self._database.transaction(renew=True)
+        async def _finish():
+            conn = self._get_conn()
+            if sent_ids:
+                await conn.execute(
+                    f"DELETE FROM {table} WHERE id = ANY($1::BIGINT[])",
+                    sent_ids)
+            if unsent_ids:
+                # 释放尚未发送的消息，下一次立即重新认领
+                await conn.execute(
+                    f"UPDATE {table} SET claimed_until = NULL "
+                    f"WHERE id = ANY($1::BIGINT[])", unsent_ids)
+
+        if rows:
+            await _finish()
+
+        if error is not None:
+            raise error
+        return len(sent_ids)
+
+
+class MemoryOutboxStore(OutboxStore):
+    """内存中的发件箱表，插入不参与数据库事务，仅用于测试和本地开发"""
+
+    def __init__(self):
+        self._rows = OrderedDict()
+        self._claimed = set()
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self._rows)
+
+    async def insert(self, record: OutboxRecord):
+        self._rows[self._next_id] = record
+        self._next_id += 1
+
+    async def relay(self, limit: int, send) -> int:
+        # 与SKIP LOCKED相同，跳过其它中继已经认领的消息
+        claimed = []
+        for row_id in self._rows:
+            if row_id not in self._claimed:
+                claimed.append(row_id)
+                if len(claimed) == limit:
+                    break
+        self._claimed.update(claimed)
+
+        count = 0
+        try:
+            for row_id in claimed:
+                await send(self._rows[row_id])
+                del self._rows[row_id]
+                count += 1
+        finally:
+            self._claimed.difference_update(claimed)
+
+        return count
+
+
+class OutboxRelay:
+    """
+    将发件箱表中的消息成批转发到broker。动作的事务提交后调用notify()立即唤醒中继，
+    此外每隔interval秒检查一次，以发送其它进程或者此前未能发送的消息。
+    """
+
+    def __init__(self, store: OutboxStore, send,
+                 batch_size: int = 100,
+                 interval: float = 1.0,
+                 min_backoff: float = 0.5,
+                 max_backoff: float = 30):
+
+        self._store = store
+        self._send = send
+        self._batch_size = batch_size
+        self._interval = interval
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+
+        self._task = None
+        self._wakeup = None
+        self._loop = None
+
+    @property
+    def store(self) -> OutboxStore:
+        return self._store
+
+    def notify(self):
+        """唤醒中继，可以在任何线程中调用"""
+        loop, wakeup = self._loop, self._wakeup
+        if wakeup is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def start(self):
+        await self._store.setup()
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wakeup = None
+
+    async def _run(self):
+        backoff = self._min_backoff
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                while (await self._store.relay(self._batch_size, self._send)
+                       == self._batch_size):
+                    pass
+            except Exception as exc:
+                logger.warning("failed to relay messages in the outbox table, "
+                               "retry in %.1fs: %s", backoff, exc)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+                self._wakeup.set()
+                continue
+
+            backoff = self._min_backoff
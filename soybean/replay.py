@@ -0,0 +1,172 @@
+"""
+回放录制的消费流量：在进程内的本地broker上按原来的节奏（或加速）重新发送录制的消息，
+由应用自己声明的反应器处理，统计每个反应器的处理延迟，用于比较不同版本的性能。
+
+    python -m soybean.replay capture.bin --app myapp.mq:mq --speed 10 --output new.json
+    python -m soybean.replay capture.bin --app myapp.mq:mq --compare old.json
+
+--app为模块和其中RocketMQ或DomainChannel对象的名称，回放时该领域改用本地broker；
+--speed为回放的倍速，0表示不等待、尽快发送。消息按录制的次序发送，相邻消息的间隔
+按照产生的时刻换算。
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+
+from .capture import read_capture
+from .utils import create_msg
+
+
+def _consumed(channel) -> int:
+    return sum(stats["consumed"] + stats["rejected"]
+               for stats in channel.stats()["reactors"].values())
+
+
+async def replay(channel, path: str, speed: float = 1.0,
+                 drain_timeout: float = 30, idle: float = 1.0):
+    """
+    在已经启动的本地broker领域上回放录制文件，等待反应器处理完毕后返回统计。
+    反应器处理的消息数量在idle秒内不再变化，或者超过drain_timeout秒时视为处理完毕。
+    """
+    if not channel.is_local:
+        raise ValueError("the replay should run on the local broker")
+
+    producer = channel.create_producer(f"{channel.name}|replay")
+    producer.start()
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first_born = None
+    count = 0
+    try:
+        for captured in read_capture(path):
+            if speed:
+                if first_born is None:
+                    first_born = captured.born_timestamp
+                due = (captured.born_timestamp - first_born) / 1000 / speed
+                delay = started + due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            msg_obj = create_msg(captured.topic, captured.body,
+                                 captured.keys, captured.tag, captured.props,
+                                 message_factory=channel.create_message)
+            producer.send_sync(msg_obj)
+            count += 1
+    finally:
+        producer.shutdown()
+
+    published = loop.time()
+
+    deadline = published + drain_timeout
+    last, last_changed = _consumed(channel), loop.time()
+    while loop.time() < deadline:
+        await asyncio.sleep(0.1)
+        consumed = _consumed(channel)
+        if consumed != last:
+            last, last_changed = consumed, loop.time()
+        elif loop.time() - last_changed >= idle:
+            break
+
+    return {
+        "messages": count,
+        "publish_seconds": published - started,
+        "reactors": channel.stats()["reactors"],
+    }
+
+
+def _load_channel(app: str):
+    module_name, _, attr = app.partition(":")
+    obj = importlib.import_module(module_name)
+    for name in attr.split("."):
+        obj = getattr(obj, name)
+
+    # RocketMQ对象包装了DomainChannel
+    return getattr(obj, "_channel", obj)
+
+
+def _format_report(report, baseline=None):
+    lines = [f"replayed {report['messages']} messages in "
+             f"{report['publish_seconds']:.1f}s"]
+    lines.append(f"{'reactor':<60s} {'consumed':>9s} {'errors':>7s} "
+                 f"{'p50(ms)':>9s} {'p99(ms)':>9s} {'max(ms)':>9s}")
+
+    baseline_reactors = baseline["reactors"] if baseline else {}
+    for reactor_id, stats in sorted(report["reactors"].items()):
+        latency = stats["latency"]
+        lines.append(f"{reactor_id:<60s} {stats['consumed']:9d} "
+                     f"{stats['errors']:7d} {latency['p50'] * 1000:9.3f} "
+                     f"{latency['p99'] * 1000:9.3f} {latency['max'] * 1000:9.3f}")
+
+        old = baseline_reactors.get(reactor_id)
+        if old is not None:
+            old_latency = old["latency"]
+            lines.append(f"{'  vs baseline':<60s} {'':9s} {'':7s} "
+                         f"{_delta(latency['p50'], old_latency['p50']):>9s} "
+                         f"{_delta(latency['p99'], old_latency['p99']):>9s} "
+                         f"{_delta(latency['max'], old_latency['max']):>9s}")
+
+    return "\n".join(lines)
+
+
+def _delta(value, old):
+    if not old:
+        return "-"
+    return f"{(value - old) / old * 100:+.1f}%"
+
+
+def run(args):
+    channel = _load_channel(args.app)
+    channel.use_local_transport(args.namesrv)
+
+    async def _main():
+        await channel.start()
+        try:
+            return await replay(channel, args.capture, speed=args.speed,
+                                drain_timeout=args.drain_timeout)
+        finally:
+            await channel.stop()
+
+    started = time.time()
+    report = asyncio.run(_main())
+    report["elapsed"] = time.time() - started
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(_format_report(report, baseline))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m soybean.replay",
+                                     description="replay captured messages")
+    parser.add_argument("capture", help="capture file recorded by enable_capture()")
+    parser.add_argument("--app", required=True,
+                        help="'module:name' of the RocketMQ or DomainChannel")
+    parser.add_argument("--namesrv", default="local://replay",
+                        help="address of the in-process broker")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed, 0 for max speed")
+    parser.add_argument("--drain-timeout", type=float, default=30,
+                        help="seconds to wait for the reactors")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="baseline report to compare with")
+
+    args = parser.parse_args(argv)
+    if args.speed < 0:
+        parser.error("--speed should not be negative")
+
+    run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
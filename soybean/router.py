@@ -0,0 +1,73 @@
+"""
+进程内的标签路由。
+
+RocketMQ的标签表达式形如"A || B"或"*"。路由表在注册时解析表达式，并为每个出现过的标签
+预先计算好按注册次序排列的目标元组（包括订阅了"*"的目标），分派消息时只需一次字典查找，
+与订阅的数量无关。
+"""
+
+
+def parse_tag_expression(expression: str):
+    """解析标签表达式，返回标签集合，表达式为'*'时返回None"""
+    tags = set()
+    for tag in expression.split("||"):
+        tag = tag.strip()
+        if tag == "*":
+            return None
+        if tag:
+            tags.add(tag)
+
+    return frozenset(tags)
+
+
+class TagRouter:
+
+    __slots__ = ("_entries", "_table", "_wildcards")
+
+    def __init__(self):
+        self._entries = []
+        self._table = {}
+        self._wildcards = ()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def targets(self):
+        return [target for _, target in self._entries]
+
+    def add(self, expression: str, target):
+        self._entries.append((parse_tag_expression(expression), target))
+        self._compile()
+
+    def remove(self, target):
+        self._entries = [(tags, t) for tags, t in self._entries
+                         if t is not target]
+        self._compile()
+
+    def expression(self) -> str:
+        """所有表达式的并集"""
+        tags = set()
+        for entry_tags, _ in self._entries:
+            if entry_tags is None:
+                return "*"
+            tags.update(entry_tags)
+
+        return " || ".join(sorted(tags))
+
+    def route(self, tag: str):
+        """返回匹配该标签的所有目标"""
+        return self._table.get(tag, self._wildcards)
+
+    def _compile(self):
+        all_tags = set()
+        for tags, _ in self._entries:
+            if tags is not None:
+                all_tags.update(tags)
+
+        self._table = {
+            tag: tuple(target for tags, target in self._entries
+                       if tags is None or tag in tags)
+            for tag in all_tags
+        }
+        self._wildcards = tuple(target for tags, target in self._entries
+                                if tags is None)
@@ -0,0 +1,193 @@
+"""
+基于主题的请求/应答。
+
+请求消息的属性中带有关联id和应答主题，每个进程实例有自己的应答主题和消费者。
+应答者处理完请求后将结果以相同的关联id发送到应答主题，请求者按关联id找到等待的future。
+等待应答的请求数量有上限，超时的请求会被移除，迟到的应答被丢弃。
+"""
+import re
+import uuid
+import asyncio
+import logging
+from rocketmq.client import ConsumeStatus
+
+from .utils import make_instance_id, pinyin_translate
+from .utils import json_loads, read_msg_body, get_msg_property
+from .exceptions import RequestError, RequestTimeoutError
+from .action.simple import SendingAction
+
+logger = logging.getLogger("soybean.rpc")
+
+
+CORRELATION_PROPERTY = "soybean_correlation_id"
+REPLY_TO_PROPERTY = "soybean_reply_to"
+REPLY_ERROR_PROPERTY = "soybean_reply_error"
+
+REPLY_TAG = "Reply"
+
+_INVALID_NAME_CHARS = re.compile("[^%|a-zA-Z0-9_-]")
+
+
+def make_reply_topic(channel_name, instance_id=None):
+    instance_id = instance_id or make_instance_id()
+    topic = pinyin_translate(f"{channel_name}-reply-{instance_id}")
+    return _INVALID_NAME_CHARS.sub("_", topic)[:127]
+
+
+class ReplyRegistry:
+    """等待应答的请求，关联id => future"""
+
+    def __init__(self, max_pending: int = 10000):
+        self._max_pending = max_pending
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def register(self, timeout: float):
+        """登记一个请求，返回(关联id, future)，超时后future被设置为RequestTimeoutError"""
+        if len(self._pending) >= self._max_pending:
+            raise RequestError(f"too many pending requests: "
+                               f"{len(self._pending)}")
+
+        loop = asyncio.get_running_loop()
+        correlation_id = uuid.uuid4().hex
+        future = loop.create_future()
+
+        timer = loop.call_later(timeout, self._expire, correlation_id, timeout)
+        self._pending[correlation_id] = (future, timer)
+        return correlation_id, future
+
+    def discard(self, correlation_id):
+        entry = self._pending.pop(correlation_id, None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def resolve(self, correlation_id, result=None, error: str = None):
+        entry = self._pending.pop(correlation_id, None)
+        if entry is None:
+            logger.debug("dropped a late or unknown reply '%s'", correlation_id)
+            return
+
+        future, timer = entry
+        timer.cancel()
+        if future.done():
+            return
+
+        if error is not None:
+            future.set_exception(RequestError(error))
+        else:
+            future.set_result(result)
+
+    def _expire(self, correlation_id, timeout):
+        entry = self._pending.pop(correlation_id, None)
+        if entry is None:
+            return
+
+        future = entry[0]
+        if not future.done():
+            future.set_exception(RequestTimeoutError(
+                f"no reply to the request '{correlation_id}' in {timeout}s"))
+
+
+class RpcClient:
+    """请求者，拥有本进程实例的应答主题和消费者"""
+
+    def __init__(self, channel, max_pending: int = 10000):
+        self._channel = channel
+        self._reply_topic = make_reply_topic(channel.name)
+        self._registry = ReplyRegistry(max_pending)
+        self._consumer = None
+        self._starting = None
+
+    @property
+    def reply_topic(self) -> str:
+        return self._reply_topic
+
+    @property
+    def registry(self) -> ReplyRegistry:
+        return self._registry
+
+    async def request(self, action, msg, timeout: float):
+        """通过action发送请求消息，等待并返回应答的内容"""
+        await self._ensure_started()
+
+        correlation_id, future = self._registry.register(timeout)
+        props = {
+            CORRELATION_PROPERTY: correlation_id,
+            REPLY_TO_PROPERTY: self._reply_topic,
+        }
+        try:
+            await action.send(msg, props=props)
+        except BaseException:
+            self._registry.discard(correlation_id)
+            raise
+
+        return await future
+
+    async def _ensure_started(self):
+        if self._consumer is not None:
+            return
+
+        if self._starting is None:
+            loop = asyncio.get_running_loop()
+            self._starting = loop.create_task(self._start(loop))
+        await asyncio.shield(self._starting)
+
+    async def _start(self, loop):
+        registry = self._registry
+
+        def _on_reply(msg):
+            correlation_id = get_msg_property(msg, CORRELATION_PROPERTY)
+            if not correlation_id:
+                return ConsumeStatus.CONSUME_SUCCESS
+
+            error = get_msg_property(msg, REPLY_ERROR_PROPERTY) or None
+            result = None
+            if error is None:
+                try:
+                    result = json_loads(str(read_msg_body(msg), "utf-8"))
+                except Exception as exc:
+                    error = f"malformed reply: {exc}"
+
+            loop.call_soon_threadsafe(registry.resolve,
+                                      correlation_id, result, error)
+            return ConsumeStatus.CONSUME_SUCCESS
+
+        group_id = f"{pinyin_translate(self._channel.name)}%{self._reply_topic}"
+        try:
+            consumer = self._channel.create_consumer(group_id)
+            consumer.set_thread_count(1)
+            consumer.subscribe(self._reply_topic, _on_reply)
+            consumer.start()
+        except Exception:
+            # 不缓存失败的启动，下一个请求重新启动
+            self._starting = None
+            raise
+
+        self._consumer = consumer
+
+    async def stop(self):
+        if self._consumer is not None:
+            self._consumer.shutdown()
+            self._consumer = None
+        self._starting = None
+
+
+def get_reply_target(msg):
+    """返回请求消息的(应答主题, 关联id)，不是请求消息时返回(None, None)"""
+    reply_to = get_msg_property(msg, REPLY_TO_PROPERTY)
+    if not reply_to:
+        return None, None
+
+    return reply_to, get_msg_property(msg, CORRELATION_PROPERTY)
+
+
+async def send_reply(channel, reply_to, correlation_id, result=None,
+                     error: str = None):
+    props = {CORRELATION_PROPERTY: correlation_id}
+    if error is not None:
+        props[REPLY_ERROR_PROPERTY] = error
+
+    action = SendingAction(channel, reply_to, REPLY_TAG, props=props)
+    await action.send(result)
@@ -0,0 +1,343 @@
+"""
+延时消息。
+
+延时恰好等于RocketMQ某个延时级别的消息由broker延时投递；其余的延时消息由本地的
+时间轮调度器保存，到期后再发送。指定了日志文件时，调度器将待发送的消息记录在
+日志文件中，重启后重新载入未发送的消息；否则延时消息只保存在内存中。
+"""
+import os
+import json
+import math
+import time
+import uuid
+import asyncio
+import logging
+import fcntl
+from datetime import datetime
+
+from sqlblock.utils.json import json_dumps, json_loads
+
+logger = logging.getLogger("soybean.scheduler")
+
+
+# RocketMQ缺省的延时级别: 1s 5s 10s 30s 1m 2m 3m 4m 5m 6m 7m 8m 9m 10m 20m 30m 1h 2h
+DELAY_LEVELS = (1, 5, 10, 30, 60, 120, 180, 240, 300, 360, 420, 480, 540, 600,
+                1200, 1800, 3600, 7200)
+
+_delay_level_map = {seconds: level
+                    for level, seconds in enumerate(DELAY_LEVELS, start=1)}
+
+
+def match_delay_level(delay: float):
+    """延时秒数恰好等于某个延时级别时返回该级别，否则返回None"""
+    seconds = round(delay)
+    if abs(delay - seconds) > 1e-3:
+        return None
+
+    return _delay_level_map.get(seconds)
+
+
+def resolve_delay(delay=None, deliver_at=None):
+    """
+    将delay(秒数或timedelta)或者deliver_at(datetime或时间戳)换算成延时的秒数，
+    没有延时返回None
+    """
+    if deliver_at is not None:
+        if delay is not None:
+            raise ValueError("delay and deliver_at should not be both given")
+
+        if isinstance(deliver_at, datetime):
+            deliver_at = deliver_at.timestamp()
+
+        return max(deliver_at - time.time(), 0.0)
+
+    if delay is None:
+        return None
+
+    if hasattr(delay, "total_seconds"):
+        delay = delay.total_seconds()
+
+    if delay < 0:
+        raise ValueError(f"the delay should not be negative: {delay}")
+
+    return delay
+
+
+class TimerWheel:
+    """哈希时间轮。
+
+    每格tick秒，共slots格，定时器按照到期的格数散列到对应的格子里，超过一圈的定时器
+    留在格子里等待后面的圈次。插入和取消是O(1)；每前进一格只检查该格子里的定时器。
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 512, now: float = None):
+        self._tick = tick
+        self._slots = [dict() for _ in range(slots)]
+        self._origin = time.time() if now is None else now
+        self._current = 0  # 已经处理过的格数
+        self._locations = {}  # key => 所在的格子
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def tick(self) -> float:
+        return self._tick
+
+    def add(self, key, deadline: float, item):
+        """添加到期时间为deadline的定时器，已经过期的定时器在下一格到期"""
+        if key in self._locations:
+            self.cancel(key)
+
+        ticks = math.ceil((deadline - self._origin) / self._tick)
+        ticks = max(ticks, self._current + 1)
+
+        slot = self._slots[ticks % len(self._slots)]
+        slot[key] = (ticks, item)
+        self._locations[key] = slot
+        self._count += 1
+
+    def cancel(self, key) -> bool:
+        slot = self._locations.pop(key, None)
+        if slot is None:
+            return False
+
+        del slot[key]
+        self._count -= 1
+        return True
+
+    def advance(self, now: float):
+        """前进到now时刻，返回期间到期的所有定时器"""
+        target = math.floor((now - self._origin) / self._tick)
+        expired = []
+
+        n_slots = len(self._slots)
+        if target - self._current > n_slots:
+            # 落后超过一圈，每个格子检查一遍即可
+            self._current = target - n_slots
+
+        while self._current < target:
+            self._current += 1
+            slot = self._slots[self._current % n_slots]
+            if not slot:
+                continue
+
+            current = self._current
+            due_keys = [key for key, (ticks, _) in slot.items()
+                        if ticks <= current]
+            for key in due_keys:
+                _, item = slot.pop(key)
+                del self._locations[key]
+                self._count -= 1
+                expired.append(item)
+
+        return expired
+
+
+class DelayedMessage:
+    """
+    compression 发送时的压缩选项[算法名称, 阈值]，False为不压缩，None为领域的缺省值；
+    claim_check 发送时认领检查的阈值，None为不做认领检查；
+    keys 消息的键。
+    """
+
+    __slots__ = ("id", "deliver_at", "topic", "tag", "body",
+                 "orderly", "props", "priority", "compression", "claim_check",
+                 "keys")
+
+    def __init__(self, id, deliver_at, topic, tag, body,
+                 orderly=False, props=None, priority=None,
+                 compression=None, claim_check=None, keys=None):
+        self.id = id
+        self.deliver_at = deliver_at
+        self.topic = topic
+        self.tag = tag
+        self.body = body
+        self.orderly = orderly
+        self.props = props
+        self.priority = priority
+        self.compression = compression
+        self.claim_check = claim_check
+        self.keys = keys
+
+    def to_record(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class DelayedMessageJournal:
+    """延时消息的日志文件，每行一条json记录：添加消息或者标记消息已发送。
+
+    日志文件被一个进程独占，path为None时不做任何记录。
+    """
+
+    def __init__(self, path: str = None, fsync: bool = False):
+        self._path = path
+        self._fsync = fsync
+        self._file = None
+        self._lock_file = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def load(self):
+        """载入尚未发送的消息，并压缩日志文件只保留这些消息"""
+        if self._path is None:
+            return []
+
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        self._lock()
+
+        pending = {}
+        if os.path.exists(self._path):
+            with open(self._path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 最后一行可能在写入时被中断
+                        logger.warning("skipped a broken line in '%s'",
+                                       self._path)
+                        continue
+
+                    if record.get("done"):
+                        pending.pop(record["id"], None)
+                    else:
+                        pending[record["id"]] = DelayedMessage(**record)
+
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for msg in pending.values():
+                f.write(json.dumps(msg.to_record()) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+
+        self._file = open(self._path, "a", encoding="utf-8")
+        return list(pending.values())
+
+    def _lock(self):
+        lock_file = open(self._path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(f"the journal '{self._path}' of delayed "
+                               f"messages is used by another process")
+
+        self._lock_file = lock_file
+
+    def append(self, msg: DelayedMessage):
+        self._write(msg.to_record())
+
+    def mark_done(self, msg_id: str):
+        self._write({"id": msg_id, "done": True})
+
+    def _write(self, record):
+        if self._file is None:
+            return
+
+        self._file.write(json.dumps(record) + "\n")
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class DelayedMessageScheduler:
+    """在本地保存延时消息，到期后调用start()时给定的send协程函数发送"""
+
+    def __init__(self, path: str = None, tick: float = 0.1,
+                 fsync: bool = False, retry_delay: float = 5):
+        self._journal = DelayedMessageJournal(path, fsync=fsync)
+        self._wheel = None
+        self._tick = tick
+        self._retry_delay = retry_delay
+        self._send = None
+        self._task = None
+        self._sending = set()
+
+    def __len__(self):
+        return len(self._wheel) if self._wheel is not None else 0
+
+    async def start(self, send):
+        """send(delayed_msg, jsonobj)为发送延时消息的协程函数"""
+        self._send = send
+        self._wheel = TimerWheel(tick=self._tick)
+
+        for msg in self._journal.load():
+            self._wheel.add(msg.id, msg.deliver_at, msg)
+
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+        self._journal.close()
+
+    def schedule(self, deliver_at: float, topic: str, tag: str, jsonobj,
+                 orderly: bool = False, props=None, priority=None,
+                 compression=None, claim_check: int = None,
+                 keys: str = None) -> str:
+        if self._wheel is None:
+            raise RuntimeError("the scheduler of delayed messages "
+                               "is not started yet")
+
+        body = json_dumps(jsonobj)
+        msg = DelayedMessage(uuid.uuid4().hex, deliver_at, topic, tag, body,
+                             orderly=orderly, props=props, priority=priority,
+                             compression=compression, claim_check=claim_check,
+                             keys=keys)
+        self._journal.append(msg)
+        self._wheel.add(msg.id, deliver_at, msg)
+        return msg.id
+
+    def cancel(self, msg_id: str) -> bool:
+        if self._wheel.cancel(msg_id):
+            self._journal.mark_done(msg_id)
+            return True
+        return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        tick = self._tick
+        while True:
+            await asyncio.sleep(tick)
+            for msg in self._wheel.advance(time.time()):
+                task = loop.create_task(self._deliver(msg))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+
+    async def _deliver(self, msg: DelayedMessage):
+        try:
+            await self._send(msg, json_loads(msg.body))
+        except Exception as exc:
+            logger.error("failed to send the delayed message '%s', "
+                         "retry in %ss: %s", msg.id, self._retry_delay, exc,
+                         exc_info=exc)
+            self._wheel.add(msg.id, time.time() + self._retry_delay, msg)
+            return
+
+        self._journal.mark_done(msg.id)
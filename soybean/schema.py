@@ -0,0 +1,312 @@
+"""
+消息的类型契约。
+
+动作和反应器可以用dataclass或TypedDict声明某个标签的消息结构。契约在声明时编译成
+解码函数和编码函数，每个字段的检查和转换函数预先确定，处理消息时不再分析类型。
+* 反应器按契约解码消息体，处理函数的message参数即是dataclass对象或者校验过的字典；
+  不符合契约的消息在调用处理函数之前被拒绝，直接确认消费，不再重新投递；
+* 动作按契约编码处理函数的结果，dataclass对象直接按字段转换成字典，不符合契约时抛出异常。
+
+支持的字段类型：int、float、str、bool、Decimal、date、datetime、Any、Optional、Union、
+List、Dict，以及嵌套的dataclass和TypedDict。多余的字段被忽略。
+"""
+import typing
+import dataclasses
+from decimal import Decimal
+from datetime import date, datetime
+
+from .exceptions import MessageSchemaError
+
+
+class MessageSchema:
+    __slots__ = ("schema", "decode", "encode")
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.decode = _compile_decoder(schema, schema.__name__)
+        self.encode = _compile_encoder(schema, schema.__name__)
+
+    def __repr__(self):
+        return f"<MessageSchema {self.schema.__name__}>"
+
+
+_compiled_schemas = {}
+
+
+def compile_schema(schema) -> MessageSchema:
+    """编译dataclass或TypedDict的消息契约，相同的类型只编译一次"""
+    compiled = _compiled_schemas.get(schema)
+    if compiled is None:
+        if not (dataclasses.is_dataclass(schema) or _is_typeddict(schema)):
+            raise TypeError(f"the message schema should be a dataclass or "
+                            f"a TypedDict, not {schema!r}")
+
+        compiled = MessageSchema(schema)
+        _compiled_schemas[schema] = compiled
+    return compiled
+
+
+def _is_typeddict(tp):
+    return (isinstance(tp, type) and issubclass(tp, dict)
+            and hasattr(tp, "__total__"))
+
+
+def _required_keys(tp):
+    required = getattr(tp, "__required_keys__", None)
+    if required is not None:
+        return frozenset(required)
+    return frozenset(tp.__annotations__) if tp.__total__ else frozenset()
+
+
+def _type_error(path, expected, value):
+    return MessageSchemaError(f"{path}: expected {expected}, "
+                              f"got {type(value).__name__}")
+
+
+def _identity(value):
+    return value
+
+
+def _compile_decoder(tp, path):
+    """返回将json对象转换成tp类型的函数，不符合时抛出MessageSchemaError"""
+    if tp is typing.Any or tp is object:
+        return _identity
+
+    if tp is type(None):
+        def _decode_none(value):
+            if value is not None:
+                raise _type_error(path, "null", value)
+            return value
+        return _decode_none
+
+    if tp is bool or tp is str:
+        name = "bool" if tp is bool else "str"
+
+        def _decode_exact(value):
+            if type(value) is not tp:
+                raise _type_error(path, name, value)
+            return value
+        return _decode_exact
+
+    if tp is int:
+        def _decode_int(value):
+            if type(value) is not int:
+                raise _type_error(path, "int", value)
+            return value
+        return _decode_int
+
+    if tp is float:
+        def _decode_float(value):
+            if type(value) is float:
+                return value
+            if type(value) is int:
+                return float(value)
+            raise _type_error(path, "float", value)
+        return _decode_float
+
+    if tp is Decimal:
+        def _decode_decimal(value):
+            if type(value) in (str, int, float):
+                try:
+                    return Decimal(value)
+                except ArithmeticError:
+                    pass
+            raise _type_error(path, "decimal", value)
+        return _decode_decimal
+
+    if tp is datetime or tp is date:
+        parse = tp.fromisoformat
+
+        def _decode_datetime(value):
+            if type(value) is str:
+                try:
+                    return parse(value)
+                except ValueError:
+                    pass
+            raise _type_error(path, tp.__name__, value)
+        return _decode_datetime
+
+    if dataclasses.is_dataclass(tp):
+        return _compile_dataclass_decoder(tp, path)
+
+    if _is_typeddict(tp):
+        return _compile_typeddict_decoder(tp, path)
+
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+
+    if origin is typing.Union:
+        decoders = [_compile_decoder(arg, path) for arg in args]
+        expected = " or ".join(getattr(arg, "__name__", str(arg)) for arg in args)
+
+        def _decode_union(value):
+            for decoder in decoders:
+                try:
+                    return decoder(value)
+                except MessageSchemaError:
+                    continue
+            raise _type_error(path, expected, value)
+        return _decode_union
+
+    if tp is list or origin is list:
+        item_decoder = _compile_decoder(args[0], path + "[]") if args else _identity
+
+        def _decode_list(value):
+            if type(value) is not list:
+                raise _type_error(path, "list", value)
+            if item_decoder is _identity:
+                return value
+            return [item_decoder(item) for item in value]
+        return _decode_list
+
+    if tp is dict or origin is dict:
+        value_decoder = _compile_decoder(args[1], path + "{}") if args else _identity
+
+        def _decode_dict(value):
+            if type(value) is not dict:
+                raise _type_error(path, "object", value)
+            if value_decoder is _identity:
+                return value
+            return {k: value_decoder(v) for k, v in value.items()}
+        return _decode_dict
+
+    raise TypeError(f"unsupported type {tp!r} of '{path}' in the message schema")
+
+
+def _compile_dataclass_decoder(tp, path):
+    hints = typing.get_type_hints(tp)
+    fields = []
+    for field in dataclasses.fields(tp):
+        if not field.init:
+            continue
+        required = (field.default is dataclasses.MISSING and
+                    field.default_factory is dataclasses.MISSING)
+        decoder = _compile_decoder(hints[field.name], f"{path}.{field.name}")
+        fields.append((field.name, decoder, required))
+
+    def _decode_dataclass(value):
+        if type(value) is not dict:
+            raise _type_error(path, "object", value)
+
+        kwargs = {}
+        for name, decoder, required in fields:
+            if name in value:
+                kwargs[name] = decoder(value[name])
+            elif required:
+                raise MessageSchemaError(f"{path}.{name}: missing field")
+        return tp(**kwargs)
+
+    return _decode_dataclass
+
+
+def _compile_typeddict_decoder(tp, path):
+    hints = typing.get_type_hints(tp)
+    required_keys = _required_keys(tp)
+    fields = [(name, _compile_decoder(hint, f"{path}.{name}"), name in required_keys)
+              for name, hint in hints.items()]
+
+    def _decode_typeddict(value):
+        if type(value) is not dict:
+            raise _type_error(path, "object", value)
+
+        result = {}
+        for name, decoder, required in fields:
+            if name in value:
+                result[name] = decoder(value[name])
+            elif required:
+                raise MessageSchemaError(f"{path}.{name}: missing field")
+        return result
+
+    return _decode_typeddict
+
+
+def _compile_encoder(tp, path):
+    """返回将tp类型的值转换成json对象的函数，不符合时抛出MessageSchemaError"""
+    if dataclasses.is_dataclass(tp):
+        return _compile_dataclass_encoder(tp, path)
+
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+
+    if origin is typing.Union:
+        encoders = [_compile_encoder(arg, path) for arg in args]
+
+        def _encode_union(value):
+            for encoder in encoders:
+                try:
+                    return encoder(value)
+                except MessageSchemaError:
+                    continue
+            raise _type_error(path, "union member", value)
+        return _encode_union
+
+    if (tp is list or origin is list) and args:
+        item_encoder = _compile_encoder(args[0], path + "[]")
+
+        def _encode_list(value):
+            if not isinstance(value, (list, tuple)):
+                raise _type_error(path, "list", value)
+            return [item_encoder(item) for item in value]
+        return _encode_list
+
+    if (tp is dict or origin is dict) and args:
+        value_encoder = _compile_encoder(args[1], path + "{}")
+
+        def _encode_dict(value):
+            if not isinstance(value, dict):
+                raise _type_error(path, "object", value)
+            return {k: value_encoder(v) for k, v in value.items()}
+        return _encode_dict
+
+    if _is_typeddict(tp):
+        hints = typing.get_type_hints(tp)
+        required_keys = _required_keys(tp)
+        fields = [(name, _compile_encoder(hint, f"{path}.{name}"),
+                   name in required_keys)
+                  for name, hint in hints.items()]
+
+        def _encode_typeddict(value):
+            if not isinstance(value, dict):
+                raise _type_error(path, "object", value)
+
+            result = {}
+            for name, encoder, required in fields:
+                if name in value:
+                    result[name] = encoder(value[name])
+                elif required:
+                    raise MessageSchemaError(f"{path}.{name}: missing field")
+            return result
+        return _encode_typeddict
+
+    # 基本类型的编码即是校验，Decimal和日期由json_dumps转换
+    decoder = _compile_decoder(tp, path)
+    if decoder is _identity:
+        return _identity
+
+    if tp in (Decimal, datetime, date):
+        def _encode_value(value):
+            if not isinstance(value, tp):
+                raise _type_error(path, tp.__name__, value)
+            return value
+        return _encode_value
+
+    return decoder
+
+
+def _compile_dataclass_encoder(tp, path):
+    hints = typing.get_type_hints(tp)
+    fields = [(field.name, _compile_encoder(hints[field.name], f"{path}.{field.name}"))
+              for field in dataclasses.fields(tp)]
+    decode = _compile_decoder(tp, path)
+
+    def _encode_dataclass(value):
+        if type(value) is not tp:
+            if type(value) is dict:
+                # 处理函数返回字典时，先按契约校验
+                value = decode(value)
+            else:
+                raise _type_error(path, tp.__name__, value)
+
+        return {name: encoder(getattr(value, name)) for name, encoder in fields}
+
+    return _encode_dataclass
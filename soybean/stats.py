@@ -0,0 +1,185 @@
+"""
+反应器的运行统计。
+
+每个反应器统计每秒消费的消息数量、处理延迟的分位数、重新投递的次数，以及从消息产生
+(born)或者存入broker(store)到开始处理之间的延迟。延迟由对数分桶的直方图估计，
+内存占用固定，分位数的相对误差不超过桶的增长率。统计在消费线程中记录，由锁保护。
+"""
+import math
+import time
+import threading
+from array import array
+
+
+class LogHistogram:
+    """
+    对数分桶的直方图，第i个桶的上界为min_value * growth ** i，
+    小于min_value的值计入第0个桶，大于max_value的值计入最后一个桶。
+    """
+
+    __slots__ = ("_min_value", "_log_growth", "_counts",
+                 "_count", "_total", "_max")
+
+    def __init__(self, min_value: float = 1e-6, max_value: float = 3600,
+                 growth: float = 1.02):
+        self._min_value = min_value
+        self._log_growth = math.log(growth)
+
+        n_buckets = math.ceil(math.log(max_value / min_value) / self._log_growth)
+        self._counts = array("Q", bytes(8 * (n_buckets + 1)))
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def record(self, value: float):
+        if value > self._min_value:
+            index = math.ceil(math.log(value / self._min_value) / self._log_growth)
+            index = min(index, len(self._counts) - 1)
+        else:
+            index = 0
+
+        self._counts[index] += 1
+        self._count += 1
+        self._total += value
+        if value > self._max:
+            self._max = value
+
+    def mean(self) -> float:
+        return self._total / self._count if self._count else 0.0
+
+    def max(self) -> float:
+        return self._max
+
+    def percentile(self, q: float) -> float:
+        """q为0到100之间的百分数，返回所在桶的上界"""
+        if not self._count:
+            return 0.0
+
+        rank = max(math.ceil(self._count * q / 100), 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                bound = self._min_value * math.exp(index * self._log_growth)
+                return min(bound, self._max)
+
+        return self._max
+
+    def summary(self):
+        return {
+            "count": self._count,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self._max,
+        }
+
+
+class RateMeter:
+    """最近window秒内平均每秒的事件数量，按秒分桶的环形计数"""
+
+    __slots__ = ("_window", "_slots", "_seconds")
+
+    def __init__(self, window: int = 60):
+        self._window = window
+        self._slots = [0] * window
+        self._seconds = [0] * window  # 各个桶所属的秒
+
+    def mark(self, now: float = None):
+        second = int(time.time() if now is None else now)
+        index = second % self._window
+        if self._seconds[index] != second:
+            self._seconds[index] = second
+            self._slots[index] = 0
+        self._slots[index] += 1
+
+    def rate(self, now: float = None) -> float:
+        """不含当前这一秒"""
+        second = int(time.time() if now is None else now)
+        total = sum(count for count, s in zip(self._slots, self._seconds)
+                    if second - self._window <= s < second)
+        return total / self._window
+
+
+class ReactorStats:
+    """一个反应器的运行统计"""
+
+    def __init__(self, rate_window: int = 60):
+        self._lock = threading.Lock()
+        self._consumed = 0
+        self._errors = 0
+        self._rejected = 0
+        self._redeliveries = 0
+        self._rate = RateMeter(rate_window)
+        self._latency = LogHistogram()
+        self._born_delay = LogHistogram()
+        self._store_delay = LogHistogram()
+        self._inflight = 0
+        self._progress_at = 0.0  # 最近一次开始处理或处理完成的时刻
+
+    def begin(self, msg) -> float:
+        """开始处理消息，返回开始的时刻"""
+        now = time.time()
+
+        # broker和生产者的时钟可能不一致，负的延迟计为0
+        born_delay = max(now - msg.born_timestamp / 1000, 0.0)
+        store_delay = max(now - msg.store_timestamp / 1000, 0.0)
+        redelivered = msg.reconsume_times > 0
+
+        with self._lock:
+            self._born_delay.record(born_delay)
+            self._store_delay.record(store_delay)
+            if redelivered:
+                self._redeliveries += 1
+            if self._inflight == 0:
+                self._progress_at = time.monotonic()
+            self._inflight += 1
+
+        return time.perf_counter()
+
+    def end(self, started: float, success: bool):
+        latency = time.perf_counter() - started
+        with self._lock:
+            self._inflight -= 1
+            self._progress_at = time.monotonic()
+            self._consumed += 1
+            if not success:
+                self._errors += 1
+            self._rate.mark()
+            self._latency.record(latency)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def stalled(self) -> float:
+        """有消息正在处理、却没有任何消息处理完成的秒数，没有在途消息时为0"""
+        with self._lock:
+            if self._inflight == 0:
+                return 0.0
+            return time.monotonic() - self._progress_at
+
+    def reject(self):
+        """消息不符合契约而被拒绝"""
+        with self._lock:
+            self._rejected += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "consumed": self._consumed,
+                "errors": self._errors,
+                "rejected": self._rejected,
+                "redeliveries": self._redeliveries,
+                "inflight": self._inflight,
+                "rate": self._rate.rate(),
+                "latency": self._latency.summary(),
+                "born_delay": self._born_delay.summary(),
+                "store_delay": self._store_delay.summary(),
+            }
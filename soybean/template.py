@@ -0,0 +1,67 @@
+"""
+消息模板。
+
+同一个动作发送的消息主题、标签和固定的属性都相同，模板在创建动作时将它们编码成bytes，
+每次发送只设置消息体和键。没有本次发送附加的属性和延时级别时，每个线程复用同一个
+原生的Message对象：rocketmq-client-cpp的发送是同步的，发送返回之后消息对象即可再用，
+而发送之前设置的属性无法清除，因此有附加属性的发送总是创建新的消息对象。
+本地broker持有发送的消息对象，不能复用。
+"""
+import threading
+from rocketmq.client import Message
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return value
+
+
+class MessageTemplate:
+
+    __slots__ = ("_topic", "_tags", "_props", "_message_factory",
+                 "_reusable", "_cached")
+
+    def __init__(self, topic: str, tag: str = None, props=None,
+                 message_factory=Message, reusable: bool = True):
+        self._topic = topic
+        self._tags = _to_bytes(tag) if tag else None
+        self._props = [(_to_bytes(k), _to_bytes(v))
+                       for k, v in (props or {}).items()]
+        self._message_factory = message_factory
+        self._reusable = reusable
+        self._cached = threading.local()
+
+    def _new_message(self):
+        msg_obj = self._message_factory(self._topic)
+        if self._tags is not None:
+            msg_obj.set_tags(self._tags)
+        for key, value in self._props:
+            msg_obj.set_property(key, value)
+        return msg_obj
+
+    def create(self, body: bytes, key: str = None, props=None,
+               delay_level: int = None):
+        """
+        返回设置了消息体的消息对象，props为模板之外附加的属性。
+        复用的消息对象在同一线程的下一次create()之前必须已经发送。
+        """
+        if props or delay_level is not None or not self._reusable:
+            msg_obj = self._new_message()
+            if props:
+                for k, v in props.items():
+                    msg_obj.set_property(_to_bytes(k), _to_bytes(v))
+            if delay_level is not None:
+                msg_obj.set_delay_time_level(delay_level)
+            if key:
+                msg_obj.set_keys(_to_bytes(key))
+        else:
+            msg_obj = getattr(self._cached, "msg_obj", None)
+            if msg_obj is None:
+                msg_obj = self._new_message()
+                self._cached.msg_obj = msg_obj
+            # 清除上一次发送的键
+            msg_obj.set_keys(_to_bytes(key) if key else b"")
+
+        msg_obj.set_body(body)
+        return msg_obj
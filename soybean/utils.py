@@ -7,6 +7,8 @@ from sqlblock.utils.json import json_dumps, json_loads
 from rocketmq.client import Message
 
 from .exceptions import InvalidGroupId, InvalidTopicName
+from .compression import COMPRESSION_PROPERTY, decompress
+from .blobstore import CLAIM_CHECK_PROPERTY
 
 VALID_NAME_PATTERN = re.compile("^[%|a-zA-Z0-9_-]+$")
 VALID_NAME_STR = (
@@ -15,8 +17,37 @@ VALID_NAME_STR = (
 )
 
 
-def create_jsonobj_msg(topic, jsonobj, key=None, tag=None, props=None):
-    msg_obj = Message(topic)
+def create_jsonobj_msg(topic, jsonobj, key=None, tag=None, props=None,
+                       compression=None, claim_check=None):
+    body, body_props = encode_jsonobj_body(jsonobj, compression, claim_check)
+    if body_props:
+        props = {**props, **body_props} if props else body_props
+
+    return create_msg(topic, body, key, tag, props)
+
+
+def encode_jsonobj_body(jsonobj, compression=None, claim_check=None):
+    """编码消息体，返回(消息体, 附加的消息属性)"""
+    body = json_dumps(jsonobj).encode("utf-8")
+    body_props = None
+
+    blob_ref = None
+    if claim_check is not None:
+        body, blob_ref = claim_check.check(body)
+        if blob_ref is not None:
+            body_props = {CLAIM_CHECK_PROPERTY: blob_ref}
+
+    if compression is not None and blob_ref is None:
+        body, codec_name = compression.compress(body)
+        if codec_name is not None:
+            body_props = {COMPRESSION_PROPERTY: codec_name}
+
+    return body, body_props
+
+
+def create_msg(topic, body, key=None, tag=None, props=None,
+               message_factory=Message):
+    msg_obj = message_factory(topic)
     if isinstance(key, str):
         msg_obj.set_keys(key.encode("utf-8"))
 
@@ -27,11 +58,37 @@ def create_jsonobj_msg(topic, jsonobj, key=None, tag=None, props=None):
         for k, v in props.items():
             msg_obj.set_property(k, v)
 
-    msg_obj.set_body(json_dumps(jsonobj).encode("utf-8"))
+    msg_obj.set_body(body)
 
     return msg_obj
 
 
+def get_msg_property(msgobj, name):
+    value = msgobj.get_property(name)
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return value
+
+
+def read_msg_body(msgobj, get_blob_store=None):
+    """
+    读取消息体，如果消息体被压缩过则解压。
+
+    如果消息体存放在blob存储中，则从get_blob_store()返回的存储中读取，
+    返回的可能是不复制数据的bytes-like对象。
+    """
+    blob_ref = get_msg_property(msgobj, CLAIM_CHECK_PROPERTY)
+    if blob_ref:
+        return get_blob_store().get(blob_ref)
+
+    body = msgobj.body
+    codec_name = get_msg_property(msgobj, COMPRESSION_PROPERTY)
+    if codec_name:
+        body = decompress(body, codec_name)
+
+    return body
+
+
 def check_topic_name(name):
     if not name:
         raise InvalidTopicName("The topic name is empty")
@@ -0,0 +1,400 @@
+"""
+窗口聚合。
+
+反应器按消息的产生时间(born_timestamp)将事件归入每slide秒一格的时间格，窗口由连续的
+window / slide个时间格组成：slide等于window时为滚动窗口，否则为滑动窗口。
+窗口结束lateness秒之后关闭，每个键的聚合结果作为一条新的消息发送，迟于关闭的事件被丢弃；
+产生时间超前于尚未关闭的时间格太多的事件（生产者的时钟偏差）也被丢弃，不能覆盖尚未关闭的窗口。
+
+状态按"行=键、列=时间格"存放在几个连续的array中，时间格首尾相接循环使用，
+每个事件只更新一个格子，不为每个事件创建对象。指定了检查点文件时，每次关闭窗口后
+将状态写入本地文件，重启后从检查点恢复；检查点之后已经确认消费的事件在进程崩溃时丢失。
+聚合结果至少发送一次：发送失败的窗口在下次关闭时重新发送。
+"""
+import os
+import math
+import time
+import json
+import struct
+import asyncio
+import logging
+import threading
+from array import array
+
+logger = logging.getLogger("soybean.window")
+
+
+REDUCERS = ("count", "sum", "mean", "min", "max")
+
+_CHECKPOINT_HEADER = struct.Struct("<I")
+
+
+class WindowState:
+    """
+    所有键的时间格状态。第row行第slot列的格子位于数组的row * n_slots + slot处，
+    epochs[slot]是该列当前所属的时间格序号。
+    """
+
+    __slots__ = ("_reducer", "_n_slots", "_rows", "_keys",
+                 "_epochs", "_counts", "_values")
+
+    def __init__(self, n_slots: int, reducer: str):
+        if reducer not in REDUCERS:
+            raise ValueError(f"unknown reducer '{reducer}', "
+                             f"should be one of {', '.join(REDUCERS)}")
+
+        self._reducer = reducer
+        self._n_slots = n_slots
+        self._rows = {}  # 键 => 行
+        self._keys = []
+        self._epochs = array("q", [-1] * n_slots)
+        self._counts = array("Q")
+        self._values = array("d")
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _initial(self) -> float:
+        if self._reducer == "min":
+            return math.inf
+        if self._reducer == "max":
+            return -math.inf
+        return 0.0
+
+    def add(self, key, epoch: int, value: float, retired: int = None) -> bool:
+        """
+        retired之前的时间格已经不再需要，所在的列可以覆盖，None表示都不能覆盖；
+        该列被更新的时间格、或者被尚未过期的时间格占用时返回False
+        """
+        n_slots = self._n_slots
+        slot = epoch % n_slots
+        occupied = self._epochs[slot]
+        if occupied != epoch:
+            if occupied > epoch:
+                return False
+            if occupied >= 0 and (retired is None or occupied >= retired):
+                return False
+            self._clear_slot(slot, epoch)
+
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._keys)
+            self._rows[key] = row
+            self._keys.append(key)
+            self._counts.extend([0] * n_slots)
+            self._values.extend([self._initial()] * n_slots)
+
+        index = row * n_slots + slot
+        self._counts[index] += 1
+
+        reducer = self._reducer
+        if reducer == "sum" or reducer == "mean":
+            self._values[index] += value
+        elif reducer == "min":
+            if value < self._values[index]:
+                self._values[index] = value
+        elif reducer == "max":
+            if value > self._values[index]:
+                self._values[index] = value
+        return True
+
+    def _clear_slot(self, slot: int, epoch: int):
+        initial = self._initial()
+        n_slots = self._n_slots
+        for index in range(slot, len(self._counts), n_slots):
+            self._counts[index] = 0
+            self._values[index] = initial
+        self._epochs[slot] = epoch
+
+    def aggregate(self, first_epoch: int, last_epoch: int):
+        """汇总时间格[first_epoch, last_epoch]，返回(键, 值, 事件数量)的列表"""
+        n_slots = self._n_slots
+        slots = [epoch % n_slots for epoch in range(first_epoch, last_epoch + 1)
+                 if self._epochs[epoch % n_slots] == epoch]
+        if not slots:
+            return []
+
+        reducer = self._reducer
+        counts = self._counts
+        values = self._values
+
+        results = []
+        for row, key in enumerate(self._keys):
+            base = row * n_slots
+            count = 0
+            if reducer == "min":
+                value = math.inf
+            elif reducer == "max":
+                value = -math.inf
+            else:
+                value = 0.0
+
+            for slot in slots:
+                index = base + slot
+                n = counts[index]
+                if not n:
+                    continue
+                count += n
+                if reducer == "min":
+                    value = min(value, values[index])
+                elif reducer == "max":
+                    value = max(value, values[index])
+                else:
+                    value += values[index]
+
+            if not count:
+                continue
+
+            if reducer == "count":
+                value = count
+            elif reducer == "mean":
+                value = value / count
+            results.append((key, value, count))
+
+        return results
+
+    def compact(self, oldest_epoch: int):
+        """移除时间格oldest_epoch之后没有事件的键"""
+        n_slots = self._n_slots
+        live_slots = [slot for slot in range(n_slots)
+                      if self._epochs[slot] >= oldest_epoch]
+
+        live_rows = [row for row in range(len(self._keys))
+                     if any(self._counts[row * n_slots + slot] for slot in live_slots)]
+        if len(live_rows) == len(self._keys):
+            return
+
+        counts = array("Q")
+        values = array("d")
+        keys = []
+        for row in live_rows:
+            counts.extend(self._counts[row * n_slots:(row + 1) * n_slots])
+            values.extend(self._values[row * n_slots:(row + 1) * n_slots])
+            keys.append(self._keys[row])
+
+        self._counts = counts
+        self._values = values
+        self._keys = keys
+        self._rows = {key: row for row, key in enumerate(keys)}
+
+    def dump(self, meta: dict) -> bytes:
+        meta = dict(meta, reducer=self._reducer, n_slots=self._n_slots,
+                    keys=self._keys)
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        return b"".join((_CHECKPOINT_HEADER.pack(len(meta_bytes)), meta_bytes,
+                         self._epochs.tobytes(), self._counts.tobytes(),
+                         self._values.tobytes()))
+
+    def load(self, data: bytes) -> dict:
+        """从检查点恢复状态，返回dump()时的meta，检查点与当前的配置不符时抛出ValueError"""
+        meta_len, = _CHECKPOINT_HEADER.unpack_from(data)
+        offset = _CHECKPOINT_HEADER.size
+        meta = json.loads(data[offset:offset + meta_len])
+        offset += meta_len
+
+        if meta["reducer"] != self._reducer or meta["n_slots"] != self._n_slots:
+            raise ValueError("the checkpoint does not match the window")
+
+        n_slots = self._n_slots
+        n_cells = len(meta["keys"]) * n_slots
+        epochs = array("q")
+        epochs.frombytes(data[offset:offset + 8 * n_slots])
+        offset += 8 * n_slots
+        counts = array("Q")
+        counts.frombytes(data[offset:offset + 8 * n_cells])
+        offset += 8 * n_cells
+        values = array("d")
+        values.frombytes(data[offset:offset + 8 * n_cells])
+
+        if len(epochs) != n_slots or len(values) != n_cells:
+            raise ValueError("the checkpoint is truncated")
+
+        keys = [tuple(key) if isinstance(key, list) else key
+                for key in meta["keys"]]
+        self._epochs = epochs
+        self._counts = counts
+        self._values = values
+        self._keys = keys
+        self._rows = {key: row for row, key in enumerate(keys)}
+        return meta
+
+
+def _field_getter(field):
+    if field is None or callable(field):
+        return field
+    return lambda message: message[field]
+
+
+class WindowAggregator:
+    """
+    window 窗口的秒数；slide 窗口滑动的秒数，缺省等于window即滚动窗口，
+        window应是slide的整数倍；
+    key 事件的分组键，消息的字段名或者函数，缺省所有事件为一组，键应能序列化为json；
+    value 参与聚合的值，消息的字段名或者函数，reducer为"count"时不需要；
+    reducer 聚合方式："count"、"sum"、"mean"、"min"或"max"；
+    emit 发送聚合结果的协程函数；
+    lateness 窗口结束之后等待迟到事件的秒数；
+    checkpoint_path 检查点文件，缺省不保存状态。
+    """
+
+    def __init__(self, window: float, emit, slide: float = None,
+                 key=None, value=None, reducer: str = "count",
+                 lateness: float = 1.0, checkpoint_path: str = None):
+
+        slide = window if slide is None else slide
+        n_buckets = round(window / slide)
+        if slide <= 0 or n_buckets < 1 or abs(n_buckets * slide - window) > 1e-6:
+            raise ValueError(f"the window {window} should be a multiple "
+                             f"of the slide {slide}")
+
+        if value is None and reducer != "count":
+            raise ValueError(f"the value should be given for reducer '{reducer}'")
+
+        self._window = window
+        self._slide = slide
+        self._n_buckets = n_buckets
+        self._lateness = lateness
+        self._emit = emit
+        self._key = _field_getter(key)
+        self._value = _field_getter(value)
+
+        # 迟到事件所在的时间格在窗口关闭之前不能被覆盖，需要额外的列
+        n_slots = n_buckets + math.ceil(lateness / slide) + 1
+        self._state = WindowState(n_slots, reducer)
+        # 接受的时间格最多超前已关闭的时间格这么多格，再超前就会覆盖尚未关闭的窗口
+        self._max_ahead = n_slots - n_buckets
+        self._checkpoint_path = checkpoint_path
+
+        self._closed = None  # 结束于该时间格之前的窗口都已关闭
+        self._late_events = 0
+        self._early_events = 0
+        self._task = None
+
+        # 开启多个事件循环时，add()在反应器所在的事件循环线程中调用，
+        # 关闭窗口和压缩状态在主事件循环中进行
+        self._lock = threading.Lock()
+
+    @property
+    def late_events(self) -> int:
+        return self._late_events
+
+    @property
+    def early_events(self) -> int:
+        """产生时间超前太多而被丢弃的事件数量"""
+        return self._early_events
+
+    def add(self, message, timestamp: float):
+        """记录一个事件，timestamp为事件产生的时刻，线程安全"""
+        epoch = int(timestamp // self._slide)
+        key = self._key(message) if self._key is not None else None
+        value = float(self._value(message)) if self._value is not None else 0.0
+
+        with self._lock:
+            closed = self._closed
+            retired = None
+            if closed is not None:
+                # 时间格epoch属于结束于epoch + 1到epoch + n_buckets的窗口
+                if epoch + self._n_buckets <= closed:
+                    self._late_events += 1
+                    return
+
+                if epoch > closed + self._max_ahead:
+                    self._early_events += 1
+                    return
+
+                retired = closed - self._n_buckets + 1
+
+            if not self._state.add(key, epoch, value, retired):
+                self._late_events += 1
+
+    async def close_windows(self, now: float = None):
+        """关闭所有已经结束lateness秒的窗口，发送聚合结果"""
+        now = time.time() if now is None else now
+        until = int((now - self._lateness) // self._slide)
+        if self._closed is None:
+            with self._lock:
+                self._closed = until
+            return
+
+        closed = self._closed
+        while closed < until:
+            end = closed + 1
+            start = end - self._n_buckets
+            with self._lock:
+                results = self._state.aggregate(start, end - 1)
+            for key, value, count in results:
+                await self._emit({
+                    "key": key,
+                    "start": start * self._slide,
+                    "end": end * self._slide,
+                    "value": value,
+                    "count": count,
+                })
+            closed = end
+            with self._lock:
+                self._closed = closed
+
+        with self._lock:
+            self._state.compact(self._closed - self._n_buckets + 1)
+        self.checkpoint()
+
+    def checkpoint(self):
+        if self._checkpoint_path is None or self._closed is None:
+            return
+
+        with self._lock:
+            data = self._state.dump({"closed": self._closed,
+                                     "slide": self._slide})
+        tmp_path = self._checkpoint_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._checkpoint_path)
+
+    def restore(self):
+        if self._checkpoint_path is None:
+            return
+
+        try:
+            with open(self._checkpoint_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        try:
+            meta = self._state.load(data)
+            if meta["slide"] != self._slide:
+                raise ValueError("the checkpoint does not match the window")
+        except (ValueError, KeyError, struct.error) as exc:
+            logger.warning("ignored the checkpoint '%s': %s",
+                           self._checkpoint_path, exc)
+            return
+
+        self._closed = meta["closed"]
+        logger.info("restored %d keys from the checkpoint '%s'",
+                    len(self._state), self._checkpoint_path)
+
+    async def start(self):
+        self.restore()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止关闭窗口，尚未关闭的窗口在重启后从检查点继续"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.close_windows()
+            except Exception as exc:
+                # 未发送的窗口在下次重新发送
+                logger.error("failed to emit the window aggregates: %s",
+                             exc, exc_info=exc)
+
+            now = time.time() - self._lateness
+            await asyncio.sleep(self._slide - now % self._slide + 0.001)
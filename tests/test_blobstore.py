@@ -0,0 +1,51 @@
+import os
+import time
+import pytest
+
+from soybean.blobstore import BlobStore, FileBlobStore, ClaimCheck
+
+
+def test_file_blob_store(tmp_path):
+    store = FileBlobStore(str(tmp_path), grace=0)
+
+    ref = store.put(b"hello soybean")
+    data = store.get(ref)
+    assert bytes(data) == b"hello soybean"
+    assert str(data, "utf-8") == "hello soybean"
+
+    assert store.gc() == 0
+    store.release(ref)
+    assert store.gc() == 1
+    assert store.gc() == 0
+
+
+def test_blob_store_ttl(tmp_path):
+    store = FileBlobStore(str(tmp_path), ttl=60)
+    ref = store.put(b"data")
+
+    path = os.path.join(str(tmp_path), ref[:2], ref)
+    expired = time.time() - 120
+    os.utime(path, (expired, expired))
+
+    assert store.gc() == 1
+
+
+def test_claim_check(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    claim_check = ClaimCheck(store, threshold=10)
+
+    assert claim_check.check(b"short") == (b"short", None)
+
+    body, ref = claim_check.check(b"x" * 100)
+    assert body == ref.encode("ascii")
+    assert bytes(store.get(ref)) == b"x" * 100
+
+
+def test_incomplete_blob_store():
+    class _PutOnlyStore(BlobStore):
+        def put(self, data):
+            return "ref"
+
+    # 没有实现全部方法的存储在创建时即出错，而不是在发送时
+    with pytest.raises(TypeError):
+        _PutOnlyStore()
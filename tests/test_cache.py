@@ -0,0 +1,92 @@
+import asyncio
+
+from soybean.cache import ActionCache
+from soybean.channel import DomainChannel
+from soybean.action.simple import SimpleAction
+
+
+def test_action_cache_lru():
+    cache = ActionCache(ttl=60, max_size=2)
+    for no in range(3):
+        cache.put((no,), no * 10)
+
+    assert cache.get((0,)) == (False, None)  # 最久未用的被淘汰
+    assert cache.get((2,)) == (True, 20)
+    assert cache.make_key(([1, 2],), {}) is None  # 参数不可哈希时不缓存
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 2)
+
+
+calls = []
+received = []
+
+
+async def on_rates_published(message):
+    received.append(message)
+
+
+def test_cached_action():
+    channel = DomainChannel("test", "local://test-cache")
+    rates_topic = channel.topic("Rates")
+    rates_topic.react("Published")(on_rates_published)
+
+    @rates_topic.action("Published", cache=ActionCache(ttl=60, suppress=60))
+    async def publish_rates(currency):
+        calls.append(currency)
+        return {"currency": currency, "rate": 7.1}
+
+    async def _run():
+        await channel.start()
+        try:
+            for _ in range(3):
+                await publish_rates("USD")
+            await publish_rates("EUR")
+            for _ in range(30):
+                if len(received) == 2:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    assert calls == ["USD", "EUR"]
+    assert sorted(m["currency"] for m in received) == ["EUR", "USD"]
+
+    stats = publish_rates.cache.stats()
+    assert (stats["hits"], stats["misses"], stats["suppressed"]) == (2, 2, 2)
+
+
+def test_concurrent_suppressed_sends(monkeypatch):
+    channel = DomainChannel("test", "local://test-cache-concurrent")
+    rates_topic = channel.topic("Rates")
+    sent = []
+    broker_up = False
+
+    async def _send(self, msg, delay=None, **kwargs):
+        await asyncio.sleep(0.01)  # 发送期间让出事件循环
+        if not broker_up:
+            raise ConnectionError("broker is down")
+        sent.append(msg)
+        return msg
+
+    monkeypatch.setattr(SimpleAction, "send", _send)
+
+    @rates_topic.action("Published", cache=ActionCache(ttl=60, suppress=60))
+    async def publish_rates(currency):
+        return {"currency": currency, "rate": 7.1}
+
+    async def _run():
+        nonlocal broker_up
+        try:
+            await publish_rates("USD")
+        except ConnectionError:
+            pass
+
+        # 发送失败后撤销登记，并发的相同调用只发送一次
+        broker_up = True
+        await asyncio.gather(*(publish_rates("USD") for _ in range(5)))
+
+    asyncio.run(_run())
+    assert sent == [{"currency": "USD", "rate": 7.1}]
+    assert publish_rates.cache.stats()["suppressed"] == 4
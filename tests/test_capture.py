@@ -0,0 +1,60 @@
+import asyncio
+
+from soybean.capture import read_capture
+from soybean.channel import DomainChannel
+from soybean.replay import replay
+
+
+def _declare(channel, received):
+    order_topic = channel.topic("Order")
+
+    @order_topic.react("Created")
+    async def on_order_created(message):
+        received.append(message["no"])
+
+    return order_topic
+
+
+def test_capture_and_replay(tmp_path):
+    path = str(tmp_path / "capture.bin")
+
+    received = []
+    channel = DomainChannel("test", "local://test-capture")
+    order_topic = _declare(channel, received)
+    channel.enable_capture(path)
+
+    async def _capture():
+        await channel.start()
+        try:
+            for no in range(5):
+                await order_topic.send({"no": no}, tag="Created", key=f"order-{no}")
+            for _ in range(40):
+                if len(received) == 5:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_capture())
+
+    captured = list(read_capture(path))
+    assert [m.keys for m in captured] == [f"order-{no}" for no in range(5)]
+    assert {(m.topic, m.tag) for m in captured} == {("Order", "Created")}
+
+    replayed = []
+    channel = DomainChannel("test", "local://test-replay")
+    _declare(channel, replayed)
+
+    async def _replay():
+        await channel.start()
+        try:
+            return await replay(channel, path, speed=0, idle=0.3)
+        finally:
+            await channel.stop()
+
+    report = asyncio.run(_replay())
+    assert report["messages"] == 5
+    assert sorted(replayed) == list(range(5))
+
+    reactor_stats, = report["reactors"].values()
+    assert reactor_stats["consumed"] == 5
@@ -0,0 +1,22 @@
+from soybean.compression import Compression, decompress, make_compression
+
+
+def test_compression():
+    compression = Compression("zlib", threshold=100)
+
+    body = b'{"a": 1}'
+    assert compression.compress(body) == (body, None)
+
+    body = b'{"name": "soybean", "items": [1, 2, 3]}' * 50
+    compressed, codec_name = compression.compress(body)
+    assert codec_name == "zlib"
+    assert len(compressed) < len(body)
+    assert b"\0" not in compressed
+    assert decompress(compressed, codec_name) == body
+
+
+def test_make_compression():
+    assert make_compression(None) is None
+    assert make_compression(False) is None
+    assert make_compression("zlib", 10).threshold == 10
+    assert make_compression(True).codec_name in ("zstd", "zlib")
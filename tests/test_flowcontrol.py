@@ -0,0 +1,183 @@
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+from rocketmq.client import ConsumeStatus
+
+from soybean.flowcontrol import TokenBucket, InflightLimiter, PauseGate
+from soybean.flowcontrol import LoopLagMonitor, PriorityScheduler
+from soybean.channel import DomainChannel
+from soybean.logcontext import current_context
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+
+    delay = bucket.reserve()
+    assert 0.05 < delay <= 0.1 + 1e-6
+
+    delay = bucket.reserve()  # 预支的令牌按先后次序排队等待
+    assert 0.15 < delay <= 0.2 + 1e-6
+
+
+def test_inflight_limiter():
+    limiter = InflightLimiter(2)
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.inflight == 2
+
+    acquired = threading.Event()
+
+    def _worker():
+        limiter.acquire()
+        acquired.set()
+
+    threading.Thread(target=_worker, daemon=True).start()
+    assert not acquired.wait(0.05)
+
+    limiter.release()
+    assert acquired.wait(1)
+    assert limiter.inflight == 2
+
+
+def test_priority_scheduler():
+    scheduler = PriorityScheduler(1, weights={"online": 2, "bulk": 1},
+                                  quotas={"bulk": 1})
+    scheduler.acquire("online")
+
+    granted = []
+    lock = threading.Lock()
+
+    def _worker(priority):
+        scheduler.acquire(priority)
+        with lock:
+            granted.append(priority)
+
+    threads = []
+    for priority in ["bulk"] * 3 + ["online"] * 3:
+        thread = threading.Thread(target=_worker, args=(priority,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)  # 按次序排队
+
+    for index in range(6):
+        while len(granted) < index:
+            time.sleep(0.01)
+        scheduler.release(granted[-1] if granted else "online")
+
+    for thread in threads:
+        thread.join(1)
+    assert granted == ["online", "bulk", "online", "online", "bulk", "bulk"]
+
+    stats = scheduler.stats()
+    assert stats["bulk"]["delayed"] == 3
+    assert stats["online"]["queue_delay"]["count"] == 4
+
+
+def test_priority_quota():
+    scheduler = PriorityScheduler(weights={"online": 1, "bulk": 1},
+                                  quotas={"bulk": 1})
+    scheduler.acquire("bulk")
+
+    acquired = threading.Event()
+
+    def _worker():
+        scheduler.acquire("bulk")
+        acquired.set()
+
+    threading.Thread(target=_worker, daemon=True).start()
+    assert not acquired.wait(0.05)  # 达到配额
+
+    assert scheduler.acquire("online") == 0.0  # 不限制其它优先级
+    scheduler.release("bulk")
+    assert acquired.wait(1)
+
+
+def test_loop_lag_monitor():
+    gate = PauseGate()
+
+    async def _main():
+        monitor = LoopLagMonitor(gate, max_lag=0.1, interval=0.02,
+                                 resume_samples=5)
+        monitor.start()
+        await asyncio.sleep(0.05)
+
+        time.sleep(0.2)  # 阻塞事件循环
+        await asyncio.sleep(0.03)
+        assert gate.is_paused()
+
+        await asyncio.sleep(0.3)
+        assert not gate.is_paused()
+        await monitor.stop()
+
+    asyncio.run(_main())
+
+
+def test_send_scheduler_prefers_online():
+    from soybean.flowcontrol import SendScheduler
+
+    async def _main():
+        scheduler = SendScheduler(rate=50, burst=1)
+        await scheduler.acquire("bulk")  # 取走桶内唯一的令牌
+
+        order = []
+
+        async def _send(priority, no):
+            await scheduler.acquire(priority)
+            order.append((priority, no))
+
+        tasks = [asyncio.ensure_future(_send("bulk", i)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.ensure_future(_send("online", i)) for i in range(2)]
+        await asyncio.gather(*tasks)
+
+        assert order[:2] == [("online", 0), ("online", 1)]
+        assert order[2:] == [("bulk", 0), ("bulk", 1), ("bulk", 2)]
+
+        stats = scheduler.stats()
+        assert stats["online"]["throttled"] == 2
+        assert stats["bulk"]["count"] == 4
+
+    asyncio.run(_main())
+
+
+async def on_order_created(message):
+    pass
+
+
+def test_reactor_callback_cleanup():
+    channel = DomainChannel("test", "local://test-callback-cleanup",
+                            max_inflight=2)
+    channel.topic("Order").react("Created")(on_order_created)
+
+    class _ClosedEvent:
+        async def acquire(self):
+            raise RuntimeError("the event loop is closed")
+
+    def _consume(reactor, msg):
+        status = reactor._callback(msg)
+        return status, current_context()
+
+    async def _run():
+        await channel.start()
+        try:
+            reactor, = channel.reactors()
+            loop = asyncio.get_running_loop()
+            busy_event = reactor._busy_events[loop]
+            reactor._busy_events[loop] = _ClosedEvent()
+            msg = SimpleNamespace(id="1", tags=b"Created")
+            try:
+                return await loop.run_in_executor(None, _consume, reactor, msg)
+            finally:
+                reactor._busy_events[loop] = busy_event
+        finally:
+            await channel.stop()
+
+    status, context = asyncio.run(_run())
+    # 占用busy_event失败时，归还处理名额、解除日志上下文
+    assert status == ConsumeStatus.RECONSUME_LATER
+    assert context is None
+    assert channel.priority_scheduler.stats()["online"]["inflight"] == 0
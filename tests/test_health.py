@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+import pytest
+
+from soybean.channel import DomainChannel
+from soybean.exceptions import NotReadyError
+
+
+def test_ready_and_liveness():
+    channel = DomainChannel("test", "local://test-health", event_loops=2)
+    channel.configure_health(stall_timeout=0.2)
+    order_topic = channel.topic("Order")
+
+    unblock = threading.Event()
+
+    @order_topic.react("Created")
+    async def on_order_created(message):
+        await asyncio.get_running_loop().run_in_executor(None, unblock.wait)
+
+    async def _run():
+        with pytest.raises(NotReadyError):
+            await channel.ready(timeout=0.2)  # 尚未启动
+
+        await channel.start()
+        try:
+            checks = await channel.ready(timeout=5)
+            assert checks == {"started": True, "namesrv": True,
+                              "consumers": True, "loops": True}
+
+            alive, _ = await channel.health.liveness()
+            assert alive
+
+            await order_topic.send({"no": 1}, tag="Created")
+            await asyncio.sleep(0.5)
+            alive, checks = await channel.health.liveness()
+            assert not alive  # 处理函数被阻塞
+            assert list(checks["stalled"]) == [channel.reactors()[0].reactor_id]
+        finally:
+            unblock.set()
+            await channel.stop()
+
+    asyncio.run(_run())
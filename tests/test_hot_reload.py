@@ -0,0 +1,108 @@
+import asyncio
+
+from soybean.channel import DomainChannel
+
+
+received = []
+
+
+async def on_order_created(message):
+    received.append(("created", message["no"]))
+
+
+async def on_order_paid(message):
+    received.append(("paid", message["no"]))
+
+
+async def on_order_shipped(message):
+    received.append(("shipped", message["no"]))
+
+
+async def wait_received(count):
+    for _ in range(30):
+        if len(received) >= count:
+            return
+        await asyncio.sleep(0.05)
+
+
+def test_register_reactors_at_runtime():
+    channel = DomainChannel("test", "local://test-hot-reload")
+    order_topic = channel.topic("Order")
+    order_topic.react("Created")(on_order_created)
+
+    async def _run():
+        await channel.start()
+        try:
+            created_reactor, = channel.reactors()
+            consumer = created_reactor._consumer
+
+            await order_topic.register_reactor(on_order_paid, "Paid", shared=True)
+            await order_topic.register_reactor(on_order_shipped, "Shipped",
+                                               shared=True)
+            shared_consumer, = channel._shared_consumers.values()
+            assert shared_consumer.expression() == "Paid || Shipped"
+
+            await order_topic.send({"no": 1}, tag="Created")
+            await order_topic.send({"no": 1}, tag="Paid")
+            await order_topic.send({"no": 1}, tag="Shipped")
+            await wait_received(3)
+
+            assert await order_topic.unregister_reactor(on_order_paid)
+            assert not await order_topic.unregister_reactor(on_order_paid)
+            assert shared_consumer.expression() == "Shipped"
+
+            await order_topic.send({"no": 2}, tag="Paid")
+            await order_topic.send({"no": 2}, tag="Shipped")
+            await order_topic.send({"no": 2}, tag="Created")
+            await wait_received(5)
+            await asyncio.sleep(0.1)
+
+            # 其它反应器的消费者没有重启
+            assert created_reactor._consumer is consumer
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    assert sorted(received) == [("created", 1), ("created", 2),
+                                ("paid", 1),
+                                ("shipped", 1), ("shipped", 2)]
+
+
+def test_rollback_failed_reactor(monkeypatch):
+    channel = DomainChannel("test", "local://test-hot-reload-rollback")
+    order_topic = channel.topic("Order")
+    create_consumer = DomainChannel.create_consumer
+    broker_up = True
+
+    def _create_consumer(self, group_id):
+        if not broker_up:
+            raise RuntimeError("broker is down")
+        return create_consumer(self, group_id)
+
+    monkeypatch.setattr(DomainChannel, "create_consumer", _create_consumer)
+
+    async def _run():
+        nonlocal broker_up
+        await channel.start()
+        try:
+            broker_up = False
+            for shared in (False, True):
+                try:
+                    await order_topic.register_reactor(on_order_paid, "Paid",
+                                                       shared=shared)
+                except RuntimeError:
+                    pass
+                else:
+                    raise AssertionError("the reactor should fail to start")
+
+                # 启动失败的反应器和共享消费者都已撤销
+                assert list(channel.reactors()) == []
+                assert channel._shared_consumers == {}
+
+            broker_up = True
+            await order_topic.register_reactor(on_order_paid, "Paid")
+            assert len(list(channel.reactors())) == 1
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
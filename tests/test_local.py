@@ -0,0 +1,71 @@
+import asyncio
+
+from soybean.channel import DomainChannel
+from soybean.local import LocalBroker
+
+
+received = []
+
+
+async def on_order_created(message, msg_tags):
+    received.append((msg_tags, message))
+    if message["no"] == 2 and len(received) == 2:
+        raise ValueError("failed once")
+
+
+def test_local_broker():
+    namesrv_addr = "local://test-local-broker"
+    channel = DomainChannel("test", namesrv_addr)
+    order_topic = channel.topic("Order")
+    order_topic.react("Created")(on_order_created)
+
+    async def _run():
+        await channel.start()
+        try:
+            await order_topic.send({"no": 1}, tag="Created")
+            await order_topic.send({"no": 0}, tag="Paid")  # 标签不匹配
+            await order_topic.send({"no": 2}, tag="Created")
+            for _ in range(30):
+                if len(received) == 3:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    assert received == [("Created", {"no": 1}),
+                        ("Created", {"no": 2}),
+                        ("Created", {"no": 2})]  # 失败后重新投递
+    assert LocalBroker.get(namesrv_addr).dead_letters == []
+
+
+def test_use_local_transport():
+    # 先声明动作，再改用本地broker，与soybean.replay加载应用的次序相同
+    channel = DomainChannel("test", "localhost:9876")
+    order_topic = channel.topic("Order")
+    paid = []
+
+    @order_topic.action("Paid")
+    async def pay_order(no):
+        return {"no": no}
+
+    @order_topic.react("Paid")
+    async def on_order_paid(message):
+        paid.append(message["no"])
+
+    channel.use_local_transport("local://test-use-local-transport")
+
+    async def _run():
+        await channel.start()
+        try:
+            await pay_order(1)
+            await pay_order(2)
+            for _ in range(30):
+                if len(paid) == 2:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    assert paid == [1, 2]
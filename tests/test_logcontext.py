@@ -0,0 +1,77 @@
+import json
+import asyncio
+import logging
+
+from soybean.channel import DomainChannel
+from soybean.logcontext import ContextFilter, StructuredFormatter, LogSampler
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(ContextFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+handler_logger = logging.getLogger("tests.logcontext")
+
+
+async def on_order_created(message):
+    handler_logger.warning("order %s created", message["no"])
+
+
+def test_reactor_log_context():
+    handler = _ListHandler()
+    handler_logger.addHandler(handler)
+
+    channel = DomainChannel("test", "local://test-logcontext")
+    order_topic = channel.topic("Order")
+    order_topic.react("Created")(on_order_created)
+
+    async def _run():
+        await channel.start()
+        try:
+            await order_topic.send({"no": 1}, tag="Created")
+            for _ in range(20):
+                if handler.records:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await channel.stop()
+
+    try:
+        asyncio.run(_run())
+    finally:
+        handler_logger.removeHandler(handler)
+
+    record, = handler.records
+    assert record.soybean_kind == "reactor"
+    assert record.soybean_topic == "Order"
+    assert record.soybean_tag == "Created"
+    assert record.soybean_msg_id
+
+    entry = json.loads(StructuredFormatter().format(record))
+    assert entry["message"] == "order 1 created"
+    assert entry["group"] == record.soybean_group
+
+
+def test_log_sampler():
+    logger = logging.getLogger("tests.logcontext.sampler")
+    handler = _ListHandler()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    sample = LogSampler(logger, every=10)
+    for i in range(30):
+        sample("handled %d", i)
+    assert handler.records == []  # DEBUG未开启
+
+    logger.setLevel(logging.DEBUG)
+    for i in range(30):
+        sample("handled %d", i)
+    assert [r.getMessage() for r in handler.records] == \
+        ["handled 0", "handled 10", "handled 20"]
+    logger.removeHandler(handler)
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from rocketmq.client import SendStatus
+
+from soybean.channel import DomainChannel
+from soybean.looppool import LoopPool, run_in_loop
+from soybean.relay import MemoryOutboxStore
+from soybean.action.transactional import TransactionalAction
+from soybean.action.outboxed import OutboxedAction
+
+
+def test_loop_pool_pick():
+    pool = LoopPool(3)
+    pool.start()
+    try:
+        assert len(set(pool.loops)) == 3
+        assert pool.pick("reactor-a") is pool.pick(b"reactor-a")
+    finally:
+        asyncio.run(pool.stop())
+
+
+received = []
+
+
+async def on_order_created(message, msg_keys):
+    received.append(("created", threading.current_thread().name))
+    await shipping_topic.send({"no": message["no"]}, tag="Requested")
+
+
+async def on_shipping_requested(message):
+    received.append(("shipping", threading.current_thread().name))
+
+
+channel = DomainChannel("test", "local://test-loop-pool",
+                        send_rate_limit=1000, event_loops=2)
+order_topic = channel.topic("Order")
+shipping_topic = channel.topic("Shipping")
+order_topic.react("Created", shard_by_key=True)(on_order_created)
+shipping_topic.react("Requested")(on_shipping_requested)
+
+
+def test_reactors_in_loop_pool():
+    async def _run():
+        await channel.start()
+        try:
+            for no in range(4):
+                await order_topic.send({"no": no}, key=f"order-{no}", tag="Created")
+            for _ in range(30):
+                if len(received) == 8:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    assert len(received) == 8
+    assert all(name.startswith("soybean-loop-") for _, name in received)
+
+
+class _FakeDatabase:
+    def transaction(self, func):
+        return func
+
+
+class _FakeTransactionProducer:
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def send_message_in_transaction(self, msg_obj, local_execute, user_args):
+        local_execute(msg_obj, user_args)
+        return SimpleNamespace(status=SendStatus.OK)
+
+
+def test_actions_in_loop_pool():
+    pool_channel = DomainChannel("test", "local://test-loop-pool-actions",
+                                 event_loops=2)
+    database = _FakeDatabase()
+    store = MemoryOutboxStore()
+    sent = []
+
+    async def _send(record):
+        sent.append(record.body)
+
+    async def create_order(order):
+        return {"no": order}
+
+    transactional = TransactionalAction(pool_channel, create_order, database,
+                                        "Order", "Created")
+    outboxed = OutboxedAction(pool_channel, create_order, database,
+                              "Order", "Created", store=store)
+
+    async def _execute_in_pool():
+        # 在其它事件循环中执行的动作，等待和唤醒都在当前事件循环中完成
+        assert await asyncio.wait_for(transactional.execute(1), 5) == {"no": 1}
+        assert await outboxed.execute(2) == {"no": 2}
+
+    async def _run():
+        relay = pool_channel.get_outbox_relay(database, store)
+        relay._send = _send
+        pool_channel.register_producer(transactional._group_id,
+                                       _FakeTransactionProducer())
+        await pool_channel.start()
+        try:
+            loop = pool_channel.loop_pool.loops[0]
+            loop.set_debug(True)  # 跨线程操作事件循环时抛出异常
+            await run_in_loop(loop, _execute_in_pool())
+            for _ in range(10):
+                if sent:
+                    break
+                await asyncio.sleep(0.05)  # 中继立即被唤醒，不必等到下一次检查
+        finally:
+            await pool_channel.stop()
+
+    asyncio.run(_run(), debug=True)
+    assert sent == [b'{"no": 2}']
@@ -0,0 +1,67 @@
+import asyncio
+
+from soybean.channel import DomainChannel
+from soybean.middleware import KIND_REACTOR
+
+
+calls = []
+
+
+def tracing(name):
+    def _middleware(call_next, info):
+        async def _traced(*args, **kwargs):
+            calls.append((name, info.kind, info.tag))
+            return await call_next(*args, **kwargs)
+        return _traced
+    return _middleware
+
+
+def reactors_only(call_next, info):
+    if info.kind != KIND_REACTOR:
+        return call_next
+
+    async def _counted(*args, **kwargs):
+        calls.append(("reactors_only", info.kind, info.tag))
+        return await call_next(*args, **kwargs)
+    return _counted
+
+
+async def create_order(no):
+    return {"no": no}
+
+
+async def on_order_created(message):
+    calls.append(("handler", message["no"]))
+
+
+def test_middleware_chain():
+    channel = DomainChannel("test", "local://test-middleware")
+    order_topic = channel.topic("Order")
+
+    channel.use(tracing("domain"))
+    order_topic.use(tracing("topic"))
+    channel.use(reactors_only)
+
+    action = order_topic.action("Created")(create_order)
+    order_topic.react("Created")(on_order_created)
+
+    async def _run():
+        await channel.start()
+        try:
+            await action(1)
+            for _ in range(20):
+                if ("handler", 1) in calls:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    assert calls == [
+        ("domain", "action", "Created"),
+        ("topic", "action", "Created"),
+        ("domain", "reactor", "Created"),
+        ("reactors_only", "reactor", "Created"),
+        ("topic", "reactor", "Created"),
+        ("handler", 1),
+    ]
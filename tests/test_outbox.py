@@ -0,0 +1,97 @@
+import os
+import asyncio
+
+from soybean.outbox import LocalOutbox, OutboxLog, OutboxRecord
+from soybean.channel import DomainChannel
+from soybean.action.simple import SendingAction, send_outbox_record
+
+
+def test_outbox_drain(tmp_path):
+    path = str(tmp_path / "outbox")
+    sent = []
+    broker_up = False
+
+    async def _send(record):
+        if not broker_up:
+            raise ConnectionError("broker is down")
+        sent.append((record.tag, record.body, record.props))
+
+    async def _outage():
+        outbox = LocalOutbox(path, segment_size=64,
+                             min_backoff=0.01, max_backoff=0.02)
+        await outbox.start(_send)
+        assert not outbox.accepts()
+
+        for i in range(5):
+            await outbox.append(OutboxRecord("Order", "Created",
+                                             props={"n": str(i)},
+                                             body=b'{"no": %d}' % i))
+        assert outbox.accepts()
+        await asyncio.sleep(0.05)
+        assert outbox.pending == 5
+        await outbox.stop()
+
+    asyncio.run(_outage())
+    assert sent == []
+    assert len(os.listdir(path)) > 2  # 段文件已经滚动
+
+    async def _recover():
+        nonlocal broker_up
+        outbox = LocalOutbox(path, min_backoff=0.01)
+        await outbox.start(_send)
+        assert outbox.pending == 5
+        broker_up = True
+        await asyncio.sleep(0.1)
+        assert outbox.pending == 0
+        await outbox.stop()
+
+    asyncio.run(_recover())
+    assert [body for _, body, _ in sent] == [b'{"no": %d}' % i for i in range(5)]
+    assert sent[0][2] == {"n": "0"}
+    assert len(os.listdir(path)) == 2  # 只剩索引和活动的段文件
+
+
+def test_outbox_log_sync_rolled_segments(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd))
+
+    log = OutboxLog(str(tmp_path / "outbox"), segment_size=64)
+    log.open()
+    for i in range(5):
+        log.append(OutboxRecord("Order", "Created", body=b'{"no": %d}' % i))
+    segments = dict(log._segments)
+    assert len(segments) > 2  # 同一批次中已经滚动
+
+    # 滚动之前的段文件也要落盘
+    log.sync()
+    assert sorted(synced) == sorted(f.fileno() for f in segments.values())
+
+    synced.clear()
+    log.sync()
+    assert synced == []
+    log.close()
+    log.sync()  # 关闭之后执行中的落盘不会出错
+
+
+def test_send_outbox_record_off_loop(monkeypatch):
+    # 补发的同步发送不在事件循环线程中执行
+    sent_on_loop = []
+    send_msg_obj = SendingAction.send_msg_obj
+
+    def _send_msg_obj(self, msg_obj):
+        sent_on_loop.append(asyncio._get_running_loop() is not None)
+        return send_msg_obj(self, msg_obj)
+
+    monkeypatch.setattr(SendingAction, "send_msg_obj", _send_msg_obj)
+    channel = DomainChannel("test", "local://test-outbox-record")
+
+    async def _run():
+        await channel.start()
+        try:
+            await send_outbox_record(channel, OutboxRecord(
+                "Order", "Created", keys="order-1", body=b'{"no": 1}'))
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    assert sent_on_loop == [False]
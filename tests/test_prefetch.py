@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+from soybean.channel import DomainChannel
+from soybean.action.simple import SendingAction
+from soybean.prefetch import PrefetchBuffer
+
+
+def test_prefetch_buffer():
+    buffer = PrefetchBuffer(2, max_bytes=100)
+    assert buffer.acquire(60)
+    assert buffer.acquire(40)
+
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(buffer.acquire(10)))
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()  # 数量和字节数都已满
+
+    buffer.release(60)
+    thread.join(1)
+    assert acquired == [True]
+    assert (buffer.messages, buffer.bytes) == (2, 50)
+
+    buffer.release(40)
+    buffer.release(10)
+    assert buffer.acquire(500)  # 缓冲区为空时放行超过上限的消息
+
+    buffer.close()
+    assert not buffer.acquire(1)
+
+
+received = []
+
+
+async def on_order_created(message):
+    received.append(message["no"])
+    if message["no"] == 3 and received.count(3) == 1:
+        raise ValueError("failed once")
+
+
+def test_prefetch_reactor(monkeypatch):
+    # 记录不在事件循环中执行的发送，即放到线程池中的重试
+    sent_off_loop = []
+    send_msg_obj = SendingAction.send_msg_obj
+
+    def _send_msg_obj(self, msg_obj):
+        if asyncio._get_running_loop() is None:
+            sent_off_loop.append(msg_obj)
+        return send_msg_obj(self, msg_obj)
+
+    monkeypatch.setattr(SendingAction, "send_msg_obj", _send_msg_obj)
+
+    channel = DomainChannel("test", "local://test-prefetch")
+    order_topic = channel.topic("Order")
+    order_topic.react("Created", max_inflight=2, prefetch=4,
+                      prefetch_bytes=1024)(on_order_created)
+
+    async def _run():
+        await channel.start()
+        try:
+            for no in range(10):
+                await order_topic.send({"no": no}, tag="Created")
+            for _ in range(40):
+                if len(received) == 11:
+                    break
+                await asyncio.sleep(0.1)
+            return channel.stats()
+        finally:
+            await channel.stop()
+
+    stats = asyncio.run(_run())
+    assert sorted(received) == sorted(list(range(10)) + [3])  # 失败后经重试主题重新处理
+    assert len(sent_off_loop) == 1
+
+    reactor_stats, = stats["reactors"].values()
+    assert reactor_stats["errors"] == 1
+    assert reactor_stats["redeliveries"] == 1
+    assert reactor_stats["prefetch"]["max_messages"] == 4
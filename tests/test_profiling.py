@@ -0,0 +1,67 @@
+import time
+import asyncio
+
+from soybean.profiling import Profiler
+from soybean.looppool import LoopPool
+
+
+async def busy_handler(n):
+    await asyncio.sleep(0.01)
+    time.sleep(0.05)
+    return n
+
+
+async def failed_handler():
+    await asyncio.sleep(0)
+    raise ValueError("failed")
+
+
+def test_profiler():
+    profiler = Profiler(slow_callback=0.03, sample_interval=0.005)
+
+    async def _main():
+        profiler.start()
+        try:
+            assert await profiler.run("busy", busy_handler(1)) == 1
+            assert await profiler.run("busy", busy_handler(2)) == 2
+            try:
+                await profiler.run("failed", failed_handler())
+            except ValueError:
+                pass
+        finally:
+            profiler.stop()
+
+    asyncio.run(_main())
+
+    report = profiler.report()
+    assert report["busy"]["calls"] == 2
+    assert report["busy"]["blocking_count"] == 2
+    assert report["busy"]["wall_time"] >= 0.12
+    assert report["failed"]["errors"] == 1
+
+    stacks = profiler.collapsed_stacks()
+    assert stacks.startswith("busy;busy_handler")
+
+
+def test_profiler_in_loop_pool():
+    profiler = Profiler(slow_callback=1, sample_interval=0.002)
+    pool = LoopPool(2)
+    pool.start()
+    profiler.start()
+    try:
+        futures = [asyncio.run_coroutine_threadsafe(
+                       profiler.run(f"busy-{index}", busy_handler(index)), loop)
+                   for index, loop in enumerate(pool.loops)
+                   for _ in range(5)]
+        assert sorted(f.result(5) for f in futures) == [0] * 5 + [1] * 5
+    finally:
+        profiler.stop()
+        asyncio.run(pool.stop())
+
+    report = profiler.report()
+    assert report["busy-0"]["calls"] == report["busy-1"]["calls"] == 5
+
+    # 两个事件循环线程中的处理函数都被采样
+    stacks = profiler.collapsed_stacks()
+    assert "busy-0;busy_handler" in stacks
+    assert "busy-1;busy_handler" in stacks
@@ -0,0 +1,138 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from soybean.channel import DomainChannel
+from soybean.outbox import OutboxRecord
+from soybean.relay import OutboxStore, MemoryOutboxStore, PostgresOutboxStore
+from soybean.action.outboxed import OutboxedAction
+
+
+def test_memory_store_relay():
+    store = MemoryOutboxStore()
+    sent = []
+    broker_up = False
+
+    async def _send(record):
+        if record.body == b"3" and not broker_up:
+            raise ConnectionError("broker is down")
+        sent.append(record.body)
+
+    async def _relay():
+        nonlocal broker_up
+        for i in range(5):
+            await store.insert(OutboxRecord("Order", "Created", body=b"%d" % i))
+
+        with pytest.raises(ConnectionError):
+            await store.relay(10, _send)
+        assert len(store) == 2
+
+        broker_up = True
+        await store.relay(10, _send)
+        assert len(store) == 0
+
+    asyncio.run(_relay())
+    assert sent == [b"0", b"1", b"2", b"3", b"4"]
+
+
+class _FakeDatabase:
+    def transaction(self, func):
+        return func
+
+
+def test_outboxed_action():
+    channel = DomainChannel("test", "localhost:9876")
+    database = _FakeDatabase()
+    store = MemoryOutboxStore()
+    sent = []
+
+    async def _send(record):
+        sent.append((record.topic, record.tag, record.body))
+
+    async def create_order(order):
+        return {"no": order}
+
+    async def _execute():
+        relay = channel.get_outbox_relay(database, store)
+        relay._send = _send
+        await relay.start()
+
+        action = OutboxedAction(channel, create_order, database,
+                                "Order", "Created")
+        assert await action.execute(1) == {"no": 1}
+        await asyncio.sleep(0.05)
+        await relay.stop()
+
+    asyncio.run(_execute())
+    assert sent == [("Order", "Created", b'{"no": 1}')]
+    assert len(store) == 0
+
+
+class _FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    async def fetch(self, sql, *args):
+        return self.rows
+
+    async def execute(self, sql, *args):
+        self.executed.append((sql.split()[0], args))
+
+
+class _FakeSqlblockDatabase:
+    def __init__(self, conn):
+        self._sqlblock = SimpleNamespace(_conn=conn)
+        self.in_transaction = False
+
+    def transaction(self, renew=False):
+        def _decorator(func):
+            async def _wrapped():
+                self.in_transaction = True
+                try:
+                    return await func()
+                finally:
+                    self.in_transaction = False
+            return _wrapped
+        return _decorator
+
+
+def test_postgres_store_sends_outside_transaction():
+    rows = [{"id": row_id, "topic": "Order", "tag": "Created",
+             "keys": f"order-{row_id}", "props": None, "body": b"%d" % row_id,
+             "orderly": False, "priority": None, "delay_level": None}
+            for row_id in (2, 1, 3)]
+    conn = _FakeConnection(rows)
+    database = _FakeSqlblockDatabase(conn)
+    store = PostgresOutboxStore(database)
+    sent = []
+
+    async def _send(record):
+        # 认领的事务已经提交，发送期间不持有行锁
+        assert not database.in_transaction
+        if record.body == b"3":
+            raise ConnectionError("broker is down")
+        sent.append(record.keys)
+
+    async def _relay():
+        await store.insert(OutboxRecord("Order", "Created", keys="order-4",
+                                        orderly=True, delay_level=3))
+        with pytest.raises(ConnectionError):
+            await store.relay(10, _send)
+
+    asyncio.run(_relay())
+    assert sent == ["order-1", "order-2"]
+    (_, inserted), (_, deleted), (_, released) = conn.executed
+    assert inserted[2] == "order-4" and inserted[5:] == (True, None, 3)
+    assert deleted == ([1, 2],)
+    assert released == ([3],)
+
+
+def test_incomplete_outbox_store():
+    class _InsertOnlyStore(OutboxStore):
+        async def insert(self, record):
+            pass
+
+    # 没有实现relay()的存储在创建时即出错
+    with pytest.raises(TypeError):
+        _InsertOnlyStore()
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+
+from soybean.rpc import ReplyRegistry, RpcClient, make_reply_topic
+from soybean.exceptions import RequestError, RequestTimeoutError
+
+
+def test_make_reply_topic():
+    topic = make_reply_topic("demo", "host.example.com_1234")
+    assert topic == "demo-reply-host_example_com_1234"
+
+
+def test_reply_registry():
+
+    async def _main():
+        registry = ReplyRegistry(max_pending=2)
+
+        correlation_id, future = registry.register(timeout=1)
+        registry.resolve(correlation_id, {"valid": True})
+        assert await future == {"valid": True}
+        assert len(registry) == 0
+
+        correlation_id, future = registry.register(timeout=1)
+        registry.resolve(correlation_id, error="invalid order")
+        with pytest.raises(RequestError):
+            await future
+
+        _, future = registry.register(timeout=0.01)
+        with pytest.raises(RequestTimeoutError):
+            await future
+        assert len(registry) == 0
+
+        registry.register(timeout=1)
+        registry.register(timeout=1)
+        with pytest.raises(RequestError):
+            registry.register(timeout=1)
+
+    asyncio.run(_main())
+
+
+class _FakeConsumer:
+    def set_thread_count(self, count):
+        pass
+
+    def subscribe(self, topic, callback):
+        pass
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class _FakeChannel:
+    name = "demo"
+
+    def __init__(self):
+        self.attempts = 0
+
+    def create_consumer(self, group_id):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise RuntimeError("broker is down")
+        return _FakeConsumer()
+
+
+def test_rpc_client_retries_start():
+    channel = _FakeChannel()
+    client = RpcClient(channel)
+
+    async def _main():
+        with pytest.raises(RuntimeError):
+            await client._ensure_started()
+
+        # 启动失败之后，下一个请求重新启动
+        await client._ensure_started()
+        assert channel.attempts == 2
+        await client.stop()
+
+    asyncio.run(_main())
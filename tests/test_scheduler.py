@@ -0,0 +1,106 @@
+import time
+import asyncio
+
+from soybean.scheduler import TimerWheel, DelayedMessageScheduler
+from soybean.scheduler import match_delay_level, resolve_delay
+from soybean.channel import DomainChannel
+from soybean.compression import Compression, COMPRESSION_PROPERTY
+from soybean.blobstore import FileBlobStore, CLAIM_CHECK_PROPERTY
+from soybean.action.simple import SendingAction
+
+
+def test_match_delay_level():
+    assert match_delay_level(1) == 1
+    assert match_delay_level(60.0) == 5
+    assert match_delay_level(7200) == 18
+    assert match_delay_level(45) is None
+    assert match_delay_level(1.5) is None
+
+
+def test_resolve_delay():
+    assert resolve_delay() is None
+    assert resolve_delay(delay=3) == 3
+    assert 9 < resolve_delay(deliver_at=time.time() + 10) <= 10
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(tick=1, slots=8, now=0)
+    wheel.add("a", 3, "A")
+    wheel.add("b", 20, "B")  # 超过一圈
+    wheel.add("c", 5, "C")
+    assert wheel.cancel("c")
+    assert len(wheel) == 2
+
+    assert wheel.advance(2) == []
+    assert wheel.advance(3) == ["A"]
+    assert wheel.advance(12) == []
+    assert wheel.advance(100) == ["B"]
+    assert len(wheel) == 0
+
+
+def test_scheduler_journal(tmp_path):
+    path = str(tmp_path / "delayed.journal")
+    sent = []
+
+    async def _send(delayed_msg, jsonobj):
+        sent.append((delayed_msg.tag, jsonobj))
+
+    async def _schedule():
+        scheduler = DelayedMessageScheduler(path, tick=0.01)
+        await scheduler.start(_send)
+        scheduler.schedule(time.time() + 0.02, "Order", "Cancel", {"no": 1})
+        scheduler.schedule(time.time() + 60, "Order", "Cancel", {"no": 2},
+                           keys="order-2")
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+
+    asyncio.run(_schedule())
+    assert sent == [("Cancel", {"no": 1})]
+
+    async def _restart():
+        scheduler = DelayedMessageScheduler(path, tick=0.01)
+        await scheduler.start(_send)
+        assert len(scheduler) == 1
+        # 重启后从日志载入的消息保留了键
+        delayed_msg, = scheduler._wheel.advance(time.time() + 120)
+        assert delayed_msg.keys == "order-2"
+        await scheduler.stop()
+
+    asyncio.run(_restart())
+
+
+def test_delayed_message_encoding(tmp_path, monkeypatch):
+    sent = []
+    send_msg_obj = SendingAction.send_msg_obj
+
+    def _send_msg_obj(self, msg_obj):
+        sent.append((msg_obj.keys, msg_obj.props))
+        return send_msg_obj(self, msg_obj)
+
+    monkeypatch.setattr(SendingAction, "send_msg_obj", _send_msg_obj)
+
+    channel = DomainChannel("test", "local://test-delayed-encoding",
+                            blob_store=FileBlobStore(str(tmp_path)))
+    order_topic = channel.topic("Order")
+    body = {"items": ["apple"] * 100}
+
+    async def _run():
+        await channel.start()
+        try:
+            # 延时不等于延时级别，由本地调度器到期后发送
+            await order_topic.send(body, tag="Created", delay=0.2,
+                                   compression=Compression("zlib", 16),
+                                   key="order-1")
+            await order_topic.send(body, tag="Created", delay=0.2,
+                                   claim_check=16)
+            for _ in range(20):
+                if len(sent) == 2:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            await channel.stop()
+
+    asyncio.run(_run())
+    # 到期发送时保留了消息的键、动作的压缩和认领检查选项
+    assert sorted((keys, list(props)) for keys, props in sent) == [
+        (b"", [CLAIM_CHECK_PROPERTY]), (b"order-1", [COMPRESSION_PROPERTY])]
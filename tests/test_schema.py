@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import List, Optional, TypedDict
+
+from soybean.channel import DomainChannel
+from soybean.exceptions import MessageSchemaError
+from soybean.schema import compile_schema
+
+
+@dataclass
+class OrderLine:
+    sku: str
+    quantity: int
+
+
+@dataclass
+class Order:
+    no: int
+    amount: Decimal
+    lines: List[OrderLine] = field(default_factory=list)
+    remark: Optional[str] = None
+
+
+class Payment(TypedDict):
+    order_no: int
+    paid: float
+
+
+def test_dataclass_schema():
+    schema = compile_schema(Order)
+    assert compile_schema(Order) is schema
+
+    order = schema.decode({"no": 1, "amount": "9.90",
+                           "lines": [{"sku": "A1", "quantity": 2}],
+                           "unknown": True})
+    assert order == Order(1, Decimal("9.90"), [OrderLine("A1", 2)])
+
+    assert schema.encode(order) == {
+        "no": 1, "amount": Decimal("9.90"),
+        "lines": [{"sku": "A1", "quantity": 2}], "remark": None}
+
+    with pytest.raises(MessageSchemaError, match="Order.lines\\[\\].quantity"):
+        schema.decode({"no": 1, "amount": 1, "lines": [{"sku": "A1", "quantity": "2"}]})
+
+    with pytest.raises(MessageSchemaError, match="missing field"):
+        schema.decode({"amount": 1})
+
+
+def test_typeddict_schema():
+    schema = compile_schema(Payment)
+    assert schema.decode({"order_no": 1, "paid": 10}) == {"order_no": 1, "paid": 10.0}
+    with pytest.raises(MessageSchemaError):
+        schema.encode({"order_no": "1", "paid": 10})
+
+
+received = []
+
+
+async def on_order_created(message: Order):
+    received.append(message)
+
+
+def test_reactor_rejects_malformed_messages():
+    channel = DomainChannel("test", "local://test-schema")
+    order_topic = channel.topic("Order")
+    order_topic.react("Created", schema=Order)(on_order_created)
+
+    async def _run():
+        await channel.start()
+        try:
+            await order_topic.send({"no": "x", "amount": 1}, tag="Created")
+            await order_topic.send({"no": 2, "amount": 1}, tag="Created")
+            for _ in range(20):
+                if received:
+                    break
+                await asyncio.sleep(0.05)
+            return channel.stats()
+        finally:
+            await channel.stop()
+
+    stats = asyncio.run(_run())
+    assert received == [Order(2, Decimal(1))]
+
+    reactor_stats, = stats["reactors"].values()
+    assert reactor_stats["rejected"] == 1
@@ -0,0 +1,55 @@
+from rocketmq.client import ConsumeStatus
+
+from soybean.consumer import SharedConsumer
+
+
+class FakeChannel:
+    name = "demo"
+    namesrv_addr = "localhost:9876"
+    capture = None
+
+
+class FakeReactor:
+    def __init__(self, reactor_id, expression, results):
+        self.reactor_id = reactor_id
+        self.expression = expression
+        self.max_inflight = 1
+        self.results = list(results)
+        self.consumed = 0
+
+    def consume(self, msg):
+        self.consumed += 1
+        return self.results.pop(0)
+
+
+class FakeMessage:
+    def __init__(self, tag, reconsume_times=0):
+        self.id = "MSG-1"
+        self.tags = tag.encode("utf-8")
+        self.reconsume_times = reconsume_times
+
+    def get_property(self, name):
+        return b""
+
+
+def test_shared_consumer_dispatch():
+    SUCCESS = ConsumeStatus.CONSUME_SUCCESS
+    LATER = ConsumeStatus.RECONSUME_LATER
+
+    ok = FakeReactor("ok", "A || B", [SUCCESS])
+    failed = FakeReactor("failed", "A", [LATER, SUCCESS])
+    other = FakeReactor("other", "C", [])
+
+    shared = SharedConsumer(FakeChannel(), "Order", "default")
+    for reactor in (ok, failed, other):
+        shared.add_reactor(reactor)
+
+    assert shared.expression() == "A || B || C"
+
+    assert shared._dispatch(FakeMessage("A")) == LATER
+    assert (ok.consumed, failed.consumed) == (1, 1)
+
+    # 重新投递时，已经成功处理过的反应器不再重复处理
+    assert shared._dispatch(FakeMessage("A", reconsume_times=1)) == SUCCESS
+    assert (ok.consumed, failed.consumed) == (1, 2)
+    assert other.consumed == 0
@@ -0,0 +1,70 @@
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+from soybean.stats import LogHistogram, RateMeter, ReactorStats
+from soybean.admin import AdminServer
+
+
+def test_log_histogram():
+    hist = LogHistogram()
+    for i in range(1, 1001):
+        hist.record(i / 1000)
+
+    assert hist.count == 1000
+    assert abs(hist.percentile(50) - 0.5) < 0.5 * 0.02
+    assert abs(hist.percentile(99) - 0.99) < 0.99 * 0.02
+    assert hist.percentile(100) == hist.max() == 1.0
+    assert abs(hist.mean() - 0.5005) < 1e-9
+
+
+def test_rate_meter():
+    meter = RateMeter(window=10)
+    for second in range(100, 110):
+        for _ in range(5):
+            meter.mark(second + 0.5)
+
+    assert meter.rate(110) == 5
+    assert meter.rate(115) == 2.5
+
+
+def test_reactor_stats():
+    stats = ReactorStats()
+    now_ms = time.time() * 1000
+    msg = SimpleNamespace(born_timestamp=now_ms - 2000,
+                          store_timestamp=now_ms - 1000,
+                          reconsume_times=1)
+
+    started = stats.begin(msg)
+    stats.end(started, success=False)
+
+    result = stats.as_dict()
+    assert result["consumed"] == 1
+    assert result["errors"] == 1
+    assert result["redeliveries"] == 1
+    assert 1.9 < result["born_delay"]["max"] < 2.5
+    assert 0.9 < result["store_delay"]["max"] < 1.5
+
+
+def test_admin_server():
+    channel = SimpleNamespace(stats=lambda: {"reactors": {}}, profiler=None)
+
+    async def _get(port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    async def _serve():
+        server = AdminServer(channel)
+        await server.start()
+        try:
+            assert await _get(server.port, "/stats") == (200, {"reactors": {}})
+            assert (await _get(server.port, "/profile"))[0] == 404
+        finally:
+            await server.stop()
+
+    asyncio.run(_serve())
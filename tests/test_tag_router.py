@@ -0,0 +1,23 @@
+from soybean.router import TagRouter, parse_tag_expression
+
+
+def test_parse_tag_expression():
+    assert parse_tag_expression("*") is None
+    assert parse_tag_expression("A || B") == {"A", "B"}
+    assert parse_tag_expression("A||*") is None
+
+
+def test_tag_router():
+    router = TagRouter()
+    router.add("A || B", "r1")
+    router.add("*", "r2")
+    router.add("B", "r3")
+
+    assert router.route("A") == ("r1", "r2")
+    assert router.route("B") == ("r1", "r2", "r3")
+    assert router.route("X") == ("r2",)
+    assert router.expression() == "*"
+
+    router.remove("r2")
+    assert router.route("X") == ()
+    assert router.expression() == "A || B"
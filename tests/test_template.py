@@ -0,0 +1,28 @@
+from soybean.local import LocalMessage
+from soybean.template import MessageTemplate
+
+
+def test_message_template():
+    template = MessageTemplate("Order", "Created", {"source": "test"},
+                               message_factory=LocalMessage)
+
+    msg1 = template.create(b"1", key="order-1")
+    assert (msg1.topic, msg1.tags, msg1.keys, msg1.body) == \
+        ("Order", b"Created", b"order-1", b"1")
+    assert msg1.props == {"source": b"test"}
+
+    # 同一线程复用消息对象，上一次的键被清除
+    msg2 = template.create(b"2")
+    assert msg2 is msg1
+    assert (msg2.keys, msg2.body) == (b"", b"2")
+
+    # 附加的属性和延时级别总是使用新的消息对象
+    msg3 = template.create(b"3", props={"encoding": "zlib"}, delay_level=2)
+    assert msg3 is not msg1
+    assert msg3.props == {"source": b"test", "encoding": b"zlib"}
+    assert msg3.delay_level == 2
+    assert template.create(b"4") is msg1
+
+    template = MessageTemplate("Order", message_factory=LocalMessage,
+                               reusable=False)
+    assert template.create(b"1") is not template.create(b"2")
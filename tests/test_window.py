@@ -0,0 +1,123 @@
+import sys
+import asyncio
+import threading
+
+from soybean.window import WindowState, WindowAggregator
+
+
+def test_window_state():
+    state = WindowState(4, "sum")
+    state.add("a", 10, 1.0)
+    state.add("a", 11, 2.0)
+    state.add("b", 11, 5.0)
+    assert state.aggregate(10, 11) == [("a", 3.0, 2), ("b", 5.0, 1)]
+
+    assert not state.add("a", 14, 7.0)  # 时间格10尚未过期，不能覆盖
+    assert state.add("a", 14, 7.0, retired=11)  # 覆盖时间格10所在的列
+    assert state.aggregate(10, 11) == [("a", 2.0, 1), ("b", 5.0, 1)]
+    assert not state.add("a", 10, 1.0, retired=11)
+
+    state.compact(12)
+    assert len(state) == 1
+    assert state.aggregate(14, 14) == [("a", 7.0, 1)]
+
+
+def test_sliding_window_and_checkpoint(tmp_path):
+    emitted = []
+
+    async def emit(result):
+        emitted.append(result)
+
+    checkpoint_path = str(tmp_path / "window.ckpt")
+
+    def make_aggregator():
+        return WindowAggregator(20, emit, slide=10, key="sku", value="amount",
+                                reducer="sum", lateness=0,
+                                checkpoint_path=checkpoint_path)
+
+    async def _run():
+        aggregator = make_aggregator()
+        await aggregator.close_windows(now=1000)
+        aggregator.add({"sku": "A", "amount": 1}, 1001)
+        aggregator.add({"sku": "B", "amount": 2}, 1005)
+        aggregator.add({"sku": "A", "amount": 3}, 1012)
+        await aggregator.close_windows(now=1010)
+        aggregator.checkpoint()
+
+        # 从检查点恢复
+        aggregator = make_aggregator()
+        aggregator.restore()
+        aggregator.add({"sku": "A", "amount": 4}, 995)  # 迟到的事件
+        await aggregator.close_windows(now=1020)
+        assert aggregator.late_events == 1
+
+    asyncio.run(_run())
+    assert emitted == [
+        {"key": "A", "start": 990, "end": 1010, "value": 1.0, "count": 1},
+        {"key": "B", "start": 990, "end": 1010, "value": 2.0, "count": 1},
+        {"key": "A", "start": 1000, "end": 1020, "value": 4.0, "count": 2},
+        {"key": "B", "start": 1000, "end": 1020, "value": 2.0, "count": 1},
+    ]
+
+
+def test_concurrent_add_and_close():
+    emitted = []
+
+    async def emit(result):
+        emitted.append(result)
+
+    aggregator = WindowAggregator(1, emit, key="sku", lateness=5)
+    n_threads, n_events = 4, 5000
+
+    def _add(offset):
+        for i in range(n_events):
+            # 事件时刻逐渐推进，键不断更替，关闭窗口时压缩状态
+            aggregator.add({"sku": (offset + i) // 100}, 1000 + i * 0.001)
+
+    async def _run():
+        await aggregator.close_windows(now=1004)
+        threads = [threading.Thread(target=_add, args=(n * 7,))
+                   for n in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        now = 1005
+        while any(thread.is_alive() for thread in threads):
+            now = min(now + 0.01, 1010)
+            await aggregator.close_windows(now=now)
+            await asyncio.sleep(0)
+        for thread in threads:
+            thread.join()
+        await aggregator.close_windows(now=2000)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # 频繁切换线程
+    try:
+        asyncio.run(_run())
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    total = sum(result["count"] for result in emitted)
+    assert total + aggregator.late_events + aggregator.early_events == \
+        n_threads * n_events
+
+
+def test_early_event_keeps_open_window():
+    emitted = []
+
+    async def emit(result):
+        emitted.append(result)
+
+    aggregator = WindowAggregator(10, emit, key="sku", lateness=1)
+
+    async def _run():
+        await aggregator.close_windows(now=1001)
+        aggregator.add({"sku": "A"}, 1030)  # 生产者的时钟超前30秒
+        for i in range(5):
+            aggregator.add({"sku": "A"}, 1002 + i)
+        await aggregator.close_windows(now=1011)
+
+    asyncio.run(_run())
+    assert aggregator.early_events == 1
+    assert aggregator.late_events == 0
+    assert emitted == [{"key": "A", "start": 1000, "end": 1010,
+                        "value": 5, "count": 5}]